@@ -0,0 +1,443 @@
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from aiohttp import web
+
+from encoders import FORMATS, available_formats
+from metrics import METRICS
+from timing import TIMING_FORMATS, build_index, export_timing
+from tts_core import (
+    VOICE_CONFIGS,
+    get_available_models,
+    find_voice,
+    generate_audio,
+    generate_mixed_voices_audio,
+    generate_single_voice_with_gaps,
+    stream_single_voice_with_gaps,
+    check_runtime,
+    runtime_info
+)
+from wav_concat import concat_wavs, encode_wav
+
+# API settings
+API_QUEUE_SIZE = int(os.environ.get("API_QUEUE_SIZE", "64"))
+API_WORKERS = int(os.environ.get("API_WORKERS", str(os.cpu_count() or 4)))
+API_MAX_PER_VOICE = int(os.environ.get("API_MAX_PER_VOICE", "2"))
+API_REQUEST_TIMEOUT = float(os.environ.get("API_REQUEST_TIMEOUT", "300"))
+# Streaming: longest wait for the next chunk once audio has started, and
+# chunks buffered for a client that reads slower than they are synthesized
+API_STREAM_IDLE_TIMEOUT = float(os.environ.get("API_STREAM_IDLE_TIMEOUT", "60"))
+API_STREAM_BUFFER_CHUNKS = int(os.environ.get("API_STREAM_BUFFER_CHUNKS", "16"))
+API_MAX_TEXT_LENGTH = int(os.environ.get("API_MAX_TEXT_LENGTH", "100000"))
+
+MODES = ("single", "gaps", "mixed")
+
+
+async def available_models():
+    # The registry may rescan the models directory, which is kept off the
+    # event loop (on the default executor, not behind queued synthesis)
+    return await asyncio.get_running_loop().run_in_executor(None, get_available_models)
+
+
+async def parse_synthesis_request(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+
+    text = body.get("text")
+    if not isinstance(text, str) or not text.strip():
+        raise web.HTTPBadRequest(text="'text' is required")
+    if len(text) > API_MAX_TEXT_LENGTH:
+        raise web.HTTPRequestEntityTooLarge(max_size=API_MAX_TEXT_LENGTH, actual_size=len(text))
+
+    mode = body.get("mode", "single")
+    if mode not in MODES:
+        raise web.HTTPBadRequest(text=f"'mode' must be one of {', '.join(MODES)}")
+
+    try:
+        gap_seconds = min(max(float(body.get("gap_seconds", 1.0)), 0.0), 10.0)
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="'gap_seconds' must be a number")
+
+    audio_format = body.get("format", "wav")
+    if audio_format not in available_formats():
+        raise web.HTTPBadRequest(text=f"'format' must be one of {', '.join(available_formats())}")
+    bitrate_kbps = body.get("bitrate_kbps")
+    if bitrate_kbps is not None:
+        try:
+            bitrate_kbps = min(max(int(bitrate_kbps), 6), 320)
+        except (TypeError, ValueError):
+            raise web.HTTPBadRequest(text="'bitrate_kbps' must be a number")
+
+    # Clean-up of the sentences as they are joined (see concat_wavs);
+    # left out, the AUDIO_* defaults apply
+    postprocess = body.get("postprocess")
+    if postprocess is not None:
+        if not isinstance(postprocess, dict) or not all(
+            key in ("normalize", "trim") and isinstance(value, bool) for key, value in postprocess.items()
+        ):
+            raise web.HTTPBadRequest(text="'postprocess' must be an object with boolean 'normalize' and 'trim'")
+
+    timing_format = body.get("timing")
+    if timing_format is not None:
+        if timing_format not in TIMING_FORMATS:
+            raise web.HTTPBadRequest(text=f"'timing' must be one of {', '.join(TIMING_FORMATS)}")
+        if mode == "single":
+            raise web.HTTPBadRequest(text="'timing' needs the 'gaps' or 'mixed' mode")
+
+    model_info = None
+    if mode != "mixed":
+        model_info = find_voice(await available_models(), body.get("voice"))
+        if model_info is None:
+            raise web.HTTPNotFound(text=f"Voice not found: {body.get('voice')}")
+
+    return {
+        "text": text,
+        "mode": mode,
+        "gap_seconds": gap_seconds,
+        "model_info": model_info,
+        "format": audio_format,
+        "bitrate_kbps": bitrate_kbps,
+        "postprocess": postprocess,
+        "timing": timing_format
+    }
+
+
+def synthesis_runner(params):
+    # Blocking function for the worker pool, returns audio bytes in the
+    # requested format or None. With "timing", the audio comes base64
+    # encoded in a JSON body next to the timing index.
+    text, model_info, gap_seconds = params["text"], params["model_info"], params["gap_seconds"]
+    audio_format, bitrate_kbps, postprocess = params["format"], params["bitrate_kbps"], params["postprocess"]
+
+    def synthesize(cancel_event, timing):
+        if params["mode"] == "single":
+            with METRICS.span("request", model_info["config"]["id"]):
+                return encode_wav(generate_audio(text, model_info), audio_format, bitrate_kbps)
+        if params["mode"] == "gaps":
+            return generate_single_voice_with_gaps(
+                text, model_info, gap_seconds, cancel_event=cancel_event,
+                audio_format=audio_format, bitrate_kbps=bitrate_kbps, postprocess=postprocess, timing=timing
+            )
+        sentence_audios = generate_mixed_voices_audio(text, cancel_event=cancel_event)
+        if not sentence_audios:
+            return None
+        timings = [] if timing is not None else None
+        audio_bytes = concat_wavs(
+            (item["audio"] for item in sentence_audios),
+            gap_seconds=gap_seconds,
+            audio_format=audio_format,
+            bitrate_kbps=bitrate_kbps,
+            postprocess=postprocess,
+            timings=timings
+        )
+        if timing is not None:
+            timing.extend(build_index(text, sentence_audios, timings))
+        return audio_bytes
+
+    def run(cancel_event):
+        timing_format = params["timing"]
+        timing = [] if timing_format else None
+        audio_bytes = synthesize(cancel_event, timing)
+        if not audio_bytes or timing is None:
+            return audio_bytes
+        return json.dumps({
+            "audio": base64.b64encode(audio_bytes).decode("ascii"),
+            "content_type": FORMATS[audio_format]["mime"],
+            "timing_format": timing_format,
+            "timing": json.loads(export_timing(timing, "json")) if timing_format == "json"
+            else export_timing(timing, timing_format)
+        }, ensure_ascii=False).encode("utf-8")
+    return run
+
+
+def voice_key(params):
+    # Mixed mode spreads over every voice, so it isn't limited per voice
+    return params["model_info"]["config"]["id"] if params["model_info"] else None
+
+
+async def submit_job(app, key, run):
+    # Queue a blocking job; raises 429 straight away if the queue is full
+    job = {
+        "key": key,
+        "run": run,
+        "future": asyncio.get_running_loop().create_future(),
+        "cancel_event": threading.Event()
+    }
+    async with app["jobs_changed"]:
+        if len(app["jobs"]) >= API_QUEUE_SIZE:
+            raise web.HTTPTooManyRequests(
+                text="Synthesis queue is full, try again later",
+                headers={"Retry-After": "1"}
+            )
+        app["jobs"].append(job)
+        app["jobs_changed"].notify()
+    return job
+
+
+def cancel_job(job):
+    job["cancel_event"].set()
+    if not job["future"].done():
+        job["future"].cancel()
+
+
+def next_job(app):
+    # Oldest queued job whose voice is below API_MAX_PER_VOICE, so jobs for
+    # a busy voice wait in the queue without holding up other voices. Jobs
+    # whose client timed out or went away are dropped. Caller holds
+    # app["jobs_changed"].
+    jobs, running = app["jobs"], app["voice_running"]
+    for job in list(jobs):
+        if job["future"].done():
+            jobs.remove(job)
+        elif job["key"] is None or running.get(job["key"], 0) < API_MAX_PER_VOICE:
+            jobs.remove(job)
+            if job["key"] is not None:
+                running[job["key"]] = running.get(job["key"], 0) + 1
+            return job
+    return None
+
+
+async def job_worker(app):
+    loop = asyncio.get_running_loop()
+    jobs_changed = app["jobs_changed"]
+    while True:
+        async with jobs_changed:
+            job = None
+            while job is None:
+                job = next_job(app)
+                if job is None:
+                    await jobs_changed.wait()
+        try:
+            result = await loop.run_in_executor(app["executor"], job["run"], job["cancel_event"])
+            if not job["future"].done():
+                job["future"].set_result(result)
+        except Exception as e:
+            if not job["future"].done():
+                job["future"].set_exception(e)
+        finally:
+            async with jobs_changed:
+                if job["key"] is not None:
+                    app["voice_running"][job["key"]] -= 1
+                # A job of this voice may be runnable now
+                jobs_changed.notify_all()
+
+
+async def handle_voices(request):
+    # Installed voices (including ones found in the models directory that
+    # aren't configured), then configured voices that aren't installed
+    installed = await available_models()
+    voices = [
+        {
+            "id": info["config"]["id"],
+            "name": name,
+            "quality": info["config"]["quality"],
+            "gender": info["config"]["gender"],
+            "language": info["language"],
+            "sample_rate": info["sample_rate"],
+            "speakers": list(info["speaker_map"]),
+            "available": True
+        }
+        for name, info in installed.items()
+    ]
+    voices += [
+        {
+            "id": voice["id"],
+            "name": voice["name"],
+            "quality": voice["quality"],
+            "gender": voice["gender"],
+            "available": False
+        }
+        for voice in VOICE_CONFIGS
+        if voice["name"] not in installed
+    ]
+    return web.json_response(voices)
+
+
+async def handle_health(request):
+    return web.json_response({
+        "status": "ok",
+        "queued": len(request.app["jobs"]),
+        "queue_size": API_QUEUE_SIZE,
+        "workers": API_WORKERS,
+        "runtime": runtime_info()
+    })
+
+
+async def handle_metrics(request):
+    # Prometheus text exposition format
+    return web.Response(
+        text=METRICS.to_prometheus(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+
+async def handle_synthesize(request):
+    params = await parse_synthesis_request(request)
+    job = await submit_job(request.app, voice_key(params), synthesis_runner(params))
+    try:
+        audio_bytes = await asyncio.wait_for(asyncio.shield(job["future"]), API_REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        cancel_job(job)
+        raise web.HTTPGatewayTimeout(text="Synthesis timed out")
+    except asyncio.CancelledError:
+        # Client disconnected
+        cancel_job(job)
+        raise
+    if not audio_bytes:
+        raise web.HTTPInternalServerError(text="Failed to generate audio")
+    content_type = "application/json" if params["timing"] else FORMATS[params["format"]]["mime"]
+    return web.Response(body=audio_bytes, content_type=content_type)
+
+
+async def handle_synthesize_stream(request):
+    params = await parse_synthesis_request(request)
+    if params["mode"] == "mixed":
+        raise web.HTTPBadRequest(text="Streaming supports the 'single' and 'gaps' modes")
+    if params["timing"]:
+        raise web.HTTPBadRequest(text="'timing' is only available from POST /synthesize")
+    if not FORMATS[params["format"]]["streamable"]:
+        streamable = [name for name in available_formats() if FORMATS[name]["streamable"]]
+        raise web.HTTPBadRequest(text=f"Streaming supports the {', '.join(streamable)} formats")
+
+    loop = asyncio.get_running_loop()
+    # Bounded, so a slow client holds up synthesis instead of the whole
+    # document piling up in memory
+    chunks = asyncio.Queue(maxsize=max(1, API_STREAM_BUFFER_CHUNKS))
+    text, model_info = params["text"], params["model_info"]
+
+    def put(chunk, cancel_event):
+        # From the worker thread: wait for room in the queue, giving up
+        # once the request is cancelled
+        future = asyncio.run_coroutine_threadsafe(chunks.put(chunk), loop)
+        while True:
+            try:
+                future.result(timeout=1.0)
+                return True
+            except FutureTimeoutError:
+                if cancel_event.is_set():
+                    future.cancel()
+                    return False
+
+    def run(cancel_event):
+        # Ends the queue with None, or with the exception synthesis failed
+        # with, which is how the handler learns about it (the job's future
+        # isn't awaited)
+        generator = None
+        error = None
+        try:
+            if params["mode"] == "gaps":
+                generator = stream_single_voice_with_gaps(
+                    text, model_info, params["gap_seconds"], cancel_event=cancel_event,
+                    audio_format=params["format"], bitrate_kbps=params["bitrate_kbps"],
+                    postprocess=params["postprocess"]
+                )
+            else:
+                # Single mode isn't split into sentences, the whole file is one chunk
+                audio_bytes = encode_wav(generate_audio(text, model_info), params["format"], params["bitrate_kbps"])
+                generator = iter([audio_bytes] if audio_bytes else [])
+            for chunk in generator:
+                if cancel_event.is_set() or not put(bytes(chunk), cancel_event):
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            if hasattr(generator, "close"):
+                generator.close()
+            if not cancel_event.is_set():
+                put(error, cancel_event)
+
+    job = await submit_job(request.app, voice_key(params), run)
+    response = None
+    try:
+        while True:
+            # Until the first audio the request may still be queued; after
+            # that, only a stall between chunks counts
+            timeout = API_REQUEST_TIMEOUT if response is None else API_STREAM_IDLE_TIMEOUT
+            chunk = await asyncio.wait_for(chunks.get(), timeout)
+            if chunk is None:
+                break
+            if isinstance(chunk, Exception):
+                if response is None:
+                    raise web.HTTPInternalServerError(text=str(chunk) or "Failed to generate audio")
+                # The status is gone already: cut the connection rather
+                # than end a truncated file as if it were complete
+                if request.transport is not None:
+                    request.transport.close()
+                return response
+            if response is None:
+                # Headers go out with the first audio, so failures before
+                # that can still be reported with a proper status
+                response = web.StreamResponse(headers={
+                    "Content-Type": FORMATS[params["format"]]["mime"],
+                    "Cache-Control": "no-store"
+                })
+                response.enable_chunked_encoding()
+                await response.prepare(request)
+            await response.write(chunk)
+    except asyncio.TimeoutError:
+        cancel_job(job)
+        if response is None:
+            raise web.HTTPGatewayTimeout(text="Synthesis timed out")
+        return response
+    except (asyncio.CancelledError, ConnectionResetError):
+        cancel_job(job)
+        raise
+
+    if response is None:
+        raise web.HTTPInternalServerError(text="Failed to generate audio")
+    await response.write_eof()
+    return response
+
+
+async def start_workers(app):
+    app["jobs"] = deque()
+    app["jobs_changed"] = asyncio.Condition()
+    app["voice_running"] = {}
+    app["executor"] = ThreadPoolExecutor(max_workers=API_WORKERS)
+    app["workers"] = [asyncio.create_task(job_worker(app)) for _ in range(API_WORKERS)]
+
+
+async def stop_workers(app):
+    for task in app["workers"]:
+        task.cancel()
+    await asyncio.gather(*app["workers"], return_exceptions=True)
+    app["executor"].shutdown(wait=False, cancel_futures=True)
+
+
+def make_app():
+    app = web.Application()
+    app.router.add_get("/voices", handle_voices)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_post("/synthesize", handle_synthesize)
+    app.router.add_post("/synthesize/stream", handle_synthesize_stream)
+    app.on_startup.append(start_workers)
+    app.on_cleanup.append(stop_workers)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP API for Piper text-to-speech")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    runtime_error = check_runtime()
+    if runtime_error:
+        sys.exit(runtime_error)
+    web.run_app(make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,82 +1,28 @@
 import streamlit as st
-import tempfile
 import os
-import subprocess
-from pathlib import Path
-import time
-import re
-import random
-import wave
-import io
-import numpy as np
-from scipy.io import wavfile
-
-# Voice configurations
-VOICE_CONFIGS = [
-    {
-        "id": "en_US-hfc_female-medium",
-        "name": "HFC Female (Medium)",
-        "file": "en_US-hfc_female-medium.onnx",
-        "quality": "medium",
-        "gender": "female"
-    },
-    {
-        "id": "en_US-ljspeech-high",
-        "name": "LJSpeech (High)",
-        "file": "en_US-ljspeech-high.onnx",
-        "quality": "high",
-        "gender": "female"
-    },
-    {
-        "id": "en_GB-cori-high",
-        "name": "Cori (High)",
-        "file": "en_GB-cori-high.onnx",
-        "quality": "high",
-        "gender": "female"
-    },
-    {
-        "id": "en_US-amy-medium",
-        "name": "Amy (Medium)",
-        "file": "en_US-amy-medium.onnx",
-        "quality": "medium",
-        "gender": "female"
-    },
-    {
-        "id": "en_US-bryce-medium",
-        "name": "Bryce (Medium)",
-        "file": "en_US-bryce-medium.onnx",
-        "quality": "medium",
-        "gender": "male"
-    },
-    {
-        "id": "en_US-danny-low",
-        "name": "Danny (Low)",
-        "file": "en_US-danny-low.onnx",
-        "quality": "low",
-        "gender": "male"
-    },
-    {
-        "id": "en_US-hfc_male-medium",
-        "name": "HFC Male (Medium)",
-        "file": "en_US-hfc_male-medium.onnx",
-        "quality": "medium",
-        "gender": "male"
-    },
-    {
-        "id": "en_US-lessac-high",
-        "name": "Lessac (High)",
-        "file": "en_US-lessac-high.onnx",
-        "quality": "high",
-        "gender": "female"
-    },
-    {
-        "id": "en_US-ryan-high",
-        "name": "Ryan (High)",
-        "file": "en_US-ryan-high.onnx",
-        "quality": "high",
-        "gender": "male"
-    }
-]
+import secrets
+from collections import defaultdict
+from long_jobs import create_job, delete_job, get_job, list_jobs
+from metrics import METRICS
+from stream_server import AudioStreamServer
+from encoders import FORMATS, OUTPUT_BITRATE_KBPS, OUTPUT_FORMAT, available_formats
+from postprocess import AUDIO_NORMALIZE, AUDIO_TRIM_SILENCE
+from timing import TIMING_FORMATS, build_index, export_timing
+from wav_concat import concat_wavs, encode_wav
+from tts_core import (
+    get_audio_store,
+    get_available_models,
+    get_synthesis_cache,
+    get_prefetcher,
+    prefetch_text,
+    runtime_info,
+    generate_audio,
+    iter_generate_all_voices,
+    generate_mixed_voices_audio,
+    generate_single_voice_with_gaps,
+    stream_single_voice_with_gaps,
+    check_runtime
+)
 
 st.set_page_config(
     page_title="Piper Text-to-Speech",
@@ -210,180 +156,140 @@ st.markdown("""
 
 st.markdown("<h1 class='main-header'>🔊 Piper Text-to-Speech</h1>", unsafe_allow_html=True)
 
-# Model paths
-PIPER_DIR = Path("C:/piper")
-MODELS_DIR = PIPER_DIR / "models"
-
-# Get available models
-def get_available_models():
-    available_models = {}
-    
-    # Check models directory
-    if MODELS_DIR.exists():
-        for voice in VOICE_CONFIGS:
-            model_path = MODELS_DIR / voice["file"]
-            json_path = model_path.with_suffix('.onnx.json')
-            if model_path.exists() and json_path.exists():
-                available_models[voice["name"]] = {
-                    "path": model_path,
-                    "config": voice
-                }
-    
-    return available_models
-
-def generate_audio(text, model_info):
+# Streaming playback server settings
+STREAM_SERVER_HOST = os.environ.get("STREAM_SERVER_HOST", "127.0.0.1")
+STREAM_SERVER_PORT = int(os.environ.get("STREAM_SERVER_PORT", "8599"))
+# Memory for the audio of streams that are still being synthesized; finished
+# streams move to the audio store
+STREAM_MAX_BUFFER_MB = int(os.environ.get("STREAM_MAX_BUFFER_MB", "64"))
+# Finished audio is only played by URL from the stream server when the
+# browser is known to reach it; otherwise it goes through st.audio
+STREAM_PUBLIC_URL = os.environ.get("STREAM_PUBLIC_URL")
+# Audio larger than this isn't sent through st.audio on every rerun, it is
+# played from the stream server on localhost instead
+STREAM_INLINE_MAX_MB = int(os.environ.get("STREAM_INLINE_MAX_MB", "16"))
+
+@st.cache_resource
+def get_stream_server():
     try:
-        # Create a temporary file for the output
-        temp_dir = Path(tempfile.gettempdir())
-        output_file = temp_dir / f"output_{int(time.time())}_{model_info['config']['id']}.wav"
-        
-        # Prepare piper command
-        piper_cmd = [
-            str(PIPER_DIR / "piper.exe"),
-            "--model", str(model_info["path"]),
-            "--output_file", str(output_file),
-            "--json_config", str(model_info["path"].with_suffix('.onnx.json'))
-        ]
-        
-        # Create process
-        process = subprocess.Popen(
-            piper_cmd,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=str(PIPER_DIR)
+        return AudioStreamServer(
+            STREAM_SERVER_HOST, STREAM_SERVER_PORT, public_url=STREAM_PUBLIC_URL, audio_store=get_audio_store(),
+            max_buffered_bytes=STREAM_MAX_BUFFER_MB * 1024 * 1024
         )
-        
-        # Send text directly to stdin
-        stdout, stderr = process.communicate(input=text)
-        
-        if process.returncode == 0 and output_file.exists():
-            return output_file.read_bytes()
-        return None
-    except Exception as e:
+    except OSError:
+        # Port already taken, streaming playback is unavailable
         return None
 
-def split_into_sentences(text):
-    # Split text into sentences using regex
-    sentences = re.split(r'(?<=[.!?])\s+', text.strip())
-    # Remove empty sentences
-    return [s for s in sentences if s.strip()]
+# Session audio lives in the shared audio store; st.session_state only keeps
+# handles (in place of the WAV bytes, or under "handle" in result entries)
+def release_audio(value):
+    # Free the store blobs behind a session value that is being replaced
+    store = get_audio_store()
+    if isinstance(value, str):
+        store.discard(value)
+    elif isinstance(value, dict):
+        for entry in value.values():
+            store.discard(entry["handle"])
+    elif isinstance(value, list):
+        for entry in value:
+            store.discard(entry["handle"])
+
+def keep_audio(key, value):
+    # Replace a session value, releasing the audio of the old one
+    release_audio(st.session_state.get(key))
+    st.session_state[key] = value
+
+def drop_audio(key):
+    release_audio(st.session_state.pop(key, None))
+
+def timing_downloads(index, file_name, key):
+    # Sentence/word timings of generated audio as subtitle and JSON files.
+    # A format is only exported when its button is clicked (not on every
+    # rerun) and is then offered for download until the index changes.
+    columns = st.columns(len(TIMING_FORMATS))
+    for column, timing_format in zip(columns, TIMING_FORMATS):
+        with column:
+            if st.button(f"⏱️ {timing_format.upper()}", key=f"{key}_{timing_format}", use_container_width=True):
+                st.session_state[f"{key}_export"] = {
+                    "index": index,
+                    "format": timing_format,
+                    "data": export_timing(index, timing_format)
+                }
+    export = st.session_state.get(f"{key}_export")
+    if export is not None and export["index"] is index:
+        info = TIMING_FORMATS[export["format"]]
+        st.download_button(
+            f"⬇️ Download {export['format'].upper()}",
+            export["data"],
+            file_name=f"{file_name}.{info['extension']}",
+            mime=info["mime"],
+            key=f"{key}_download",
+            use_container_width=True
+        )
+
+def stream_server_for(size):
+    # The stream server, if audio of `size` bytes is played from it: always
+    # with STREAM_PUBLIC_URL set, otherwise only past STREAM_INLINE_MAX_MB
+    if STREAM_PUBLIC_URL or size > STREAM_INLINE_MAX_MB * 1024 * 1024:
+        return get_stream_server()
+    return None
+
+def show_player(url, size, load, content_type, key):
+    # An <audio> element for the URL, or st.audio with the bytes from load()
+    if url is not None:
+        st.markdown(
+            f"<audio class='stAudio' controls preload='metadata' src='{url}'></audio>",
+            unsafe_allow_html=True
+        )
+        if not STREAM_PUBLIC_URL:
+            st.caption("Played from the stream server on this machine; set STREAM_PUBLIC_URL if the browser runs elsewhere.")
+        return
+    if size > STREAM_INLINE_MAX_MB * 1024 * 1024 and not st.session_state.get(f"{key}_inline"):
+        # No stream server to play it from: only load it into the page on request
+        st.caption(f"This audio is {size / 1e6:.0f} MB, too large to load into the page by default.")
+        if st.button("▶️ Load into the page", key=f"{key}_inline_button"):
+            st.session_state[f"{key}_inline"] = True
+            st.rerun()
+        return
+    st.audio(load(), format=content_type)
+
+def play_audio(handle):
+    # Small audio goes through st.audio; large audio, or any with
+    # STREAM_PUBLIC_URL set, is played by URL from the stream server so
+    # reruns don't send it through Streamlit again
+    store = get_audio_store()
+    size = store.size(handle)
+    if size is None:
+        st.caption("⌛ This audio was removed to free memory, please generate it again.")
+        return
+    stream_server = stream_server_for(size)
+    show_player(
+        stream_server.audio_url(handle) if stream_server is not None else None,
+        size, lambda: store.get(handle), store.content_type(handle), f"play_{handle}"
+    )
 
-def generate_mixed_voices_audio(text):
-    sentences = split_into_sentences(text)
-    if not sentences:
-        return None
-    
-    # Get list of available models in the same order as VOICE_CONFIGS
-    available_models = get_available_models()
-    ordered_models = []
-    for voice in VOICE_CONFIGS:
-        if voice["name"] in available_models:
-            ordered_models.append((voice["name"], available_models[voice["name"]]))
-    
-    if not ordered_models:
-        return None
-    
-    # Generate audio for each sentence with voices in sequence
-    sentence_audios = []
+def progress_callback():
+    # on_progress callback that drives a new progress bar
     progress_bar = st.progress(0)
-    
-    for i, sentence in enumerate(sentences):
-        # Use voice in sequence, loop back to start if needed
-        voice_index = i % len(ordered_models)
-        voice_name, voice_info = ordered_models[voice_index]
-        
-        # Generate audio for this sentence
-        audio_bytes = generate_audio(sentence, voice_info)
-        if audio_bytes:
-            sentence_audios.append({
-                "sentence": sentence,
-                "audio": audio_bytes,
-                "voice": voice_name,
-                "config": voice_info["config"]
-            })
-        progress_bar.progress((i + 1) / len(sentences))
-    
-    return sentence_audios
+    return lambda completed, total: progress_bar.progress(completed / total)
 
-def create_silence(duration_seconds, sample_rate, num_channels):
-    # Create silence as a numpy array
-    num_samples = int(duration_seconds * sample_rate)
-    return np.zeros(num_samples * num_channels, dtype=np.int16)
+def prefetch_current_text():
+    # Synthesize the finished sentences for the selected voice in the
+    # background, so the generate buttons mostly find them in the cache
+    text = st.session_state.get("text_input")
+    model_info = get_available_models().get(st.session_state.get("selected_voice"))
+    if text and model_info is not None:
+        owner = st.session_state.setdefault("prefetch_owner", secrets.token_urlsafe(8))
+        prefetch_text(owner, text, model_info)
 
-def generate_single_voice_with_gaps(text, model_info):
-    try:
-        sentences = split_into_sentences(text)
-        if not sentences:
-            return None
-            
-        # Generate audio for each sentence
-        audio_segments = []
-        progress_bar = st.progress(0)
-        
-        for i, sentence in enumerate(sentences):
-            audio_bytes = generate_audio(sentence, model_info)
-            if audio_bytes:
-                with io.BytesIO(audio_bytes) as bio:
-                    with wave.open(bio, 'rb') as wav:
-                        if not audio_segments:  # First segment
-                            target_sample_rate = wav.getframerate()
-                            target_channels = wav.getnchannels()
-                            target_sampwidth = wav.getsampwidth()
-                        frames = wav.readframes(wav.getnframes())
-                        audio_segments.append({
-                            'frames': frames,
-                            'sample_rate': wav.getframerate(),
-                            'channels': wav.getnchannels(),
-                            'sampwidth': wav.getsampwidth()
-                        })
-            progress_bar.progress((i + 1) / len(sentences))
-        
-        if not audio_segments:
-            return None
-            
-        # Create output wave file with gaps
-        output_bytes = io.BytesIO()
-        with wave.open(output_bytes, 'wb') as output:
-            output.setnchannels(target_channels)
-            output.setsampwidth(target_sampwidth)
-            output.setframerate(target_sample_rate)
-            
-            # Create 1-second silence
-            silence = create_silence(1.0, target_sample_rate, target_channels)
-            
-            # Write each audio segment with silence in between
-            for i, segment in enumerate(audio_segments):
-                # Convert frames to numpy array
-                audio_data = np.frombuffer(segment['frames'], dtype=np.int16)
-                
-                # If sample rates don't match, we need to resample
-                if segment['sample_rate'] != target_sample_rate:
-                    ratio = target_sample_rate / segment['sample_rate']
-                    new_length = int(len(audio_data) * ratio)
-                    indices = np.linspace(0, len(audio_data) - 1, new_length)
-                    audio_data = np.interp(indices, np.arange(len(audio_data)), audio_data)
-                
-                # Write the audio segment
-                output.writeframes(audio_data.astype(np.int16).tobytes())
-                
-                # Add silence after each segment except the last one
-                if i < len(audio_segments) - 1:
-                    output.writeframes(silence.tobytes())
-        
-        return output_bytes.getvalue()
-    except Exception as e:
-        st.error(f"Error: {str(e)}")
-        return None
+def on_text_change():
+    st.session_state.current_text = st.session_state.text_input
+    prefetch_current_text()
 
 # Verify piper installation
-if not PIPER_DIR.exists():
-    st.error(f"Piper directory not found at {PIPER_DIR}")
-    st.stop()
-
-if not (PIPER_DIR / "piper.exe").exists():
-    st.error(f"Piper executable not found at {PIPER_DIR / 'piper.exe'}")
+runtime_error = check_runtime()
+if runtime_error:
+    st.error(runtime_error)
     st.stop()
 
 # Sidebar for model selection
@@ -399,6 +305,8 @@ with st.sidebar:
         "Select Voice",
         options=list(available_models.keys()),
         help="Choose a voice model for text-to-speech conversion",
+        key="selected_voice",
+        on_change=prefetch_current_text,
         index=list(available_models.keys()).index("HFC Female (Medium)" if "HFC Female (Medium)" in available_models else 0)
     )
     
@@ -408,30 +316,58 @@ with st.sidebar:
     st.markdown(f"""
     <div class='voice-info'>
     ✨ **Quality:** {model_info['config']['quality'].title()}<br>
-    👤 **Gender:** {model_info['config']['gender'].title()}
+    👤 **Gender:** {model_info['config']['gender'].title()}<br>
+    🌐 **Language:** {model_info['language']} • {model_info['sample_rate'] / 1000:g} kHz
     </div>
     """, unsafe_allow_html=True)
     
     st.markdown("---")
     
+    # Format of the generated audio; the cache and the per-sentence clips
+    # of "Mix Voices per Sentence" stay WAV
+    formats = available_formats()
+    output_format = st.selectbox(
+        "Output Format",
+        options=formats,
+        index=formats.index(OUTPUT_FORMAT) if OUTPUT_FORMAT in formats else 0,
+        format_func=lambda name: name.upper(),
+        help="Opus and MP3 are 5-10x smaller than WAV; FLAC is lossless" if len(formats) > 1
+        else "Install soundfile for Opus, MP3 and FLAC output"
+    )
+    output_bitrate = None
+    if output_format in OUTPUT_BITRATE_KBPS:
+        output_bitrate = st.select_slider(
+            "Bitrate (kbps)",
+            options=sorted({16, 24, 32, 48, 64, 96, 128, 160, 192, OUTPUT_BITRATE_KBPS[output_format]}),
+            value=OUTPUT_BITRATE_KBPS[output_format],
+            key=f"bitrate_{output_format}"
+        )
+    output_mime = FORMATS[output_format]["mime"]
+    
+    # Clean-up of the sentences as they are joined
+    gap_seconds = st.slider("Gap between sentences (s)", 0.0, 3.0, 1.0, 0.1)
+    postprocess = {
+        "normalize": st.checkbox(
+            "Normalize loudness",
+            value=AUDIO_NORMALIZE,
+            help="Bring every sentence and voice to the same loudness"
+        ),
+        "trim": st.checkbox(
+            "Trim silence",
+            value=AUDIO_TRIM_SILENCE,
+            help="Cut the silence piper leaves before and after each sentence, so only the gap remains"
+        )
+    }
+    
+    st.markdown("---")
+    
     st.markdown("### 🎯 Actions")
     
     # Generate in all voices button
     if st.button("🎭 Generate in All Voices", use_container_width=True):
         if 'current_text' in st.session_state and st.session_state.current_text:
-            with st.spinner("Generating audio in all voices..."):
-                all_audios = {}
-                progress_bar = st.progress(0)
-                for i, (name, info) in enumerate(available_models.items()):
-                    audio_bytes = generate_audio(st.session_state.current_text, info)
-                    if audio_bytes:
-                        all_audios[name] = {
-                            "audio": audio_bytes,
-                            "config": info["config"]
-                        }
-                    progress_bar.progress((i + 1) / len(available_models))
-                st.session_state.all_voices_audio = all_audios
-                st.success(f"Generated audio in {len(all_audios)} voices!")
+            # Generated in the All Voices section so each card shows up as soon as its voice is done
+            st.session_state.all_voices_request = st.session_state.current_text
         else:
             st.warning("Please enter text first!")
     
@@ -439,28 +375,100 @@ with st.sidebar:
     if st.button("🎲 Mix Voices per Sentence", use_container_width=True):
         if 'current_text' in st.session_state and st.session_state.current_text:
             with st.spinner("Generating audio with mixed voices..."):
-                sentence_audios = generate_mixed_voices_audio(st.session_state.current_text)
+                sentence_audios = generate_mixed_voices_audio(
+                    st.session_state.current_text,
+                    on_progress=progress_callback()
+                )
                 if sentence_audios:
-                    st.session_state.mixed_voices_audio = sentence_audios
+                    store = get_audio_store()
+                    # Sentence offsets point into this text, for the timings of the joined audio
+                    st.session_state.mixed_voices_text = st.session_state.current_text
+                    keep_audio('mixed_voices_audio', [
+                        {**{k: v for k, v in item.items() if k != "audio"}, "handle": store.put(item["audio"])}
+                        for item in sentence_audios
+                    ])
                     st.success(f"Generated audio for {len(sentence_audios)} sentences!")
                 else:
                     st.error("Failed to generate mixed voices audio.")
         else:
             st.warning("Please enter text first!")
     
+    stream_playback = st.checkbox(
+        "📡 Stream playback",
+        help="Start playing 'Generate with Gaps' audio as soon as the first sentence is ready"
+    )
+    
     # Generate with single voice and gaps button
     if st.button("🎵 Generate with Gaps", use_container_width=True):
         if 'current_text' in st.session_state and st.session_state.current_text:
-            with st.spinner("Generating audio with gaps..."):
-                joined_audio = generate_single_voice_with_gaps(st.session_state.current_text, model_info)
-                if joined_audio:
-                    st.session_state.joined_audio = joined_audio
-                    st.success("Audio generated successfully!")
-                else:
-                    st.error("Failed to generate audio.")
+            stream_server = get_stream_server() if stream_playback else None
+            if stream_playback and stream_server is None:
+                st.warning(f"Streaming server could not start on port {STREAM_SERVER_PORT}.")
+            if stream_server is not None:
+                text_to_stream = st.session_state.current_text
+                # Formats that rewrite their header when done are streamed as WAV
+                stream_format = output_format if FORMATS[output_format]["streamable"] else "wav"
+                st.session_state.stream_url = stream_server.register(
+                    lambda: stream_single_voice_with_gaps(
+                        text_to_stream, model_info, gap_seconds, audio_format=stream_format,
+                        bitrate_kbps=output_bitrate, postprocess=postprocess
+                    ),
+                    content_type=FORMATS[stream_format]["mime"]
+                )
+                drop_audio('joined_audio')
+                st.session_state.pop('joined_timing', None)
+                st.success("Streaming started!")
+            else:
+                with st.spinner("Generating audio with gaps..."):
+                    timing = []
+                    try:
+                        joined_audio = generate_single_voice_with_gaps(
+                            st.session_state.current_text,
+                            model_info,
+                            gap_seconds,
+                            on_progress=progress_callback(),
+                            audio_format=output_format,
+                            bitrate_kbps=output_bitrate,
+                            postprocess=postprocess,
+                            timing=timing
+                        )
+                    except Exception as e:
+                        st.error(f"Error: {str(e)}")
+                        joined_audio = None
+                    if joined_audio:
+                        keep_audio('joined_audio', get_audio_store().put(joined_audio, output_mime))
+                        st.session_state.joined_timing = timing
+                        st.session_state.pop('stream_url', None)
+                        st.success("Audio generated successfully!")
+                    else:
+                        st.error("Failed to generate audio.")
         else:
             st.warning("Please enter text first!")
     
+    # Synthesis cache counters
+    cache_stats = get_synthesis_cache().stats()
+    st.caption(
+        f"🗄️ Cache: {cache_stats['memory_hits'] + cache_stats['disk_hits']} hits / "
+        f"{cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%}), "
+        f"{cache_stats['memory_bytes'] / 1e6:.1f} MB in memory, "
+        f"{cache_stats['disk_bytes'] / 1e6:.1f} MB on disk"
+    )
+    prefetch_owner = st.session_state.get("prefetch_owner")
+    prefetching = get_prefetcher().pending(prefetch_owner) if prefetch_owner else 0
+    if prefetching:
+        st.caption(f"⏳ Preparing {prefetching} sentences in the background")
+    runtime = runtime_info()
+    if runtime["binary"]:
+        tested = next((result for result in runtime["self_test"] if result["name"] == runtime["binary"]), None)
+        speed = f", {1 / tested['real_time_factor']:.0f}x real time" if tested else ""
+        st.caption(f"⚙️ Piper: {runtime['binary']} on {runtime['host']}{speed}")
+    store_stats = get_audio_store().stats()
+    st.caption(
+        f"💾 Session audio (all users): {store_stats['memory_entries'] + store_stats['disk_entries']} clips, "
+        f"{store_stats['memory_bytes'] / 1e6:.1f} MB in memory, "
+        f"{store_stats['disk_bytes'] / 1e6:.1f} MB on disk"
+    )
+    
     st.markdown("---")
     st.markdown("""
     <div class='about-section'>
@@ -483,16 +491,18 @@ text_input = st.text_area(
     height=200,
     help="Enter the text you want to convert to speech",
     key="text_input",
-    on_change=lambda: setattr(st.session_state, 'current_text', st.session_state.text_input)
+    on_change=on_text_change
 )
 
 if st.button("🔊 Generate Audio", type="primary", use_container_width=True):
     if text_input:
         try:
-            with st.spinner("Generating audio..."):
+            with st.spinner("Generating audio..."), METRICS.span("request", model_info["config"]["id"]):
                 audio_bytes = generate_audio(text_input, model_info)
                 if audio_bytes:
-                    st.session_state.last_audio = audio_bytes
+                    keep_audio('last_audio', get_audio_store().put(
+                        encode_wav(audio_bytes, output_format, output_bitrate), output_mime
+                    ))
                     st.session_state.last_text = text_input
                     st.session_state.last_model = model_info["config"]
                     st.success("Audio generated successfully!")
@@ -506,25 +516,56 @@ if st.button("🔊 Generate Audio", type="primary", use_container_width=True):
 # Single audio output section
 if 'last_audio' in st.session_state:
     st.markdown("<h3 class='section-header'>🎵 Generated Audio</h3>", unsafe_allow_html=True)
-    st.audio(st.session_state.last_audio, format="audio/wav")
+    play_audio(st.session_state.last_audio)
 
 # All voices output section
-if 'all_voices_audio' in st.session_state and st.session_state.all_voices_audio:
+def render_voice_card(voice_name, voice_data):
+    st.markdown("<div class='voice-card'>", unsafe_allow_html=True)
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.markdown(f"""
+        <p class='voice-name'>{voice_name}</p>
+        <p class='voice-quality'>✨ {voice_data['config']['quality'].title()} Quality<br>
+        👤 {voice_data['config']['gender'].title()}</p>
+        """, unsafe_allow_html=True)
+    with col2:
+        play_audio(voice_data["handle"])
+    st.markdown("</div>", unsafe_allow_html=True)
+
+if st.session_state.get('all_voices_request'):
+    all_voices_text = st.session_state.pop('all_voices_request')
+    st.markdown("<h3 class='section-header'>🎭 All Voices</h3>", unsafe_allow_html=True)
+    
+    with st.spinner("Generating audio in all voices..."):
+        # Every handle goes into the session as soon as it is stored, so a
+        # rerun or stop halfway still releases it with the next results
+        keep_audio('all_voices_audio', {})
+        all_audios = st.session_state.all_voices_audio
+        failed_voices = []
+        progress_bar = st.progress(0)
+        # Voices run concurrently; render each card as soon as its voice finishes
+        for i, (name, info, audio_bytes) in enumerate(iter_generate_all_voices(all_voices_text, available_models)):
+            if audio_bytes:
+                all_audios[name] = {
+                    "handle": get_audio_store().put(encode_wav(audio_bytes, output_format, output_bitrate), output_mime),
+                    "config": info["config"]
+                }
+                render_voice_card(name, all_audios[name])
+            else:
+                failed_voices.append(name)
+            progress_bar.progress((i + 1) / len(available_models))
+    
+    # Keep the usual voice order for later reruns
+    st.session_state.all_voices_audio = {name: all_audios[name] for name in available_models if name in all_audios}
+    st.success(f"Generated audio in {len(all_audios)} voices!")
+    if failed_voices:
+        st.warning(f"Failed to generate audio for: {', '.join(failed_voices)}")
+elif 'all_voices_audio' in st.session_state and st.session_state.all_voices_audio:
     st.markdown("<h3 class='section-header'>🎭 All Voices</h3>", unsafe_allow_html=True)
     
     # Create a table for all voices
     for voice_name, voice_data in st.session_state.all_voices_audio.items():
-        st.markdown("<div class='voice-card'>", unsafe_allow_html=True)
-        col1, col2 = st.columns([1, 3])
-        with col1:
-            st.markdown(f"""
-            <p class='voice-name'>{voice_name}</p>
-            <p class='voice-quality'>✨ {voice_data['config']['quality'].title()} Quality<br>
-            👤 {voice_data['config']['gender'].title()}</p>
-            """, unsafe_allow_html=True)
-        with col2:
-            st.audio(voice_data["audio"], format="audio/wav")
-        st.markdown("</div>", unsafe_allow_html=True)
+        render_voice_card(voice_name, voice_data)
 
 # Mixed voices output section
 if 'mixed_voices_audio' in st.session_state and st.session_state.mixed_voices_audio:
@@ -542,75 +583,206 @@ if 'mixed_voices_audio' in st.session_state and st.session_state.mixed_voices_au
             <p class='voice-quality'>{sentence_data['config']['quality'].title()} • {sentence_data['config']['gender'].title()}</p>
             """, unsafe_allow_html=True)
         with col2:
-            st.audio(sentence_data['audio'], format="audio/wav")
+            play_audio(sentence_data['handle'])
         # st.markdown("</div>", unsafe_allow_html=True)
     
     # Join audio button
     if st.button("🔗 Join All Audio", type="primary", use_container_width=True):
-        try:
-            with st.spinner("Joining audio files..."):
-                # Read all audio files and their parameters
-                audio_segments = []
-                target_sample_rate = None
-                
-                # First pass: read all files and determine target sample rate
-                for sentence_data in st.session_state.mixed_voices_audio:
-                    with io.BytesIO(sentence_data['audio']) as bio:
-                        with wave.open(bio, 'rb') as wav:
-                            if target_sample_rate is None:
-                                target_sample_rate = wav.getframerate()
-                                target_channels = wav.getnchannels()
-                                target_sampwidth = wav.getsampwidth()
-                            
-                            # Read the frames
-                            frames = wav.readframes(wav.getnframes())
-                            audio_segments.append({
-                                'frames': frames,
-                                'sample_rate': wav.getframerate(),
-                                'channels': wav.getnchannels(),
-                                'sampwidth': wav.getsampwidth()
-                            })
-                
-                # Create output wave file
-                output_bytes = io.BytesIO()
-                with wave.open(output_bytes, 'wb') as output:
-                    output.setnchannels(target_channels)
-                    output.setsampwidth(target_sampwidth)
-                    output.setframerate(target_sample_rate)
-                    
-                    # Create 2-second silence
-                    silence = create_silence(1.0, target_sample_rate, target_channels)
-                    
-                    # Write each audio segment with silence in between
-                    for i, segment in enumerate(audio_segments):
-                        # Convert frames to numpy array
-                        audio_data = np.frombuffer(segment['frames'], dtype=np.int16)
-                        
-                        # If sample rates don't match, we need to resample
-                        if segment['sample_rate'] != target_sample_rate:
-                            # Calculate resampling ratio
-                            ratio = target_sample_rate / segment['sample_rate']
-                            new_length = int(len(audio_data) * ratio)
-                            # Resample using numpy
-                            indices = np.linspace(0, len(audio_data) - 1, new_length)
-                            audio_data = np.interp(indices, np.arange(len(audio_data)), audio_data)
-                        
-                        # Write the audio segment
-                        output.writeframes(audio_data.astype(np.int16).tobytes())
-                        
-                        # Add silence after each segment except the last one
-                        if i < len(audio_segments) - 1:
-                            output.writeframes(silence.tobytes())
+        store = get_audio_store()
+        # concat_wavs skips missing audio, which would leave sentences out
+        # of the file and its timing without a word
+        missing = [
+            number for number, sentence_data in enumerate(st.session_state.mixed_voices_audio, 1)
+            if sentence_data['handle'] not in store
+        ]
+
+        def sentence_audios():
+            for sentence_data in st.session_state.mixed_voices_audio:
+                audio = store.get(sentence_data['handle'])
+                if audio is None:
+                    raise LookupError("a sentence was removed to free memory while joining, please generate again")
+                yield audio
+
+        if missing:
+            st.error(
+                f"{'Sentences' if len(missing) > 1 else 'Sentence'} {', '.join(map(str, missing))} "
+                f"{'were' if len(missing) > 1 else 'was'} removed to free memory. "
+                "Please generate the mixed voices again before joining."
+            )
+        else:
+            try:
+                with st.spinner("Joining audio files..."):
+                    timings = []
+                    joined_audio = concat_wavs(
+                        sentence_audios(),
+                        gap_seconds=gap_seconds,
+                        audio_format=output_format,
+                        bitrate_kbps=output_bitrate,
+                        postprocess=postprocess,
+                        timings=timings
+                    )
                 
-                # Store the joined audio in session state
-                st.session_state.joined_audio = output_bytes.getvalue()
-                st.success("Audio files joined successfully!")
-        except Exception as e:
-            st.error(f"Failed to join audio files: {str(e)}")
+                    # Store the joined audio in session state
+                    keep_audio('joined_audio', store.put(joined_audio, output_mime))
+                    st.session_state.joined_timing = build_index(
+                        st.session_state.get('mixed_voices_text', ""), st.session_state.mixed_voices_audio, timings
+                    )
+                    st.success("Audio files joined successfully!")
+            except Exception as e:
+                st.error(f"Failed to join audio files: {str(e)}")
+
+# Streaming audio output section
+if 'stream_url' in st.session_state:
+    st.markdown("<h3 class='section-header'>📡 Streaming Audio</h3>", unsafe_allow_html=True)
+    st.markdown(
+        f"<audio class='stAudio' controls autoplay preload='auto' src='{st.session_state.stream_url}'></audio>",
+        unsafe_allow_html=True
+    )
 
 # Joined audio output section
 if 'joined_audio' in st.session_state:
     st.markdown("<h3 class='section-header'>🎵 Complete Audio</h3>", unsafe_allow_html=True)
     # st.markdown("<div class='voice-card'>", unsafe_allow_html=True)
-    st.audio(st.session_state.joined_audio, format="audio/wav")
-    # st.markdown("</div>", unsafe_allow_html=True) 
\ No newline at end of file
+    play_audio(st.session_state.joined_audio)
+    # st.markdown("</div>", unsafe_allow_html=True) 
+    if st.session_state.get('joined_timing'):
+        st.caption("Sentence and word timings (word times are estimated from the text):")
+        timing_downloads(st.session_state.joined_timing, "complete_audio", "joined_timing")
+
+# Long documents: rendered chunk by chunk into a file on disk, with progress
+# saved after every chunk, so nothing piles up in session memory and an
+# interrupted job resumes where it stopped
+with st.expander("📚 Long Document", expanded='long_job_id' in st.session_state):
+    st.caption(
+        "For book-length texts. The audio is written to disk as it is synthesized and an "
+        "interrupted job picks up after the last finished chunk."
+    )
+    long_job_mixed = st.checkbox("Mix voices per sentence", key="long_job_mixed")
+    if st.button("📚 Start / Resume Long Document", use_container_width=True):
+        if text_input:
+            job = create_job(
+                text_input,
+                list(available_models.values()) if long_job_mixed else [model_info],
+                gap_seconds,
+                postprocess=postprocess
+            )
+            st.session_state.long_job_id = job.id
+            st.session_state.long_job_run = job.id
+        else:
+            st.warning("Please enter some text first.")
+
+    if st.session_state.get('long_job_run'):
+        job = get_job(st.session_state.pop('long_job_run'))
+        if job is not None:
+            progress_bar = st.progress(job.state["completed"] / max(1, job.state["chunks"]))
+            with st.spinner(f"Rendering {job.state['chunks']} chunks..."):
+                finished = job.run(
+                    available_models,
+                    on_progress=lambda completed, total: progress_bar.progress(completed / total)
+                )
+            if finished:
+                st.success("Long document finished!")
+            elif job.state["error"]:
+                st.error(f"Stopped: {job.state['error']}. Resume to retry.")
+            elif job.status == "running":
+                st.warning("This job is already being rendered in another session.")
+
+    for job in list_jobs():
+        state = job.state
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            st.markdown(f"""
+            <p class='voice-name'>{state['title']}</p>
+            <p class='voice-quality'>{', '.join(state['voice_names'])} • {state['characters']:,} characters •
+            {state['completed']}/{state['chunks']} chunks • {job.status}</p>
+            """, unsafe_allow_html=True)
+        with col2:
+            if st.button("▶️ Play" if job.done else "▶️ Resume", key=f"long_job_open_{job.id}", use_container_width=True):
+                st.session_state.long_job_id = job.id
+                if not job.done:
+                    st.session_state.long_job_run = job.id
+                st.rerun()
+        with col3:
+            if st.button("🗑️ Delete", key=f"long_job_delete_{job.id}", use_container_width=True):
+                if delete_job(job.id):
+                    if st.session_state.get('long_job_id') == job.id:
+                        st.session_state.pop('long_job_id')
+                    st.rerun()
+                else:
+                    st.warning("Can't delete a job while it is being rendered.")
+
+    # Play what has been rendered so far, straight from the file on disk
+    long_job = get_job(st.session_state['long_job_id']) if 'long_job_id' in st.session_state else None
+    if long_job is not None and long_job.state["data_size"]:
+        size = long_job.audio_path.stat().st_size
+        stream_server = stream_server_for(size)
+        show_player(
+            stream_server.register_file(long_job.audio_path) if stream_server is not None else None,
+            size, lambda: long_job.audio_path.read_bytes(), "audio/wav", f"long_job_{long_job.id}"
+        )
+        st.caption(f"Saved to {long_job.audio_path}")
+        # Re-chunking the document for its index is only worth it when
+        # more of it has been rendered
+        timing_key = (long_job.id, long_job.state["completed"])
+        cached_timing = st.session_state.get('long_job_timing')
+        if cached_timing is None or cached_timing["key"] != timing_key:
+            cached_timing = {"key": timing_key, "index": long_job.timing()}
+            st.session_state.long_job_timing = cached_timing
+        if cached_timing["index"]:
+            timing_downloads(cached_timing["index"], f"long_document_{long_job.id}", f"long_job_timing_{long_job.id}")
+
+# Performance panel: latency percentiles per voice and mode, since the app started
+with st.expander("📈 Performance"):
+    snapshot = METRICS.snapshot()
+    if not snapshot["timings"]:
+        st.caption("Nothing has been synthesized yet.")
+    else:
+        stages = sorted({row["stage"] for row in snapshot["timings"]})
+        stage = st.selectbox(
+            "Stage",
+            stages,
+            index=stages.index("request") if "request" in stages else 0,
+            key="performance_stage",
+            help="request = whole generation; synthesize = one uncached sentence; the rest are pipeline steps"
+        )
+        # Real-time factor has no unit, everything else is shown in milliseconds
+        scale, unit = (1, "") if stage == "real_time_factor" else (1000, " (ms)")
+        st.dataframe(
+            [
+                {
+                    "voice": row["voice"] or "-",
+                    "mode": row["mode"],
+                    "count": row["count"],
+                    f"p50{unit}": row["p50"] * scale,
+                    f"p95{unit}": row["p95"] * scale,
+                    f"p99{unit}": row["p99"] * scale
+                }
+                for row in snapshot["timings"] if row["stage"] == stage
+            ],
+            use_container_width=True,
+            hide_index=True
+        )
+
+        totals = defaultdict(lambda: defaultdict(float))
+        for (name, voice, _), value in snapshot["counters"].items():
+            totals[voice][name] += value
+        voice_rows = [
+            {
+                "voice": voice,
+                "audio (s)": counters["audio_seconds"],
+                "real-time factor": counters["synthesis_seconds"] / counters["audio_seconds"],
+                "MB produced": counters["bytes"] / 1e6,
+                "cache hits": int(counters["cache_hits"]),
+                "errors": int(counters["errors"])
+            }
+            for voice, counters in sorted(totals.items()) if counters["audio_seconds"]
+        ]
+        if voice_rows:
+            st.dataframe(voice_rows, use_container_width=True, hide_index=True)
+
+    st.download_button(
+        "⬇️ Prometheus metrics",
+        METRICS.to_prometheus(),
+        file_name="piper_tts_metrics.prom",
+        mime="text/plain"
+    )
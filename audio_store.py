@@ -0,0 +1,195 @@
+import atexit
+import io
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from metrics import METRICS
+
+
+class AudioStore:
+    # Shared, size-bounded home for the audio that sessions keep around
+    # between reruns. Sessions hold handles instead of bytes. Blobs live in
+    # an in-memory LRU limited by `memory_budget` bytes and are spilled to
+    # disk when it is full; the disk tier is an LRU limited by `disk_budget`
+    # bytes whose oldest blobs are dropped for good. Handles are random, so
+    # they can double as the URL of the audio.
+    def __init__(self, directory, memory_budget=256 * 1024 * 1024, disk_budget=2 * 1024 * 1024 * 1024):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        # Spilled from memory but not on disk yet
+        self._spilling = {}
+        # Content type of every blob, wherever it is
+        self._types = {}
+        self._lock = threading.Lock()
+        self.counters = {"puts": 0, "hits": 0, "misses": 0, "spills": 0, "evictions": 0}
+        self.dir = None
+        if disk_budget:
+            # Handles don't outlive the process, so neither do the files
+            Path(directory).mkdir(parents=True, exist_ok=True)
+            self.dir = Path(tempfile.mkdtemp(prefix=f"{os.getpid()}-", dir=directory))
+            atexit.register(shutil.rmtree, self.dir, True)
+
+    def _path(self, handle):
+        return self.dir / f"{handle}.bin"
+
+    def _count(self, name, value=1):
+        # Caller holds the lock
+        self.counters[name] += value
+        METRICS.inc(f"audio_store_{name}", value, mode="session")
+
+    def _update_gauges(self):
+        METRICS.set_gauge("audio_store_memory_bytes", self._memory_bytes)
+        METRICS.set_gauge("audio_store_disk_bytes", self._disk_bytes)
+
+    def put(self, data, content_type="audio/wav"):
+        # Store a blob and return its handle
+        handle = secrets.token_urlsafe(16)
+        data = bytes(data)
+        with self._lock:
+            self._count("puts")
+            self._types[handle] = content_type
+            self._memory[handle] = data
+            self._memory_bytes += len(data)
+            spill = []
+            while self._memory_bytes > self.memory_budget and self._memory:
+                old_handle, old_data = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old_data)
+                if self.dir is not None and len(old_data) <= self.disk_budget:
+                    self._spilling[old_handle] = old_data
+                    spill.append(old_handle)
+                else:
+                    self._types.pop(old_handle, None)
+                    self._count("evictions")
+            self._update_gauges()
+        for old_handle in spill:
+            self._spill(old_handle)
+        return handle
+
+    def _spill(self, handle):
+        with self._lock:
+            data = self._spilling.get(handle)
+        if data is None:
+            # Discarded in the meantime
+            return
+        try:
+            self._path(handle).write_bytes(data)
+        except OSError:
+            with self._lock:
+                self._spilling.pop(handle, None)
+                self._types.pop(handle, None)
+                self._count("evictions")
+            return
+
+        evicted = []
+        with self._lock:
+            if self._spilling.pop(handle, None) is None:
+                evicted.append(handle)
+            else:
+                self._disk[handle] = len(data)
+                self._disk_bytes += len(data)
+                self._count("spills")
+            while self._disk_bytes > self.disk_budget and self._disk:
+                old_handle, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self._types.pop(old_handle, None)
+                self._count("evictions")
+                evicted.append(old_handle)
+            self._update_gauges()
+        for old_handle in evicted:
+            try:
+                self._path(old_handle).unlink(missing_ok=True)
+            except OSError:
+                # Still being served (Windows); removed at exit
+                pass
+
+    def open(self, handle):
+        # (binary file, size, content type) for serving a blob without
+        # copying it, or None if the handle is unknown or was evicted
+        with self._lock:
+            data = self._memory.get(handle)
+            if data is None:
+                data = self._spilling.get(handle)
+            if data is not None:
+                if handle in self._memory:
+                    self._memory.move_to_end(handle)
+                self._count("hits")
+                return io.BytesIO(data), len(data), self._types.get(handle, "audio/wav")
+            on_disk = handle in self._disk
+            content_type = self._types.get(handle, "audio/wav")
+            if on_disk:
+                self._disk.move_to_end(handle)
+        if on_disk:
+            try:
+                file = open(self._path(handle), 'rb')
+                with self._lock:
+                    self._count("hits")
+                return file, os.fstat(file.fileno()).st_size, content_type
+            except OSError:
+                pass
+        with self._lock:
+            self._count("misses")
+        return None
+
+    def get(self, handle):
+        # The blob's bytes, or None if the handle is unknown or was evicted
+        opened = self.open(handle) if handle else None
+        if opened is None:
+            return None
+        file, _, _ = opened
+        with file:
+            return file.read()
+
+    def size(self, handle):
+        # Bytes of a blob without reading or touching it, None if it's gone
+        with self._lock:
+            data = self._memory.get(handle)
+            if data is None:
+                data = self._spilling.get(handle)
+            if data is not None:
+                return len(data)
+            return self._disk.get(handle)
+
+    def content_type(self, handle):
+        with self._lock:
+            return self._types.get(handle, "audio/wav")
+
+    def __contains__(self, handle):
+        with self._lock:
+            return handle in self._memory or handle in self._spilling or handle in self._disk
+
+    def discard(self, handle):
+        # Free a blob the session no longer needs
+        with self._lock:
+            data = self._memory.pop(handle, None)
+            if data is not None:
+                self._memory_bytes -= len(data)
+            self._spilling.pop(handle, None)
+            self._types.pop(handle, None)
+            size = self._disk.pop(handle, None)
+            if size is not None:
+                self._disk_bytes -= size
+            self._update_gauges()
+        if size is not None:
+            try:
+                self._path(handle).unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes
+            }
@@ -0,0 +1,330 @@
+import json
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from metrics import METRICS
+from postprocess import AUDIO_TRIM_KEEP_MS, AUDIO_TRIM_THRESHOLD_DBFS, FRAME_MS
+from wav_concat import wav_header
+
+# Special symbols in piper's phoneme_id_map
+PAD = "_"
+BOS = "^"
+EOS = "$"
+
+
+def pcm_to_wav(samples, sample_rate, num_channels=1):
+    samples = np.ascontiguousarray(samples, dtype=np.int16)
+    return wav_header(sample_rate, num_channels, 2, samples.nbytes) + samples.tobytes()
+
+
+class SynthesisBackend:
+    # Interface every backend implements. synthesize_pcm() is the native call
+    # and returns (int16 samples, sample_rate); synthesize() returns a WAV.
+    name = "base"
+
+    def synthesize_pcm(self, text, model_info, params=None):
+        raise NotImplementedError
+
+    def synthesize(self, text, model_info, params=None):
+        result = self.synthesize_pcm(text, model_info, params)
+        if result is None:
+            return None
+        samples, sample_rate = result
+        return pcm_to_wav(samples, sample_rate)
+
+    def shutdown(self):
+        pass
+
+
+class SubprocessBackend(SynthesisBackend):
+    # The piper executable, kept warm by a PiperPool
+    name = "subprocess"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def synthesize(self, text, model_info, params=None):
+        return self.pool.synthesize(text, model_info)
+
+    def synthesize_pcm(self, text, model_info, params=None):
+        result = self.pool.synthesize_pcm(text, model_info)
+        if result is None:
+            return None
+        pcm, sample_rate = result
+        return np.frombuffer(pcm, dtype=np.int16), sample_rate
+
+    def shutdown(self):
+        self.pool.shutdown()
+
+
+class OnnxBackend(SynthesisBackend):
+    # Runs the .onnx voice models in-process with onnxruntime. Text is
+    # phonemized with espeak-ng through piper-phonemize, the same way the
+    # piper executable does it. Sessions stay loaded for the lifetime of the
+    # backend object.
+    #
+    # With max_batch_size > 1, sentences for the same voice that arrive within
+    # batch_wait seconds of each other (e.g. from the parallel sentence
+    # executor) are padded into one batch and run with a single inference call.
+    # `slots` (a shared semaphore) is held for every inference call.
+    name = "onnx"
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, espeak_data_path=None,
+                 max_batch_size=8, batch_wait=0.01, padding_tolerance=0.25, slots=None):
+        try:
+            import onnxruntime
+            import piper_phonemize
+        except ImportError as e:
+            raise ImportError(
+                "The onnx backend needs onnxruntime and piper-phonemize: "
+                "pip install onnxruntime piper-phonemize"
+            ) from e
+        self._onnxruntime = onnxruntime
+        self._phonemize = piper_phonemize
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.espeak_data_path = espeak_data_path
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.batch_wait = batch_wait
+        self.padding_tolerance = padding_tolerance
+        self.slots = slots
+        self._voices = {}
+        self._lock = threading.Lock()
+
+    def load_voice(self, model_path):
+        model_path = Path(model_path)
+        with self._lock:
+            voice = self._voices.get(model_path)
+            if voice is not None:
+                return voice
+
+            voice_id = model_path.name[:-len(".onnx")]
+            options = self._onnxruntime.SessionOptions()
+            options.intra_op_num_threads = self.intra_op_threads
+            options.inter_op_num_threads = self.inter_op_threads
+            options.graph_optimization_level = self._onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            with METRICS.span("model_load", voice_id):
+                session = self._onnxruntime.InferenceSession(
+                    str(model_path),
+                    sess_options=options,
+                    providers=["CPUExecutionProvider"]
+                )
+                with open(model_path.with_suffix('.onnx.json'), encoding="utf-8") as f:
+                    config = json.load(f)
+            # Models exported with a fixed batch dimension can't be batched
+            batch_dim = session.get_inputs()[0].shape[0]
+            voice = {
+                "id": voice_id,
+                "session": session,
+                "config": config,
+                "input_names": {i.name for i in session.get_inputs()},
+                "sample_rate": config["audio"]["sample_rate"],
+                "batchable": not isinstance(batch_dim, int) or batch_dim > 1,
+                "batch_queue": None
+            }
+            self._voices[model_path] = voice
+            return voice
+
+    def phoneme_ids(self, text, config):
+        # One list of phoneme ids per sentence espeak finds in the text
+        if config.get("phoneme_type", "espeak") == "text":
+            sentences = self._phonemize.phonemize_codepoints(text)
+        else:
+            voice = config["espeak"]["voice"]
+            if self.espeak_data_path:
+                sentences = self._phonemize.phonemize_espeak(text, voice, data_path=str(self.espeak_data_path))
+            else:
+                sentences = self._phonemize.phonemize_espeak(text, voice)
+
+        id_map = config["phoneme_id_map"]
+        all_ids = []
+        for phonemes in sentences:
+            ids = list(id_map[BOS])
+            for phoneme in phonemes:
+                if phoneme in id_map:
+                    ids.extend(id_map[phoneme])
+                    ids.extend(id_map[PAD])
+            ids.extend(id_map[EOS])
+            all_ids.append(ids)
+        return all_ids
+
+    def scales(self, config, params=None):
+        params = params or {}
+        inference = config.get("inference", {})
+        return np.array([
+            params.get("noise_scale", inference.get("noise_scale", 0.667)),
+            params.get("length_scale", inference.get("length_scale", 1.0)),
+            params.get("noise_w", inference.get("noise_w", 0.8))
+        ], dtype=np.float32)
+
+    @contextmanager
+    def _synthesis_slot(self, voice_id):
+        if self.slots is None:
+            yield
+            return
+        if not self.slots.acquire(blocking=False):
+            # Every core is busy: wait for a slot instead of oversubscribing
+            with METRICS.span("synthesis_queue", voice_id):
+                self.slots.acquire()
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def infer(self, voice, ids, params=None):
+        return self.infer_batch(voice, [ids], params)[0]
+
+    def infer_batch(self, voice, batch_ids, params=None):
+        # One inference call for several phoneme id sequences, padded to the
+        # longest one; each output is trimmed back to its own length
+        params = params or {}
+        lengths = [len(ids) for ids in batch_ids]
+        padded = np.zeros((len(batch_ids), max(lengths)), dtype=np.int64)
+        for row, ids in enumerate(batch_ids):
+            padded[row, :len(ids)] = ids
+        inputs = {
+            "input": padded,
+            "input_lengths": np.array(lengths, dtype=np.int64),
+            "scales": self.scales(voice["config"], params)
+        }
+        if "sid" in voice["input_names"]:
+            inputs["sid"] = np.full(len(batch_ids), params.get("speaker_id", 0), dtype=np.int64)
+        with self._synthesis_slot(voice["id"]), METRICS.span("inference", voice["id"]):
+            audio = voice["session"].run(None, inputs)[0].reshape(len(batch_ids), -1)
+        METRICS.inc("inference_batches", voice=voice["id"])
+        METRICS.inc("inference_sentences", len(batch_ids), voice=voice["id"])
+        if len(batch_ids) == 1:
+            return [audio[0]]
+        longest = max(lengths)
+        return [
+            audio[row] if length == longest else trim_padding(audio[row], voice["sample_rate"])
+            for row, length in enumerate(lengths)
+        ]
+
+    def run_batches(self, voice, items):
+        # items: list of (ids, params). Items are grouped by their params,
+        # sorted by phoneme length and cut into buckets of similar length so
+        # little compute is spent on padding. Returns audio in item order.
+        results = [None] * len(items)
+        groups = {}
+        for index, (ids, params) in enumerate(items):
+            groups.setdefault(json.dumps(params or {}, sort_keys=True), []).append(index)
+        for indices in groups.values():
+            params = items[indices[0]][1]
+            indices.sort(key=lambda index: len(items[index][0]))
+            bucket = []
+            for index in indices + [None]:
+                if bucket and (
+                    index is None
+                    or len(bucket) >= self.max_batch_size
+                    or len(items[index][0]) > len(items[bucket[0]][0]) * (1 + self.padding_tolerance)
+                ):
+                    audios = self.infer_batch(voice, [items[i][0] for i in bucket], params)
+                    for i, audio in zip(bucket, audios):
+                        results[i] = audio
+                    bucket = []
+                if index is not None:
+                    bucket.append(index)
+        return results
+
+    def _batch_queue(self, voice):
+        with self._lock:
+            if voice["batch_queue"] is None:
+                voice["batch_queue"] = queue.Queue()
+                threading.Thread(target=self._batch_worker, args=(voice,), daemon=True).start()
+            return voice["batch_queue"]
+
+    def _batch_worker(self, voice):
+        pending = voice["batch_queue"]
+        while True:
+            requests = [pending.get()]
+            # Give concurrent callers a moment to add their sentences
+            deadline = time.monotonic() + self.batch_wait
+            while len(requests) < self.max_batch_size * 4:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    requests.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                # A batch can mix requests from several modes; label it by the first
+                with metrics.mode(requests[0]["mode"]):
+                    audios = self.run_batches(voice, [(request["ids"], request["params"]) for request in requests])
+                for request, audio in zip(requests, audios):
+                    request["audio"] = audio
+            except Exception as e:
+                for request in requests:
+                    request["error"] = e
+            for request in requests:
+                request["done"].set()
+
+    def _infer_sentences(self, voice, sentence_ids, params):
+        if self.max_batch_size == 1 or not voice["batchable"]:
+            return [self.infer(voice, ids, params) for ids in sentence_ids]
+        pending = self._batch_queue(voice)
+        requests = [
+            {"ids": ids, "params": params, "mode": metrics.current_mode(), "audio": None, "error": None, "done": threading.Event()}
+            for ids in sentence_ids
+        ]
+        for request in requests:
+            pending.put(request)
+        for request in requests:
+            request["done"].wait()
+            if request["error"] is not None:
+                raise request["error"]
+        return [request["audio"] for request in requests]
+
+    def _join_sentences(self, voice, audios, params):
+        sentence_silence = np.zeros(
+            int(voice["sample_rate"] * (params or {}).get("sentence_silence", 0.2)), dtype=np.int16
+        )
+        pieces = []
+        for i, audio in enumerate(audios):
+            if i:
+                pieces.append(sentence_silence)
+            pieces.append(float_to_int16(audio))
+        return np.concatenate(pieces), voice["sample_rate"]
+
+    def synthesize_pcm(self, text, model_info, params=None):
+        voice = self.load_voice(model_info["path"])
+        with METRICS.span("phonemize", voice["id"]):
+            sentence_ids = self.phoneme_ids(text, voice["config"])
+        if not sentence_ids:
+            return None
+        return self._join_sentences(voice, self._infer_sentences(voice, sentence_ids, params), params)
+
+
+def trim_padding(audio, sample_rate):
+    # Batched outputs of shorter inputs end in padding that decodes to a
+    # near-constant low-level signal. Cut it with the threshold and margin
+    # silence trimming uses (postprocess.py), measured against the peak the
+    # audio is normalized to by float_to_int16, so quiet word endings that
+    # trimming would keep are kept here too.
+    frame_size = max(1, sample_rate * FRAME_MS // 1000)
+    num_frames = len(audio) // frame_size
+    if num_frames < 2:
+        return audio
+    peak = max(0.01, float(np.max(np.abs(audio))))
+    frames = audio[:num_frames * frame_size].reshape(num_frames, frame_size) / np.float32(peak)
+    energy = np.mean(np.square(frames, dtype=np.float32), axis=1)
+    loud = np.flatnonzero(10 * np.log10(np.maximum(energy, 1e-12)) >= AUDIO_TRIM_THRESHOLD_DBFS)
+    if not len(loud):
+        return audio
+    end = (loud[-1] + 1) * frame_size + int(AUDIO_TRIM_KEEP_MS * sample_rate / 1000)
+    return audio[:min(end, len(audio))]
+
+
+def float_to_int16(audio):
+    # Peak-normalize each utterance like piper does before converting to 16-bit
+    peak = max(0.01, float(np.max(np.abs(audio)))) if len(audio) else 1.0
+    audio = audio * np.float32(32767.0 / peak)
+    np.clip(audio, -32767, 32767, out=audio)
+    return audio.astype(np.int16)
@@ -0,0 +1,283 @@
+import argparse
+import json
+import os
+import sys
+import time
+import wave
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import tts_core
+from tts_core import (
+    VOICE_CONFIGS,
+    get_available_models,
+    find_voice,
+    generate_audio,
+    generate_mixed_voices_audio,
+    generate_single_voice_with_gaps,
+    check_runtime,
+    get_piper_binary,
+    PIPER_RUNTIME,
+    SYNTHESIS_BACKEND
+)
+from encoders import FORMATS, available_formats
+from piper_runtime import pinned_environment
+from timing import TIMING_FORMATS, build_index, export_timing
+from wav_concat import concat_wavs, encode_wav
+
+MODES = ("single", "gaps", "mixed")
+
+
+def load_jobs(source, voices, mode, gap_seconds, output_dir, audio_format="wav", bitrate_kbps=None, timing_formats=(),
+              postprocess=None):
+    # One job per (text, voice). `source` is a directory of .txt files or a
+    # JSONL manifest whose lines look like
+    #   {"id": "chapter-01", "text": "...", "voice": "en_US-amy-medium", "mode": "gaps"}
+    # ("text_file" can replace "text"; "output" overrides the output path).
+    # `timing_formats` (see timing.TIMING_FORMATS) are written next to the
+    # audio of gaps and mixed jobs. `postprocess` is passed on to concat_wavs.
+    source = Path(source)
+    entries = []
+    if source.is_dir():
+        for text_file in sorted(source.rglob("*.txt")):
+            entries.append({"id": str(text_file.relative_to(source).with_suffix("")), "text_file": str(text_file)})
+    else:
+        with open(source, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                entry.setdefault("id", f"line-{line_number:06d}")
+                if "text_file" in entry:
+                    entry["text_file"] = str((source.parent / entry["text_file"]).resolve())
+                entries.append(entry)
+
+    jobs = []
+    for entry in entries:
+        entry_mode = entry.get("mode", mode)
+        if entry_mode not in MODES:
+            raise ValueError(f"{entry['id']}: unknown mode {entry_mode}")
+        entry_voices = ["mixed"] if entry_mode == "mixed" else ([entry["voice"]] if "voice" in entry else voices)
+        for voice in entry_voices:
+            if "output" in entry and len(entry_voices) == 1:
+                output = Path(output_dir) / entry["output"]
+            else:
+                output = Path(output_dir) / voice / f"{entry['id']}.{FORMATS[audio_format]['extension']}"
+            jobs.append({
+                "id": entry["id"],
+                "text": entry.get("text"),
+                "text_file": entry.get("text_file"),
+                "voice": voice,
+                "mode": entry_mode,
+                "gap_seconds": float(entry.get("gap_seconds", gap_seconds)),
+                "format": audio_format,
+                "bitrate_kbps": bitrate_kbps,
+                "timing": list(timing_formats) if entry_mode != "single" else [],
+                "postprocess": postprocess,
+                "output": str(output)
+            })
+    return jobs
+
+
+def audio_duration(path, audio_format):
+    if audio_format == "wav":
+        with wave.open(str(path), 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    import soundfile
+    info = soundfile.info(str(path))
+    return info.frames / info.samplerate
+
+
+def init_worker(sentences_in_flight):
+    # Every process runs its own sentence executor; keep the total in check
+    tts_core.SYNTHESIS_MAX_IN_FLIGHT = sentences_in_flight
+
+
+def render_job(job):
+    # Runs in a worker process. Writes to a temp file and renames it so an
+    # interrupted run never leaves a half-written output behind.
+    start = time.perf_counter()
+    text = job["text"]
+    if text is None:
+        text = Path(job["text_file"]).read_text(encoding="utf-8")
+    output = Path(job["output"])
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_output = output.with_name(output.name + ".part")
+
+    result = None
+    audio_format, bitrate_kbps = job["format"], job["bitrate_kbps"]
+    timing = [] if job.get("timing") else None
+    if job["mode"] == "mixed":
+        sentence_audios = generate_mixed_voices_audio(text)
+        if sentence_audios:
+            timings = [] if timing is not None else None
+            result = concat_wavs(
+                (item["audio"] for item in sentence_audios),
+                output=tmp_output,
+                gap_seconds=job["gap_seconds"],
+                audio_format=audio_format,
+                bitrate_kbps=bitrate_kbps,
+                postprocess=job.get("postprocess"),
+                timings=timings
+            )
+            if timing is not None:
+                timing.extend(build_index(text, sentence_audios, timings))
+    else:
+        model_info = find_voice(get_available_models(), job["voice"])
+        if model_info is None:
+            return {**job, "error": f"Voice not found: {job['voice']}"}
+        if job["mode"] == "gaps":
+            result = generate_single_voice_with_gaps(
+                text, model_info, job["gap_seconds"], output=tmp_output,
+                audio_format=audio_format, bitrate_kbps=bitrate_kbps, postprocess=job.get("postprocess"), timing=timing
+            )
+        else:
+            audio_bytes = generate_audio(text, model_info)
+            if audio_bytes:
+                tmp_output.write_bytes(encode_wav(audio_bytes, audio_format, bitrate_kbps))
+                result = tmp_output
+
+    if result is None:
+        tmp_output.unlink(missing_ok=True)
+        return {**job, "error": "Failed to generate audio"}
+
+    audio_seconds = audio_duration(tmp_output, audio_format)
+    # Timing files go first, so an output that exists always has them
+    for timing_format in job.get("timing", []):
+        timing_output = output.with_suffix(f".{TIMING_FORMATS[timing_format]['extension']}")
+        tmp_timing = timing_output.with_name(timing_output.name + ".part")
+        tmp_timing.write_text(export_timing(timing, timing_format), encoding="utf-8")
+        os.replace(tmp_timing, timing_output)
+    os.replace(tmp_output, output)
+    return {
+        **job,
+        "chars": len(text),
+        "audio_seconds": audio_seconds,
+        "synthesis_seconds": time.perf_counter() - start
+    }
+
+
+def summarize(results, wall_seconds):
+    per_voice = defaultdict(lambda: {"files": 0, "failed": 0, "chars": 0, "audio_seconds": 0.0, "synthesis_seconds": 0.0})
+    for result in results:
+        stats = per_voice[result["voice"]]
+        if "error" in result:
+            stats["failed"] += 1
+            continue
+        stats["files"] += 1
+        stats["chars"] += result["chars"]
+        stats["audio_seconds"] += result["audio_seconds"]
+        stats["synthesis_seconds"] += result["synthesis_seconds"]
+
+    for stats in per_voice.values():
+        # Real-time factor: seconds spent synthesizing per second of audio
+        stats["real_time_factor"] = stats["synthesis_seconds"] / stats["audio_seconds"] if stats["audio_seconds"] else None
+        stats["chars_per_second"] = stats["chars"] / stats["synthesis_seconds"] if stats["synthesis_seconds"] else None
+
+    total_chars = sum(stats["chars"] for stats in per_voice.values())
+    total_audio = sum(stats["audio_seconds"] for stats in per_voice.values())
+    return {
+        "wall_seconds": wall_seconds,
+        "files": sum(stats["files"] for stats in per_voice.values()),
+        "failed": sum(stats["failed"] for stats in per_voice.values()),
+        "chars_per_second": total_chars / wall_seconds if wall_seconds else None,
+        "audio_seconds_per_second": total_audio / wall_seconds if wall_seconds else None,
+        "voices": dict(per_voice)
+    }
+
+
+def print_summary(summary):
+    print(f"\n{'voice':<28} {'files':>6} {'failed':>6} {'audio s':>9} {'RTF':>7} {'chars/s':>9}")
+    for voice, stats in sorted(summary["voices"].items()):
+        rtf = f"{stats['real_time_factor']:.3f}" if stats["real_time_factor"] is not None else "-"
+        cps = f"{stats['chars_per_second']:.0f}" if stats["chars_per_second"] is not None else "-"
+        print(f"{voice:<28} {stats['files']:>6} {stats['failed']:>6} {stats['audio_seconds']:>9.1f} {rtf:>7} {cps:>9}")
+    print(
+        f"\n{summary['files']} files in {summary['wall_seconds']:.1f}s "
+        f"({summary['chars_per_second'] or 0:.0f} chars/s, "
+        f"{summary['audio_seconds_per_second'] or 0:.1f}x real time overall)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render text files or a JSONL manifest with Piper voices")
+    parser.add_argument("source", help="directory of .txt files or a JSONL manifest")
+    parser.add_argument("output_dir", help="where the audio files are written")
+    parser.add_argument("--voice", action="append", help="voice id or name (repeatable, 'all' for every installed voice)")
+    parser.add_argument("--mode", choices=MODES, default="gaps", help="same modes as the web UI (default: gaps)")
+    parser.add_argument("--gap-seconds", type=float, default=1.0)
+    parser.add_argument("--format", choices=list(FORMATS), default="wav", help="output format (default: wav)")
+    parser.add_argument("--bitrate-kbps", type=int, help="bitrate of opus/mp3 output")
+    parser.add_argument(
+        "--timing", action="append", choices=list(TIMING_FORMATS),
+        help="also write sentence/word timings next to the audio of gaps and mixed jobs (repeatable)"
+    )
+    parser.add_argument("--no-normalize", action="store_true", help="don't normalize the loudness of joined sentences")
+    parser.add_argument("--no-trim", action="store_true", help="don't trim the silence around joined sentences")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sentences-in-flight", type=int, default=1, help="parallel sentences inside each process")
+    parser.add_argument("--overwrite", action="store_true", help="re-render outputs that already exist")
+    parser.add_argument("--summary", help="write the throughput summary as JSON to this file")
+    args = parser.parse_args()
+
+    runtime_error = check_runtime()
+    if runtime_error:
+        sys.exit(runtime_error)
+
+    available_models = get_available_models()
+    if not args.voice:
+        default_model = find_voice(available_models)
+        voices = [default_model["config"]["id"]] if default_model else []
+    elif "all" in args.voice:
+        voices = [voice["id"] for voice in VOICE_CONFIGS if voice["name"] in available_models]
+    else:
+        voices = args.voice
+    if not voices and args.mode != "mixed":
+        sys.exit("No voices available")
+
+    if args.format not in available_formats():
+        sys.exit(f"{args.format} output needs soundfile: pip install soundfile")
+    # Only what was switched off; the rest keeps the AUDIO_* defaults
+    postprocess = {
+        option: False for option, off in (("normalize", args.no_normalize), ("trim", args.no_trim)) if off
+    } or None
+    jobs = load_jobs(
+        args.source, voices, args.mode, args.gap_seconds, args.output_dir, args.format, args.bitrate_kbps,
+        args.timing or (), postprocess
+    )
+    # Resumable: anything already rendered is skipped
+    todo = [job for job in jobs if args.overwrite or not Path(job["output"]).exists()]
+    print(f"{len(jobs)} outputs, {len(jobs) - len(todo)} already done, rendering {len(todo)}")
+
+    if SYNTHESIS_BACKEND != "onnx":
+        # Workers use the binary this process picked instead of self-testing again
+        os.environ.update(pinned_environment(PIPER_RUNTIME, get_piper_binary()))
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=max(1, args.processes),
+        initializer=init_worker,
+        initargs=(max(1, args.sentences_in_flight),)
+    ) as executor:
+        futures = [executor.submit(render_job, job) for job in todo]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {**todo[futures.index(future)], "error": str(e)}
+            results.append(result)
+            status = result.get("error", "ok")
+            print(f"[{done}/{len(todo)}] {result['voice']} {result['id']}: {status}", flush=True)
+
+    summary = summarize(results, time.perf_counter() - start)
+    print_summary(summary)
+    if args.summary:
+        Path(args.summary).write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# End-to-end throughput and latency of the synthesis pipeline, run against
+# benchmarks/fake_piper.py so it needs no piper install and gives the same
+# numbers from run to run. Measures generate_audio, the "gaps" and "mixed"
+# modes and the WAV join path on texts of 1 to 10,000 sentences, and writes
+# the results as JSON so two revisions can be compared:
+#
+#   python benchmarks/bench_pipeline.py --output before.json
+#   python benchmarks/bench_pipeline.py --output after.json --compare before.json
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import tts_core  # noqa: E402
+from backends import pcm_to_wav  # noqa: E402
+from metrics import METRICS  # noqa: E402
+from piper_pool import PiperPool  # noqa: E402
+from wav_concat import concat_wavs, read_wav  # noqa: E402
+
+FAKE_PIPER = Path(__file__).resolve().parent / "fake_piper.py"
+CASES = ("single", "gaps", "mixed", "join")
+# Alternating rates so the mixed and join cases go through resampling
+SAMPLE_RATES = (22050, 16000)
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while seven bright stars "
+    "shine above quiet rivers and distant mountains before morning arrives"
+).split()
+
+
+def make_fake_runtime(root, num_voices, stub_args):
+    # A piper directory with the stub as its executable and empty models
+    # named like the configured voices
+    models_dir = root / "models"
+    models_dir.mkdir(parents=True)
+    for index, voice in enumerate(tts_core.VOICE_CONFIGS[:num_voices]):
+        model_path = models_dir / voice["file"]
+        model_path.write_bytes(b"")
+        model_path.with_suffix(".onnx.json").write_text(json.dumps({
+            "audio": {"sample_rate": SAMPLE_RATES[index % len(SAMPLE_RATES)], "quality": voice["quality"]},
+            "espeak": {"voice": "en-us"},
+            "language": {"code": voice["id"].split("-")[0]},
+            "num_speakers": 1
+        }), encoding="utf-8")
+
+    command = [sys.executable, str(FAKE_PIPER), *stub_args]
+    if os.name == "nt":
+        launcher = root / "piper.cmd"
+        launcher.write_text("@" + subprocess.list2cmdline(command) + " %*\r\n", encoding="utf-8")
+    else:
+        launcher = root / "piper"
+        launcher.write_text("#!/bin/sh\nexec " + " ".join(f"'{part}'" for part in command) + ' "$@"\n', encoding="utf-8")
+        launcher.chmod(0o755)
+    return launcher, models_dir
+
+
+def make_text(num_sentences, seed):
+    # Deterministic sentences of 6-14 words; the seed keeps repeats from
+    # ever hitting a cache
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(num_sentences):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 14))]
+        sentences.append(" ".join(words).capitalize() + rng.choice(".!?"))
+    return " ".join(sentences)
+
+
+def make_sentence_wavs(num_sentences, seconds_per_char, seed):
+    # Input for the join case, the same shape the mixed mode produces
+    rng = random.Random(seed)
+    wavs = []
+    for index in range(num_sentences):
+        sample_rate = SAMPLE_RATES[index % len(SAMPLE_RATES)]
+        num_samples = int(rng.randint(30, 90) * seconds_per_char * sample_rate)
+        wavs.append(pcm_to_wav(np.full(num_samples, 1000, dtype=np.int16), sample_rate))
+    return wavs
+
+
+def wav_seconds(audio):
+    # Duration of WAV bytes or of a WAV file
+    if isinstance(audio, (bytes, bytearray)):
+        fmt, frames = read_wav(audio)
+        return len(frames) / fmt['block_align'] / fmt['sample_rate']
+    with wave.open(str(audio), 'rb') as wav_file:
+        return wav_file.getnframes() / wav_file.getframerate()
+
+
+def run_case(case, num_sentences, seed, model_info, args, work_dir):
+    # Returns (seconds of audio produced, output bytes)
+    output = work_dir / "output.wav"
+    if case == "single":
+        audio = tts_core.generate_audio(make_text(num_sentences, seed), model_info)
+    elif case == "gaps":
+        audio = tts_core.generate_single_voice_with_gaps(
+            make_text(num_sentences, seed), model_info, args.gap_seconds, output=output
+        )
+    elif case == "mixed":
+        sentence_audios = tts_core.generate_mixed_voices_audio(make_text(num_sentences, seed)) or []
+        audio = concat_wavs((item["audio"] for item in sentence_audios), output=output, gap_seconds=args.gap_seconds)
+    else:
+        wavs = make_sentence_wavs(num_sentences, args.seconds_per_char, seed)
+        start = time.perf_counter()
+        audio = concat_wavs(wavs, output=output, gap_seconds=args.gap_seconds)
+        # Building the input isn't part of the join
+        return wav_seconds(audio), output.stat().st_size, time.perf_counter() - start
+    if audio is None:
+        raise RuntimeError(f"{case} with {num_sentences} sentences produced no audio")
+    size = len(audio) if isinstance(audio, bytes) else output.stat().st_size
+    return wav_seconds(audio), size, None
+
+
+def measure(case, num_sentences, model_info, args, work_dir):
+    METRICS.reset()
+    timings = []
+    audio_seconds = output_bytes = 0
+    for repeat in range(args.repeat):
+        start = time.perf_counter()
+        audio_seconds, output_bytes, elapsed = run_case(
+            case, num_sentences, f"{num_sentences}-{repeat}", model_info, args, work_dir
+        )
+        timings.append(elapsed if elapsed is not None else time.perf_counter() - start)
+    median = statistics.median(timings)
+    result = {
+        "case": case,
+        "sentences": num_sentences,
+        "repeat": args.repeat,
+        "wall_seconds": {"min": min(timings), "median": median, "max": max(timings)},
+        "sentences_per_second": num_sentences / median,
+        "audio_seconds": audio_seconds,
+        "output_bytes": output_bytes,
+        "realtime_speed": audio_seconds / median
+    }
+    if case != "join":
+        # Per-sentence latency inside the pipeline, from the metrics module
+        result["sentence_latency"] = METRICS.summary("synthesize")
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent.parent,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    previous = {(r["case"], r["sentences"]): r for r in baseline["results"]}
+    print(f"\nvs {baseline['meta'].get('revision') or 'baseline'}:")
+    print(f"{'case':>8} {'sentences':>9} {'before s':>10} {'after s':>10} {'change':>8}")
+    for result in results:
+        before = previous.get((result["case"], result["sentences"]))
+        if before is None:
+            continue
+        old, new = before["wall_seconds"]["median"], result["wall_seconds"]["median"]
+        print(f"{result['case']:>8} {result['sentences']:>9} {old:>10.4f} {new:>10.4f} {(new - old) / old:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the synthesis pipeline against a fake piper")
+    parser.add_argument("--sizes", default="1,10,100,1000,10000", help="comma-separated sentence counts")
+    parser.add_argument("--cases", default=",".join(CASES), help=f"comma-separated subset of {', '.join(CASES)}")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--voices", type=int, default=3, help="fake voices installed (used by the mixed case)")
+    parser.add_argument("--workers-per-voice", type=int, default=1)
+    parser.add_argument("--sentences-in-flight", type=int, default=tts_core.SYNTHESIS_MAX_IN_FLIGHT)
+    parser.add_argument("--gap-seconds", type=float, default=0.1)
+    parser.add_argument("--seconds-per-char", type=float, default=0.01, help="audio the fake piper produces per character")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds the fake piper spends per utterance")
+    parser.add_argument("--realtime-factor", type=float, default=0.0, help="fake synthesis seconds per second of audio")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    cases = [case for case in args.cases.split(",") if case]
+    for case in cases:
+        if case not in CASES:
+            parser.error(f"unknown case {case}")
+
+    root = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    pool = None
+    try:
+        launcher, models_dir = make_fake_runtime(root, max(1, args.voices), [
+            "--seconds-per-char", str(args.seconds_per_char),
+            "--delay", str(args.delay),
+            "--realtime-factor", str(args.realtime_factor)
+        ])
+        # Point the core at the fake runtime, with the cache off so every
+        # repeat really synthesizes
+        tts_core.PIPER_DIR = root
+        tts_core.MODELS_DIR = models_dir
+        tts_core.SYNTHESIS_BACKEND = "subprocess"
+        tts_core.SYNTHESIS_MAX_IN_FLIGHT = args.sentences_in_flight
+        tts_core.SYNTHESIS_CACHE_DIR = root / "cache"
+        tts_core.SYNTHESIS_CACHE_MEMORY_MB = 0
+        tts_core.SYNTHESIS_CACHE_DISK_MB = 0
+        pool = PiperPool(
+            launcher, cwd=root, workers_per_voice=args.workers_per_voice, idle_timeout=0,
+            output_raw=tts_core.PIPER_OUTPUT != "wav"
+        )
+        tts_core.get_piper_pool = lambda: pool
+        # Keep every sample of a run for the percentiles
+        METRICS.window = max(sizes) * args.repeat
+
+        model_info = tts_core.find_voice(tts_core.get_available_models())
+        # Start the piper processes outside of the timed runs
+        tts_core.generate_mixed_voices_audio(make_text(max(1, args.voices), "warm-up"))
+
+        results = []
+        print(f"{'case':>8} {'sentences':>9} {'median s':>10} {'sent/s':>9} {'x realtime':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for case in cases:
+            for num_sentences in sizes:
+                result = measure(case, num_sentences, model_info, args, root)
+                results.append(result)
+                latency = result.get("sentence_latency") or {}
+                p50 = f"{latency['p50'] * 1000:.2f}" if latency.get("p50") is not None else "-"
+                p99 = f"{latency['p99'] * 1000:.2f}" if latency.get("p99") is not None else "-"
+                print(
+                    f"{case:>8} {num_sentences:>9} {result['wall_seconds']['median']:>10.4f} "
+                    f"{result['sentences_per_second']:>9.1f} {result['realtime_speed']:>10.1f} {p50:>8} {p99:>8}",
+                    flush=True
+                )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+        },
+        "results": results
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    if args.compare:
+        compare(results, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# Compares the old np.interp resampling used by the join paths with the
+# polyphase resampler in resample.py: throughput and peak memory per call.
+#
+#   python benchmarks/bench_resample.py [--seconds 60] [--repeat 5]
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from resample import resample_pcm16  # noqa: E402
+
+RATE_PAIRS = [(16000, 22050), (22050, 16000), (22050, 44100)]
+
+
+def interp_resample(frames, from_rate, to_rate):
+    # The join code before resample.py
+    audio_data = np.frombuffer(frames, dtype=np.int16)
+    ratio = to_rate / from_rate
+    new_length = int(len(audio_data) * ratio)
+    indices = np.linspace(0, len(audio_data) - 1, new_length)
+    return np.interp(indices, np.arange(len(audio_data)), audio_data).astype(np.int16)
+
+
+def measure(func, frames, from_rate, to_rate, repeat):
+    # Warm-up call also fills the filter cache, like a long-running server would
+    func(frames, from_rate, to_rate)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(frames, from_rate, to_rate)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(frames, from_rate, to_rate)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(timings), peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare resampler throughput and peak memory")
+    parser.add_argument("--seconds", type=float, default=60.0, help="length of the test signal")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'rates':>14} {'method':>10} {'Msamples/s':>11} {'peak MB':>8} {'peak/input':>10}")
+    for from_rate, to_rate in RATE_PAIRS:
+        num_samples = int(args.seconds * from_rate)
+        frames = (rng.standard_normal(num_samples) * 3000).astype(np.int16).tobytes()
+        for name, func in (("interp", interp_resample), ("polyphase", resample_pcm16)):
+            best, peak = measure(func, frames, from_rate, to_rate, args.repeat)
+            print(
+                f"{from_rate:>6}->{to_rate:<7} {name:>10} {num_samples / best / 1e6:>11.1f} "
+                f"{peak / 1e6:>8.1f} {peak / len(frames):>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Deterministic stand-in for the piper executable, for benchmarks and for
+# trying the app without a real piper install. It follows the same command
+# line contract as piper:
+#
+#   --model/--json_config   the voice; the sample rate is read from its .onnx.json
+#   --output_file PATH      read all of stdin, write one WAV
+#   --output_dir DIR        one WAV per input line, its path echoed on stdout
+#   --json-input            input lines are {"text": ..., "output_file": ...}
+#   --output_raw            raw 16-bit PCM for each line on stdout instead of files
+#
+# and logs piper's "Real-time factor: ... audio=<seconds> sec" line to stderr
+# after each utterance.
+#
+# Instead of a voice it writes a sine tone whose length is proportional to the
+# text, after an optional delay, so runs are repeatable:
+#
+#   --seconds-per-char 0.01   audio produced per input character
+#   --delay 0.0               seconds spent on every utterance
+#   --realtime-factor 0.0     extra seconds spent per second of audio
+#   --load-delay 0.0          seconds spent "loading the model" at startup
+import argparse
+import json
+import sys
+import time
+import wave
+from pathlib import Path
+
+import numpy as np
+
+TONE_HZ = 220
+AMPLITUDE = 3000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fake piper executable")
+    parser.add_argument("-m", "--model", required=True)
+    parser.add_argument("-c", "--config", "--json_config", dest="config")
+    parser.add_argument("-f", "--output_file", "--output-file", dest="output_file")
+    parser.add_argument("-d", "--output_dir", "--output-dir", dest="output_dir")
+    parser.add_argument("--output_raw", "--output-raw", dest="output_raw", action="store_true")
+    parser.add_argument("--json-input", dest="json_input", action="store_true")
+    parser.add_argument("--seconds-per-char", type=float, default=0.01)
+    parser.add_argument("--delay", type=float, default=0.0)
+    parser.add_argument("--realtime-factor", type=float, default=0.0)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    args, _ = parser.parse_known_args()
+    return args
+
+
+class ToneVoice:
+    def __init__(self, sample_rate, seconds_per_char, delay, realtime_factor):
+        self.sample_rate = sample_rate
+        self.seconds_per_char = seconds_per_char
+        self.delay = delay
+        self.realtime_factor = realtime_factor
+        # One second of tone, tiled to the requested length
+        t = np.arange(sample_rate) / sample_rate
+        self.tone = (np.sin(2 * np.pi * TONE_HZ * t) * AMPLITUDE).astype(np.int16)
+        self.utterances = 0
+        self.last_result = None
+
+    def synthesize(self, text):
+        start = time.perf_counter()
+        num_samples = max(1, round(len(text) * self.seconds_per_char * self.sample_rate))
+        wait = self.delay + self.realtime_factor * num_samples / self.sample_rate
+        if wait > 0:
+            time.sleep(wait)
+        self.utterances += 1
+        self.last_result = (time.perf_counter() - start, num_samples / self.sample_rate)
+        return np.resize(self.tone, num_samples).tobytes()
+
+    def log_result(self):
+        infer_seconds, audio_seconds = self.last_result
+        sys.stderr.write(
+            f"[piper] [info] Real-time factor: {infer_seconds / audio_seconds} "
+            f"(infer={infer_seconds} sec, audio={audio_seconds} sec)\n"
+        )
+        sys.stderr.flush()
+
+    def write_wav(self, path, pcm):
+        with wave.open(str(path), 'wb') as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            wav_file.writeframes(pcm)
+
+
+def main():
+    args = parse_args()
+    config_path = Path(args.config or args.model + ".json")
+    with open(config_path, encoding="utf-8") as f:
+        sample_rate = json.load(f).get("audio", {}).get("sample_rate", 22050)
+    voice = ToneVoice(sample_rate, args.seconds_per_char, args.delay, args.realtime_factor)
+    if args.load_delay > 0:
+        time.sleep(args.load_delay)
+
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    if args.output_file and not args.output_raw:
+        voice.write_wav(args.output_file, voice.synthesize(stdin.read().decode("utf-8").strip()))
+        voice.log_result()
+        return
+
+    output_dir = Path(args.output_dir) if args.output_dir else Path.cwd()
+    for line in stdin:
+        line = line.decode("utf-8").strip()
+        if not line:
+            continue
+        output_file = None
+        if args.json_input:
+            request = json.loads(line)
+            text = request.get("text", "")
+            output_file = request.get("output_file")
+        else:
+            text = line
+        pcm = voice.synthesize(text)
+        if args.output_raw:
+            stdout.write(pcm)
+        else:
+            output_file = Path(output_file) if output_file else output_dir / f"{time.monotonic_ns()}.wav"
+            voice.write_wav(output_file, pcm)
+            stdout.write(str(output_file).encode("utf-8") + b"\n")
+        stdout.flush()
+        voice.log_result()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import os
+import re
+
+# Chunk size budget in characters. Sentences longer than the max are split at
+# clause boundaries; sentences shorter than the min are merged with a neighbour.
+TEXT_CHUNK_MAX_CHARS = int(os.environ.get("TEXT_CHUNK_MAX_CHARS", "300"))
+TEXT_CHUNK_MIN_CHARS = int(os.environ.get("TEXT_CHUNK_MIN_CHARS", "12"))
+
+# Abbreviations that are usually followed by a name or number, so a period
+# after them never ends a sentence
+TITLES = {
+    "mr", "mrs", "ms", "dr", "prof", "st", "mt", "ft", "sr", "jr", "gen", "col", "lt", "sgt", "capt",
+    "cmdr", "adm", "rev", "hon", "gov", "pres", "sen", "rep", "vs", "approx", "dept", "est", "ca", "cf"
+}
+# Abbreviations that don't end a sentence when a number follows: "No. 5", "p. 12"
+NUMBER_ABBREVIATIONS = {"no", "nos", "fig", "figs", "vol", "vols", "ch", "sec", "art", "p", "pp", "op"}
+# Abbreviations that may also end a sentence; only split after them when the
+# next word is capitalized and not another abbreviation
+ABBREVIATIONS = {
+    "etc", "inc", "ltd", "co", "corp", "jan", "feb", "mar", "apr", "jun", "jul", "aug", "sep", "sept",
+    "oct", "nov", "dec", "mon", "tue", "wed", "thu", "fri", "sat", "sun", "am", "pm", "al", "eg", "ie"
+}
+
+# Candidate boundaries: terminal punctuation (with closing quotes/brackets)
+# followed by whitespace, or a line break. The lookbehinds keep runs of
+# punctuation or spaces from being retried at every position inside them,
+# which is quadratic in the length of the run.
+_BOUNDARY = re.compile(r"""(?<![.!?…])([.!?…]+["'”’»)\]]*)(\s+)|(?<![ \t])([ \t]*\n\s*)""")
+# Places a long sentence can be split, best first
+_CLAUSE = re.compile(
+    r"""[;:]\s+|[,)\]]\s+|(?<!\s)\s+[–—-]+\s+"""
+    r"""|(?<!\s)\s+(?=(?:and|but|or|so|because|which|while|although|whereas|then)\s)"""
+)
+# Text (without its trailing whitespace) that ends with a finished sentence
+_FINISHED = re.compile(r"""[.!?…]["'”’»)\]]*$""")
+_LIST_MARKER = re.compile(r"(?:[-*•]|\d+[.)])\s")
+_WORD_BEFORE = re.compile(r"""[\w.'’-]*$""")
+# A line shorter than this (a heading or list item) ends at its line break
+_SHORT_LINE = 60
+
+
+def _is_sentence_end(text, punct_start, punct, next_pos):
+    # Whether terminal punctuation at punct_start really ends a sentence
+    next_char = text[next_pos] if next_pos < len(text) else ""
+    if next_char.islower():
+        # "e.g. this", "he said "stop." and left", "Wait... what"
+        return False
+    if not punct.startswith(".") or punct.startswith(".."):
+        return True
+    word = _WORD_BEFORE.search(text, max(0, punct_start - 20), punct_start).group().lstrip("'’-")
+    key = word.replace(".", "").lower()
+    if key in TITLES:
+        return False
+    if key in NUMBER_ABBREVIATIONS and next_char.isdigit():
+        return False
+    if len(word) == 1 and word.isupper():
+        # An initial: "J. R. R. Tolkien"
+        return False
+    if key in ABBREVIATIONS or ("." in word and len(word) <= 6):
+        # "etc.", "U.S.", "Ph.D."
+        return next_char.isupper()
+    if word.isdigit():
+        # A numbered list item at the start of a line: "1. Preheat the oven"
+        line_start = text.rfind("\n", max(0, punct_start - 12), punct_start) + 1
+        if line_start == punct_start - len(word) or punct_start - len(word) == 0:
+            return False
+    return True
+
+
+def split_sentence_spans(text):
+    # (start, end, line_end) for every sentence in text, in one pass. end
+    # excludes the trailing whitespace; line_end marks sentences followed by
+    # a line break (or the end of the text), such as headings and paragraphs.
+    spans = []
+    start = 0
+    for match in _BOUNDARY.finditer(text):
+        if match.group(1) is not None:
+            space = match.group(2)
+            end = match.start(2)
+            if not _is_sentence_end(text, match.start(1), match.group(1), match.end()):
+                continue
+        else:
+            space = match.group(3)
+            end = match.start(3)
+            next_pos = match.end()
+            if space.count("\n") < 2 and not _LIST_MARKER.match(text, next_pos):
+                next_char = text[next_pos] if next_pos < len(text) else ""
+                short_line = end < _SHORT_LINE or text.rfind("\n", end - _SHORT_LINE, end) != -1
+                if next_char.islower() or not short_line:
+                    # A wrapped line inside a sentence
+                    continue
+        if end > start and text[start:end].strip():
+            spans.append((start, end, "\n" in space))
+        start = match.end()
+    if start < len(text) and text[start:].strip():
+        end = len(text.rstrip())
+        spans.append((start, end, True))
+    elif spans:
+        spans[-1] = (spans[-1][0], spans[-1][1], True)
+    return spans
+
+
+def _split_long_span(text, start, end, max_chars, min_chars):
+    # Cut [start, end) into pieces of at most max_chars, as even as possible,
+    # preferring clause boundaries, then spaces. Every step only looks at the
+    # next max_chars characters, so this is linear in the span length.
+    pieces = []
+    cuts = [m.end() for m in _CLAUSE.finditer(text, start, end)]
+    cut_index = 0
+    while end - start > max_chars:
+        remaining = end - start
+        ideal = start + remaining // -(-remaining // max_chars)
+        limit = start + max_chars
+        while cut_index < len(cuts) and cuts[cut_index] < start + min_chars:
+            cut_index += 1
+        best = None
+        index = cut_index
+        while index < len(cuts) and cuts[index] <= limit:
+            if best is None or abs(cuts[index] - ideal) < abs(best - ideal):
+                best = cuts[index]
+            index += 1
+        if best is None or abs(best - ideal) > max_chars // 3:
+            # No clause boundary near the middle; fall back to a space
+            space = text.rfind(" ", start + min_chars, ideal + 1)
+            if space == -1:
+                space = text.find(" ", ideal, limit)
+            if space != -1 and (best is None or abs(space + 1 - ideal) < abs(best - ideal)):
+                best = space + 1
+        if best is None:
+            best = limit
+        pieces.append((start, best))
+        start = best
+        while start < end and text[start].isspace():
+            start += 1
+    if end > start:
+        pieces.append((start, end))
+    return pieces
+
+
+def _normalize(text):
+    return " ".join(text.split())
+
+
+def chunk_text(text, max_chars=None, min_chars=None):
+    # Split text into synthesis chunks of balanced size. Returns a list of
+    #   {"text", "start", "end", "group", "sentences": (first, last)}
+    # where start/end index into the original text and sentences are indexes
+    # into split_sentence_spans(text). Sentences shorter than min_chars are
+    # merged with their neighbours (never across line breaks); sentences longer
+    # than max_chars are split into several chunks of the same group. A group
+    # is one unit for display and for gaps between sentences.
+    max_chars = max(1, max_chars or TEXT_CHUNK_MAX_CHARS)
+    min_chars = TEXT_CHUNK_MIN_CHARS if min_chars is None else min_chars
+    min_chars = min(min_chars, max_chars // 2)
+    spans = split_sentence_spans(text)
+
+    # Merge short sentences into their neighbour on the same line
+    merged = []
+    for index, (start, end, line_end) in enumerate(spans):
+        if merged:
+            prev = merged[-1]
+            prev_short = prev["end"] - prev["start"] < min_chars
+            this_short = end - start < min_chars
+            if (
+                not prev["line_end"]
+                and (prev_short or (this_short and line_end))
+                and end - prev["start"] <= max_chars
+            ):
+                prev["end"] = end
+                prev["last"] = index
+                prev["line_end"] = line_end
+                continue
+        merged.append({"start": start, "end": end, "first": index, "last": index, "line_end": line_end})
+
+    chunks = []
+    for group, unit in enumerate(merged):
+        for start, end in _split_long_span(text, unit["start"], unit["end"], max_chars, min_chars):
+            chunk_text_value = _normalize(text[start:end])
+            if chunk_text_value:
+                chunks.append({
+                    "text": chunk_text_value,
+                    "start": start,
+                    "end": end,
+                    "group": group,
+                    "sentences": (unit["first"], unit["last"])
+                })
+    return chunks
+
+
+def finished_chunks(text, max_chars=None, min_chars=None):
+    # chunk_text of text that may still be being typed: the chunks of the
+    # last sentence are left out until it ends in terminal punctuation or a
+    # line break. A short finished sentence merged into that last sentence
+    # is left out with it: which chunk it ends up in depends on the sentence
+    # still being typed, so its audio could not be reused before then.
+    chunks = chunk_text(text, max_chars, min_chars)
+    stripped = text.rstrip()
+    if chunks and "\n" not in text[len(stripped):] and not _FINISHED.search(stripped):
+        last_group = chunks[-1]["group"]
+        chunks = [chunk for chunk in chunks if chunk["group"] != last_group]
+    return chunks
+
+
+def group_chunks(chunks):
+    # Consecutive chunks of the same group, as lists
+    groups = []
+    for chunk in chunks:
+        if groups and groups[-1][0]["group"] == chunk["group"]:
+            groups[-1].append(chunk)
+        else:
+            groups.append([chunk])
+    return groups
+
+
+def chunk_gaps(chunks, gap_seconds):
+    # Silence before each chunk: gap_seconds between groups, none between
+    # the pieces of a split sentence
+    return [
+        gap_seconds if index and chunk["group"] != chunks[index - 1]["group"] else 0.0
+        for index, chunk in enumerate(chunks)
+    ]
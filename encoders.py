@@ -0,0 +1,211 @@
+import os
+
+import numpy as np
+
+from resample import resample_pcm16
+
+# Output formats. Everything but WAV is encoded with libsndfile through the
+# soundfile package. Streamable formats only ever append to their output, so
+# they can be sent while they are being encoded.
+FORMATS = {
+    "wav": {"mime": "audio/wav", "extension": "wav", "streamable": True},
+    "opus": {
+        "mime": "audio/ogg", "extension": "ogg", "streamable": True,
+        "container": "OGG", "subtype": "OPUS",
+        # Opus only runs at these rates; other voices are resampled up
+        "sample_rates": (8000, 12000, 16000, 24000, 48000),
+        # libsndfile maps compression level 0..1 linearly onto this bitrate range
+        "bitrate_range": (6, 256)
+    },
+    # MP3 and FLAC rewrite their first frame/header once done, so they
+    # can't be streamed
+    "mp3": {
+        "mime": "audio/mpeg", "extension": "mp3", "streamable": False,
+        "container": "MP3", "subtype": "MPEG_LAYER_III", "bitrate_mode": "CONSTANT"
+    },
+    "flac": {
+        # Lossless; only the compression effort can be chosen
+        "mime": "audio/flac", "extension": "flac", "streamable": False,
+        "container": "FLAC", "subtype": "PCM_16"
+    }
+}
+
+# Default output format and bitrate of the lossy formats
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "wav")
+OUTPUT_BITRATE_KBPS = {
+    "opus": int(os.environ.get("OUTPUT_OPUS_KBPS", "32")),
+    "mp3": int(os.environ.get("OUTPUT_MP3_KBPS", "64"))
+}
+OUTPUT_FLAC_COMPRESSION = float(os.environ.get("OUTPUT_FLAC_COMPRESSION", "0.5"))
+
+
+def _soundfile():
+    try:
+        import soundfile
+    except ImportError as e:
+        raise ImportError("Compressed output formats need soundfile: pip install soundfile") from e
+    return soundfile
+
+
+def available_formats():
+    # Formats that can be written here: soundfile is optional
+    try:
+        soundfile = _soundfile()
+    except ImportError:
+        return ["wav"]
+    return [
+        name for name, spec in FORMATS.items()
+        if name == "wav" or spec["subtype"] in soundfile.available_subtypes(spec["container"])
+    ]
+
+
+def encoder_sample_rate(audio_format, sample_rate):
+    # Rate the format is encoded at: the voice's own when it's supported,
+    # otherwise the next supported rate up
+    rates = FORMATS[audio_format].get("sample_rates")
+    if not rates or sample_rate in rates:
+        return sample_rate
+    return next((rate for rate in rates if rate >= sample_rate), rates[-1])
+
+
+def compression_level(audio_format, sample_rate, bitrate_kbps=None):
+    # libsndfile's 0 (best) .. 1 (smallest) setting for a target bitrate
+    if audio_format == "flac":
+        return OUTPUT_FLAC_COMPRESSION
+    bitrate_kbps = bitrate_kbps or OUTPUT_BITRATE_KBPS[audio_format]
+    if audio_format == "mp3":
+        # MPEG-1 rates (32 kHz and up) go from 32 to 320 kbps, MPEG-2 from 8 to 160
+        low, high = (32, 320) if sample_rate >= 32000 else (8, 160)
+    else:
+        low, high = FORMATS[audio_format]["bitrate_range"]
+    return min(1.0, max(0.0, (high - bitrate_kbps) / (high - low)))
+
+
+class EncodedConcatenator:
+    # WavConcatenator's counterpart for compressed formats: PCM segments
+    # and silence gaps are encoded into `output` (a path or a binary file)
+    # as they are added, so the uncompressed audio never exists as a whole.
+    def __init__(self, output, sample_rate, num_channels=1, sampwidth=2, gap_seconds=1.0,
+                 audio_format="opus", bitrate_kbps=None):
+        if sampwidth != 2:
+            raise ValueError("Only 16-bit audio can be encoded")
+        soundfile = _soundfile()
+        spec = FORMATS[audio_format]
+        self.audio_format = audio_format
+        self.num_channels = num_channels
+        # Segments come in at input_rate and are encoded at sample_rate
+        self.input_rate = sample_rate
+        self.sample_rate = encoder_sample_rate(audio_format, sample_rate)
+        self.gap_seconds = gap_seconds
+        self.num_frames = 0
+        self.segments = 0
+        self._file = soundfile.SoundFile(
+            output, 'w',
+            samplerate=self.sample_rate,
+            channels=num_channels,
+            format=spec["container"],
+            subtype=spec["subtype"],
+            compression_level=compression_level(audio_format, self.sample_rate, bitrate_kbps),
+            bitrate_mode=spec.get("bitrate_mode")
+        )
+
+    def _write(self, samples):
+        self._file.write(samples.reshape(-1, self.num_channels))
+        self.num_frames += len(samples) // self.num_channels
+
+    def add(self, frames, sample_rate=None, gap_seconds=None):
+        # gap_seconds overrides the default gap before this segment
+        if self.segments:
+            gap_frames = int((self.gap_seconds if gap_seconds is None else gap_seconds) * self.sample_rate)
+            if gap_frames:
+                self._write(np.zeros(gap_frames * self.num_channels, dtype=np.int16))
+        sample_rate = sample_rate or self.input_rate
+        if sample_rate != self.sample_rate:
+            samples = resample_pcm16(frames, sample_rate, self.sample_rate, self.num_channels)
+        else:
+            samples = np.frombuffer(frames, dtype=np.int16)
+        self._write(samples)
+        self.segments += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _StreamSink:
+    # Write-only file for the encoder that hands out what has been written
+    # so far. Writes before the part already handed out (header updates
+    # some encoders make when they close) are dropped; a streamable format
+    # is valid without them.
+    def __init__(self):
+        self._buffer = bytearray()
+        self._base = 0
+        self._pos = 0
+        self._size = 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        size = len(data)
+        start, end = self._pos, self._pos + size
+        if end > self._base:
+            if start < self._base:
+                data = data[self._base - start:]
+                start = self._base
+            offset = start - self._base
+            if offset > len(self._buffer):
+                self._buffer.extend(bytes(offset - len(self._buffer)))
+            self._buffer[offset:offset + len(data)] = data
+        self._pos = end
+        self._size = max(self._size, end)
+        return size
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        else:
+            self._pos = self._size + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        return b""
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._base += len(data)
+        self._buffer.clear()
+        return data
+
+
+class StreamEncoder:
+    # Encodes segments as they are produced and hands back the encoded
+    # bytes right away, for streaming a compressed format over HTTP
+    def __init__(self, audio_format, sample_rate, num_channels=1, gap_seconds=1.0, bitrate_kbps=None):
+        if not FORMATS[audio_format]["streamable"]:
+            raise ValueError(f"{audio_format} can't be streamed")
+        self._sink = _StreamSink()
+        self._encoder = EncodedConcatenator(
+            self._sink, sample_rate, num_channels, 2, gap_seconds, audio_format, bitrate_kbps
+        )
+
+    def add(self, frames, sample_rate=None, gap_seconds=None):
+        # Encoded bytes available after this segment (may be empty)
+        self._encoder.add(frames, sample_rate, gap_seconds)
+        return self._sink.drain()
+
+    def close(self):
+        # The rest of the encoded stream
+        self._encoder.close()
+        return self._sink.drain()
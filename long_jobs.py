@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import metrics
+from chunker import chunk_gaps, chunk_text, TEXT_CHUNK_MAX_CHARS, TEXT_CHUNK_MIN_CHARS
+from metrics import METRICS
+from postprocess import make_postprocessor
+from timing import build_index
+from tts_core import find_voice, get_synthesis_cache, iter_synthesize_sentences
+from wav_concat import WavConcatenator, read_wav
+
+# Where long-document jobs keep their text, progress and audio
+LONG_JOB_DIR = Path(os.environ.get("LONG_JOB_DIR", Path(tempfile.gettempdir()) / "piper_tts_jobs"))
+
+# Jobs being rendered in this process, so two sessions never write one file
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _write_json(path, data):
+    # Atomic replace: a crash leaves either the old or the new checkpoint
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def make_job_id(text, voices, gap_seconds, max_chars, min_chars, postprocess=None):
+    # Same text, voices (and model files), gaps, chunking and post-processing
+    # = same job, so starting a job again resumes it
+    cache = get_synthesis_cache()
+    job = {
+        "text": text,
+        "voices": [[info["config"]["id"], cache.model_hash(info["path"])] for info in voices],
+        "gap_seconds": gap_seconds,
+        "max_chars": max_chars,
+        "min_chars": min_chars
+    }
+    if postprocess is not None:
+        job["postprocess"] = postprocess
+    payload = json.dumps(job, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class LongJob:
+    # A long document rendered chunk by chunk into <job dir>/audio.wav.
+    # job.json records how many chunks are done and how many bytes of audio
+    # they took, and is replaced after every chunk, so an interrupted job
+    # (rerun, crash, restart) resumes after the last chunk that reached the
+    # disk. Only the chunks in flight are ever held in memory. Where each
+    # chunk ended up in the audio is appended to timing.jsonl.
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self.id = self.dir.name
+        self.state = json.loads((self.dir / "job.json").read_text(encoding="utf-8"))
+
+    @property
+    def audio_path(self):
+        return self.dir / "audio.wav"
+
+    @property
+    def timing_path(self):
+        return self.dir / "timing.jsonl"
+
+    @property
+    def text(self):
+        return (self.dir / "text.txt").read_text(encoding="utf-8")
+
+    @property
+    def status(self):
+        # A job left "running" by a process that died is just paused
+        with _running_lock:
+            running = self.id in _running
+        if self.state["status"] == "running" and not running:
+            return "paused"
+        return self.state["status"]
+
+    @property
+    def done(self):
+        return self.state["status"] == "done"
+
+    def _read_timings(self):
+        if not self.timing_path.exists():
+            return []
+        with open(self.timing_path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.endswith("\n")]
+
+    def timing(self):
+        # Sentence index (see timing.py) of the chunks rendered so far.
+        # Chunks rendered before timings were recorded are left out.
+        chunks = chunk_text(self.text, self.state["max_chars"], self.state["min_chars"])
+        timings = [entry for entry in self._read_timings() if entry["segment"] < self.state["completed"]]
+        return build_index(self.text, chunks, timings)
+
+    def _save(self):
+        self.state["updated"] = time.time()
+        _write_json(self.dir / "job.json", self.state)
+
+    def run(self, available_models, on_progress=None, cancel_event=None):
+        # Synthesize the remaining chunks. Returns True once the whole job
+        # is done; False if it failed, was cancelled or is already being
+        # rendered elsewhere in this process.
+        with _running_lock:
+            if self.id in _running:
+                return False
+            _running.add(self.id)
+        try:
+            return self._run(available_models, on_progress, cancel_event)
+        finally:
+            with _running_lock:
+                _running.discard(self.id)
+
+    def _run(self, available_models, on_progress, cancel_event):
+        state = self.state
+        if state["status"] == "done":
+            return True
+        voices = [find_voice(available_models, voice_id) for voice_id in state["voices"]]
+        missing = [voice_id for voice_id, info in zip(state["voices"], voices) if info is None]
+        if missing:
+            state["status"] = "failed"
+            state["error"] = f"Voice not installed: {', '.join(missing)}"
+            self._save()
+            return False
+
+        chunks = chunk_text(self.text, state["max_chars"], state["min_chars"])
+        gaps = chunk_gaps(chunks, state["gap_seconds"])
+        completed = state["completed"]
+        # Voices take turns per sentence, like "Mix Voices per Sentence"
+        jobs = [(chunk["text"], voices[chunk["group"] % len(voices)]) for chunk in chunks[completed:]]
+        state["status"] = "running"
+        state["error"] = None
+        self._save()
+
+        concatenator = WavConcatenator.reopen(self.audio_path, state["data_size"], completed, state["gap_seconds"])
+        processor = make_postprocessor(state["postprocess"], concatenator.sample_rate, concatenator.num_channels)
+        processor.position = concatenator.num_frames
+        # Like the audio, timings of chunks past the checkpoint are dropped
+        timings = [entry for entry in self._read_timings() if entry["segment"] < completed]
+        with open(self.timing_path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in timings)
+        timing_file = open(self.timing_path, "a", encoding="utf-8")
+        audios = iter_synthesize_sentences(jobs, cancel_event=cancel_event, mode="long")
+        try:
+            with metrics.mode("long"), METRICS.span("request"):
+                for index, audio_bytes in enumerate(audios, completed):
+                    if not audio_bytes:
+                        if cancel_event is not None and cancel_event.is_set():
+                            break
+                        # Stop here so resuming retries this chunk
+                        state["status"] = "failed"
+                        state["error"] = f"Chunk {index + 1} could not be synthesized"
+                        break
+                    fmt, frames = read_wav(audio_bytes)
+                    with METRICS.span("postprocess"):
+                        # Flushed right away: the checkpoint can't point
+                        # past audio that is still held back, so chunks
+                        # fade in and out instead of overlapping
+                        pieces = processor.feed(frames, fmt['sample_rate'], gaps[index]) + processor.flush()
+                    for piece, piece_gap in pieces:
+                        concatenator.add(piece, processor.sample_rate, piece_gap)
+                    if processor.span is not None:
+                        timing_file.write(json.dumps({
+                            "segment": index,
+                            "start": processor.span[0] / processor.sample_rate,
+                            "end": processor.span[1] / processor.sample_rate
+                        }) + "\n")
+                        timing_file.flush()
+                    # Audio first, then the checkpoint that points past it
+                    concatenator.checkpoint()
+                    state["completed"] = index + 1
+                    state["data_size"] = concatenator.data_size
+                    self._save()
+                    if on_progress:
+                        on_progress(index + 1, len(chunks))
+        finally:
+            audios.close()
+            concatenator.close()
+            timing_file.close()
+            if state["completed"] >= len(chunks):
+                state["status"] = "done"
+            elif state["status"] == "running":
+                state["status"] = "paused"
+            self._save()
+        return state["status"] == "done"
+
+
+def create_job(text, voices, gap_seconds=1.0, max_chars=None, min_chars=None, postprocess=None):
+    # New job for text read by voices (model infos, taking turns per
+    # sentence), or the existing one if the same job was started before.
+    # `postprocess` is stored with the job (see concat_wavs).
+    max_chars = max_chars or TEXT_CHUNK_MAX_CHARS
+    min_chars = TEXT_CHUNK_MIN_CHARS if min_chars is None else min_chars
+    job_id = make_job_id(text, voices, gap_seconds, max_chars, min_chars, postprocess)
+    job_dir = LONG_JOB_DIR / job_id
+    if (job_dir / "job.json").exists():
+        return LongJob(job_dir)
+
+    # Built next to its final place and renamed in, so a half-created job
+    # never shows up
+    LONG_JOB_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{job_id}-", dir=LONG_JOB_DIR))
+    (tmp_dir / "text.txt").write_text(text, encoding="utf-8")
+    sample_rate = voices[0]["sample_rate"]
+    WavConcatenator(tmp_dir / "audio.wav", sample_rate, gap_seconds=gap_seconds).close()
+    now = time.time()
+    _write_json(tmp_dir / "job.json", {
+        "id": job_id,
+        "title": " ".join(text.split())[:80],
+        "voices": [info["config"]["id"] for info in voices],
+        "voice_names": [info["config"]["name"] for info in voices],
+        "gap_seconds": gap_seconds,
+        "max_chars": max_chars,
+        "min_chars": min_chars,
+        "postprocess": postprocess,
+        "characters": len(text),
+        "chunks": len(chunk_text(text, max_chars, min_chars)),
+        "sample_rate": sample_rate,
+        "completed": 0,
+        "data_size": 0,
+        "status": "new",
+        "error": None,
+        "created": now,
+        "updated": now
+    })
+    try:
+        os.replace(tmp_dir, job_dir)
+    except OSError:
+        # Created by someone else in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return LongJob(job_dir)
+
+
+def get_job(job_id):
+    try:
+        return LongJob(LONG_JOB_DIR / job_id)
+    except (OSError, ValueError):
+        return None
+
+
+def list_jobs():
+    # Every job on disk, most recently updated first
+    jobs = []
+    if LONG_JOB_DIR.exists():
+        for job_dir in LONG_JOB_DIR.iterdir():
+            if job_dir.name.startswith("."):
+                continue
+            try:
+                jobs.append(LongJob(job_dir))
+            except (OSError, ValueError):
+                continue
+    return sorted(jobs, key=lambda job: job.state["updated"], reverse=True)
+
+
+def delete_job(job_id):
+    # Returns False for a job that is being rendered
+    with _running_lock:
+        if job_id in _running:
+            return False
+    shutil.rmtree(LONG_JOB_DIR / job_id, ignore_errors=True)
+    return True
@@ -0,0 +1,173 @@
+import contextvars
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Generation mode (single, gaps, mixed, all-voices, ...) the current code runs
+# under, so stage timings deep in the pipeline can be broken down by mode
+_mode = contextvars.ContextVar("tts_mode", default="single")
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    # In-process metrics for the synthesis pipeline: timing samples per
+    # (stage, voice, mode) kept in bounded windows for percentiles, plus
+    # monotonically increasing counters. Cheap enough for the hot path: one
+    # lock and a deque append per observation.
+    def __init__(self, window=2048):
+        self.window = window
+        self._timings = defaultdict(lambda: {"samples": deque(maxlen=self.window), "count": 0, "sum": 0.0})
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, voice="", mode=None):
+        key = (stage, voice, mode or _mode.get())
+        with self._lock:
+            series = self._timings[key]
+            series["samples"].append(seconds)
+            series["count"] += 1
+            series["sum"] += seconds
+
+    @contextmanager
+    def span(self, stage, voice=""):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, voice)
+
+    def inc(self, name, value=1, voice="", mode=None):
+        with self._lock:
+            self._counters[(name, voice, mode or _mode.get())] += value
+
+    def set_gauge(self, name, value):
+        # A current level (bytes held, ...) rather than a running total
+        with self._lock:
+            self._gauges[name] = value
+
+    def record_audio(self, voice, num_bytes, num_samples, sample_rate, synthesis_seconds):
+        # Output counters and real-time factor for one synthesized utterance
+        audio_seconds = num_samples / sample_rate if sample_rate else 0.0
+        self.inc("bytes", num_bytes, voice)
+        self.inc("samples", num_samples, voice)
+        self.inc("audio_seconds", audio_seconds, voice)
+        self.inc("synthesis_seconds", synthesis_seconds, voice)
+        if audio_seconds:
+            self.observe("real_time_factor", synthesis_seconds / audio_seconds, voice)
+
+    def snapshot(self):
+        # Rows of {stage, voice, mode, count, sum, p50, p95, p99}
+        with self._lock:
+            timings = [(key, sorted(series["samples"]), series["count"], series["sum"]) for key, series in self._timings.items()]
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+        rows = []
+        for (stage, voice, mode), values, count, total in sorted(timings):
+            row = {"stage": stage, "voice": voice, "mode": mode, "count": count, "sum": total}
+            for q in QUANTILES:
+                row[f"p{int(q * 100)}"] = _quantile(values, q)
+            rows.append(row)
+        return {"timings": rows, "counters": counters, "gauges": gauges}
+
+    def summary(self, stage):
+        # Percentiles of one stage across every voice and mode
+        with self._lock:
+            values = sorted(
+                value
+                for (series_stage, _, _), series in self._timings.items() if series_stage == stage
+                for value in series["samples"]
+            )
+        result = {"count": len(values)}
+        for q in QUANTILES:
+            result[f"p{int(q * 100)}"] = _quantile(values, q)
+        return result
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = []
+
+        stages = [row for row in snapshot["timings"] if row["stage"] != "real_time_factor"]
+        rtf = [row for row in snapshot["timings"] if row["stage"] == "real_time_factor"]
+        for metric, rows, labels, help_text in (
+            ("tts_stage_seconds", stages, ("stage", "voice", "mode"), "Time spent in each synthesis pipeline stage"),
+            ("tts_real_time_factor", rtf, ("voice", "mode"), "Synthesis time divided by audio duration"),
+        ):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for row in rows:
+                label_text = ",".join(f'{label}="{_escape(row[label])}"' for label in labels)
+                for q in QUANTILES:
+                    value = row[f"p{int(q * 100)}"]
+                    lines.append(f'{metric}{{{label_text},quantile="{q}"}} {value:.6g}')
+                lines.append(f"{metric}_sum{{{label_text}}} {row['sum']:.6g}")
+                lines.append(f"{metric}_count{{{label_text}}} {row['count']}")
+
+        counter_help = {
+            "bytes": "Audio bytes produced",
+            "samples": "Audio samples produced",
+            "audio_seconds": "Seconds of audio produced",
+            "synthesis_seconds": "Seconds spent producing audio",
+            "coalesced": "Sentences that got the audio of an identical synthesis already running",
+            "audio_store_puts": "Audio blobs handed to the session audio store",
+            "audio_store_hits": "Session audio blobs found in the store",
+            "audio_store_misses": "Session audio blobs requested after they were evicted",
+            "audio_store_spills": "Session audio blobs moved from memory to disk",
+            "audio_store_evictions": "Session audio blobs dropped to stay within budget"
+        }
+        by_name = defaultdict(list)
+        for (name, voice, mode), value in snapshot["counters"].items():
+            by_name[name].append((voice, mode, value))
+        for name, values in sorted(by_name.items()):
+            metric = f"tts_{name}_total"
+            lines.append(f"# HELP {metric} {counter_help.get(name, name)}")
+            lines.append(f"# TYPE {metric} counter")
+            for voice, mode, value in sorted(values):
+                lines.append(f'{metric}{{voice="{_escape(voice)}",mode="{_escape(mode)}"}} {value:.6g}')
+
+        for name, value in sorted(snapshot["gauges"].items()):
+            metric = f"tts_{name}"
+            lines.append(f"# HELP {metric} {name.replace('_', ' ').capitalize()}")
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:.6g}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._counters.clear()
+
+
+METRICS = Metrics()
+
+
+def current_mode():
+    return _mode.get()
+
+
+@contextmanager
+def mode(name):
+    token = _mode.set(name)
+    try:
+        yield
+    finally:
+        _mode.reset(token)
+
+
+def call_in_mode(name, func, *args, **kwargs):
+    # For worker threads, which don't inherit the submitting thread's mode
+    with mode(name):
+        return func(*args, **kwargs)
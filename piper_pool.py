@@ -0,0 +1,442 @@
+import json
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import METRICS
+from wav_concat import WAV_HEADER_SIZE, read_wav, wav_header
+
+# Piper logs "Real-time factor: ... (infer=... sec, audio=... sec)" to stderr
+# once an utterance's audio has been written
+UTTERANCE_END = "Real-time factor"
+# Initial raw buffer size per character of text (piper voices speak ~15
+# chars/s); the buffer doubles if an utterance turns out longer
+RAW_SECONDS_PER_CHAR = 0.07
+RAW_MIN_BUFFER = 64 * 1024
+RAW_MAX_INITIAL_BUFFER = 1024 * 1024
+# How often stdout is checked for audio while piper is synthesizing: right
+# after audio arrived, backing off to the slower rate while piper is busy
+RAW_POLL_SECONDS = (0.00005, 0.002)
+RAW_PIPE_SIZE = 1024 * 1024
+
+if os.name == "nt":
+    import ctypes
+    import msvcrt
+    from ctypes import wintypes
+
+    def pipe_available(fd):
+        # Bytes waiting in a pipe, -1 once the other end is closed
+        available = wintypes.DWORD()
+        if not ctypes.windll.kernel32.PeekNamedPipe(
+            msvcrt.get_osfhandle(fd), None, 0, None, ctypes.byref(available), None
+        ):
+            return -1
+        return available.value
+
+    def enlarge_pipe(fd):
+        pass
+else:
+    import fcntl
+    import termios
+
+    def pipe_available(fd):
+        # Bytes waiting in a pipe (0 at end of file; a dead process is
+        # noticed through its stderr closing)
+        return struct.unpack("i", fcntl.ioctl(fd, termios.FIONREAD, b"\0" * 4))[0]
+
+    def enlarge_pipe(fd):
+        # Fewer round trips for long utterances, where the kernel allows it (Linux)
+        try:
+            fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, RAW_PIPE_SIZE)
+        except (AttributeError, OSError):
+            pass
+
+
+class PiperWorker:
+    # A single resident piper process with one voice model loaded. Text is
+    # sent one JSON line at a time (--json-input).
+    #
+    # With output_raw, piper writes each utterance to stdout as raw 16-bit
+    # mono PCM (--output_raw), which is read straight into a preallocated
+    # buffer. Raw output has no framing: the end of an utterance is the
+    # "Real-time factor: ..." line piper logs to stderr once all of its audio
+    # has been written, after which whatever is left in the pipe is read.
+    # The sample rate comes from the model's .onnx.json.
+    #
+    # Otherwise piper writes each utterance to a uniquely named file in a
+    # private temp dir and echoes the path on stdout, which is what we wait
+    # for before reading the audio back.
+    def __init__(self, piper_path, model_path, config_path, cwd=None, request_timeout=120.0, output_raw=True,
+                 extra_args=None, env=None):
+        # Absolute paths, since the process runs with cwd set to the piper dir
+        self.piper_path = Path(piper_path).absolute()
+        self.model_path = Path(model_path).absolute()
+        self.config_path = Path(config_path).absolute()
+        self.cwd = cwd
+        self.request_timeout = request_timeout
+        self.output_raw = output_raw
+        # Additional command line arguments and environment variables of the build
+        self.extra_args = list(extra_args or [])
+        self.env = dict(env or {})
+        self.voice_id = self.model_path.name[:-len(".onnx")]
+        with open(self.config_path, encoding="utf-8") as f:
+            self.sample_rate = json.load(f).get("audio", {}).get("sample_rate", 22050)
+        self.process = None
+        self.cold = True
+        self.output_dir = None
+        self._events = None
+        self.restarts = 0
+        self.last_used = time.monotonic()
+        self.stderr_tail = deque(maxlen=50)
+
+    def start(self):
+        piper_cmd = [
+            str(self.piper_path),
+            "--model", str(self.model_path),
+            "--json_config", str(self.config_path),
+            "--json-input"
+        ]
+        if self.output_raw:
+            piper_cmd.append("--output_raw")
+        else:
+            if self.output_dir is None:
+                self.output_dir = Path(tempfile.mkdtemp(prefix="piper_worker_"))
+            piper_cmd += ["--output_dir", str(self.output_dir)]
+        piper_cmd += self.extra_args
+        self.cold = True
+        with METRICS.span("process_spawn", self.voice_id):
+            self.process = subprocess.Popen(
+                piper_cmd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=str(self.cwd) if self.cwd else None,
+                env={**os.environ, **self.env} if self.env else None
+            )
+        if self.output_raw:
+            enlarge_pipe(self.process.stdout.fileno())
+        # End-of-utterance markers logged by this process
+        self._events = queue.Queue()
+        # Piper logs to stderr continuously; drain it so the pipe never fills up
+        threading.Thread(target=self._drain_stderr, args=(self.process, self._events), daemon=True).start()
+
+    def _drain_stderr(self, process, events):
+        for line in process.stderr:
+            line = line.decode("utf-8", errors="replace").rstrip()
+            self.stderr_tail.append(line)
+            if self.output_raw and UTTERANCE_END in line:
+                events.put(("end", line))
+        events.put(("eof", None))
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def restart(self):
+        self.stop(keep_output_dir=True)
+        self.restarts += 1
+        self.start()
+
+    def _send(self, text, output_file=None):
+        request = {"text": text}
+        if output_file is not None:
+            request["output_file"] = str(output_file)
+        try:
+            self.process.stdin.write(json.dumps(request).encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            return False
+
+    def _capture_raw(self, text):
+        # Returns a bytearray holding WAV_HEADER_SIZE free bytes followed by
+        # the utterance's PCM, and the PCM size; None on failure
+        events = self._events
+        # Drop markers left over from a request that timed out
+        while True:
+            try:
+                events.get_nowait()
+            except queue.Empty:
+                break
+
+        estimate = int(len(text) * RAW_SECONDS_PER_CHAR * self.sample_rate) * 2
+        buffer = bytearray(WAV_HEADER_SIZE + min(max(RAW_MIN_BUFFER, estimate), RAW_MAX_INITIAL_BUFFER))
+        size = 0
+        ended = False
+        stdout = self.process.stdout.raw
+        fd = stdout.fileno()
+        poll = RAW_POLL_SECONDS[0]
+        if not self._send(text):
+            return None
+        while True:
+            available = pipe_available(fd)
+            if available < 0:
+                return None
+            if available:
+                end = WAV_HEADER_SIZE + size + available
+                if end > len(buffer):
+                    buffer.extend(bytes(max(end, len(buffer) * 2) - len(buffer)))
+                with memoryview(buffer) as view:
+                    read = stdout.readinto(view[WAV_HEADER_SIZE + size:end])
+                if not read:
+                    return None
+                size += read
+                # More is likely right behind it
+                poll = RAW_POLL_SECONDS[0]
+                continue
+            # Piper logs the end of an utterance after all of its audio has
+            # been written, so an empty pipe after that means we have it all
+            if ended:
+                return buffer, size
+            try:
+                kind, _ = events.get(timeout=poll)
+            except queue.Empty:
+                poll = min(poll * 2, RAW_POLL_SECONDS[1])
+                continue
+            if kind != "end":
+                # Process went away
+                return None
+            ended = True
+
+    def _synthesize_file(self, text):
+        output_file = self.output_dir / f"{uuid.uuid4().hex}.wav"
+        if self._send(text, output_file):
+            reply = self.process.stdout.readline()
+        else:
+            reply = b""
+        if not reply:
+            output_file.unlink(missing_ok=True)
+            return None
+        with METRICS.span("temp_io", self.voice_id):
+            try:
+                if output_file.exists():
+                    return output_file.read_bytes()
+                return None
+            finally:
+                output_file.unlink(missing_ok=True)
+
+    def _run(self, func, text):
+        if not self.is_alive():
+            self.restart()
+        # Kill the process if it wedges; reads then fail and the worker gets
+        # restarted on the next request
+        watchdog = threading.Timer(self.request_timeout, self.process.kill)
+        watchdog.daemon = True
+        watchdog.start()
+        # Piper loads the model before it reads its first request, so the
+        # first round trip after a (re)start is timed separately
+        start = time.perf_counter()
+        try:
+            return func(text)
+        finally:
+            watchdog.cancel()
+            self.last_used = time.monotonic()
+            METRICS.observe("model_load" if self.cold else "piper_inference", time.perf_counter() - start, self.voice_id)
+            self.cold = False
+
+    def synthesize_pcm(self, text):
+        # (16-bit mono PCM, sample rate) or None
+        if not self.output_raw:
+            audio_bytes = self.synthesize(text)
+            if not audio_bytes:
+                return None
+            fmt, frames = read_wav(audio_bytes)
+            return frames, fmt['sample_rate']
+        result = self._run(self._capture_raw, text)
+        if result is None:
+            return None
+        buffer, size = result
+        return memoryview(buffer)[WAV_HEADER_SIZE:WAV_HEADER_SIZE + size], self.sample_rate
+
+    def synthesize(self, text):
+        # WAV bytes or None
+        if not self.output_raw:
+            return self._run(self._synthesize_file, text)
+        result = self._run(self._capture_raw, text)
+        if result is None:
+            return None
+        buffer, size = result
+        # The header goes into the space left in front of the audio
+        del buffer[WAV_HEADER_SIZE + size:]
+        buffer[:WAV_HEADER_SIZE] = wav_header(self.sample_rate, 1, 2, size)
+        return bytes(buffer)
+
+    def stop(self, keep_output_dir=False):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+            self.process = None
+        if self.output_dir is not None and not keep_output_dir:
+            shutil.rmtree(self.output_dir, ignore_errors=True)
+            self.output_dir = None
+
+
+class PiperPool:
+    # Keeps up to `workers_per_voice` warm piper processes per voice.
+    # Workers are spawned lazily on first use, restarted if they crash and
+    # evicted once a voice has been idle for `idle_timeout` seconds.
+    # `slots` (a semaphore shared with other pools/backends) is held only
+    # while a worker is actually synthesizing, so requests queued for a busy
+    # voice don't take slots away from other voices.
+    def __init__(self, piper_path, cwd=None, workers_per_voice=1, idle_timeout=600.0, request_timeout=120.0, output_raw=True,
+                 extra_args=None, env=None, slots=None):
+        self.piper_path = Path(piper_path)
+        self.slots = slots
+        self.cwd = cwd
+        self.output_raw = output_raw
+        self.extra_args = extra_args
+        self.env = env
+        self.workers_per_voice = max(1, int(workers_per_voice))
+        self.idle_timeout = idle_timeout
+        self.request_timeout = request_timeout
+        self._voices = {}
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+        if idle_timeout:
+            threading.Thread(target=self._reaper, daemon=True).start()
+
+    def _acquire(self, model_info):
+        voice_id = model_info["config"]["id"]
+        with self._lock:
+            slot = self._voices.get(voice_id)
+            if slot is None:
+                slot = {
+                    "model_path": Path(model_info["path"]),
+                    "idle": queue.LifoQueue(),
+                    "workers": [],
+                    "busy": 0,
+                    "last_used": time.monotonic()
+                }
+                self._voices[voice_id] = slot
+            slot["busy"] += 1
+            slot["last_used"] = time.monotonic()
+            try:
+                # LIFO so the most recently used (hottest) worker is reused first
+                return slot, slot["idle"].get_nowait()
+            except queue.Empty:
+                pass
+            if len(slot["workers"]) < self.workers_per_voice:
+                model_path = slot["model_path"]
+                worker = PiperWorker(
+                    self.piper_path,
+                    model_path,
+                    model_path.with_suffix('.onnx.json'),
+                    cwd=self.cwd,
+                    request_timeout=self.request_timeout,
+                    output_raw=self.output_raw,
+                    extra_args=self.extra_args,
+                    env=self.env
+                )
+                slot["workers"].append(worker)
+                return slot, worker
+        # All workers for this voice are busy; wait for one to come back
+        return slot, slot["idle"].get()
+
+    def _release(self, slot, worker):
+        with self._lock:
+            slot["busy"] -= 1
+            slot["last_used"] = time.monotonic()
+        slot["idle"].put(worker)
+
+    @contextmanager
+    def _synthesis_slot(self, voice_id):
+        if self.slots is None:
+            yield
+            return
+        if not self.slots.acquire(blocking=False):
+            # Every core is busy: wait for a slot instead of oversubscribing
+            with METRICS.span("synthesis_queue", voice_id):
+                self.slots.acquire()
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def _run(self, model_info, call):
+        if self._closed.is_set():
+            return None
+        slot, worker = self._acquire(model_info)
+        try:
+            with self._synthesis_slot(model_info["config"]["id"]):
+                if worker.process is None:
+                    worker.start()
+                result = call(worker)
+                if result is None and not worker.is_alive():
+                    # Crashed mid-request: bring it back and retry once
+                    worker.restart()
+                    result = call(worker)
+            return result
+        finally:
+            self._release(slot, worker)
+
+    def synthesize(self, text, model_info):
+        # WAV bytes or None
+        return self._run(model_info, lambda worker: worker.synthesize(text))
+
+    def synthesize_pcm(self, text, model_info):
+        # (16-bit mono PCM, sample rate) or None
+        return self._run(model_info, lambda worker: worker.synthesize_pcm(text))
+
+    def health_check(self):
+        # Restart dead idle workers (busy ones restart themselves on their
+        # next request) and report per-voice status
+        status = {}
+        with self._lock:
+            slots = list(self._voices.items())
+        for voice_id, slot in slots:
+            idle_workers = []
+            while True:
+                try:
+                    idle_workers.append(slot["idle"].get_nowait())
+                except queue.Empty:
+                    break
+            for worker in idle_workers:
+                if worker.process is not None and not worker.is_alive():
+                    try:
+                        worker.restart()
+                    except Exception:
+                        pass
+                slot["idle"].put(worker)
+            status[voice_id] = {
+                "workers": len(slot["workers"]),
+                "alive": sum(1 for w in slot["workers"] if w.is_alive()),
+                "busy": slot["busy"],
+                "restarts": sum(w.restarts for w in slot["workers"]),
+                "idle_seconds": time.monotonic() - slot["last_used"]
+            }
+        return status
+
+    def evict_idle(self, max_idle=None):
+        max_idle = self.idle_timeout if max_idle is None else max_idle
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for voice_id, slot in list(self._voices.items()):
+                if slot["busy"] == 0 and now - slot["last_used"] >= max_idle:
+                    evicted.append(self._voices.pop(voice_id))
+        for slot in evicted:
+            for worker in slot["workers"]:
+                worker.stop()
+        return len(evicted)
+
+    def _reaper(self):
+        interval = max(1.0, min(60.0, self.idle_timeout / 4))
+        while not self._closed.wait(interval):
+            self.evict_idle()
+            self.health_check()
+
+    def shutdown(self):
+        self._closed.set()
+        self.evict_idle(max_idle=0)
@@ -0,0 +1,243 @@
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import time
+from pathlib import Path
+
+import metrics
+from piper_pool import PiperWorker
+
+# Optional JSON file describing the piper install(s), e.g.
+#   {
+#     "piper_dir": "/opt/piper",
+#     "models_dir": "/srv/piper/models",
+#     "threads": 2,
+#     "binaries": [
+#       {"name": "avx2", "path": "/opt/piper-avx2/piper", "requires": ["avx2", "fma"]},
+#       {"name": "generic", "path": "/opt/piper/piper"}
+#     ],
+#     "hosts": {"render-*": {"threads": 1}, "laptop": {"binary": "generic"}}
+#   }
+# Relative paths are relative to the file. Environment variables win over it.
+PIPER_CONFIG = os.environ.get("PIPER_CONFIG", "piper_runtime.json")
+
+EXECUTABLE_NAME = "piper.exe" if os.name == "nt" else "piper"
+# Where piper is looked for when nothing is configured
+DEFAULT_PIPER_DIRS = ["C:/piper"] if os.name == "nt" else ["~/piper", "/opt/piper", "/usr/local/share/piper"]
+
+SELF_TEST_TEXT = "The quick brown fox jumps over the lazy dog, then takes a short nap in the sun."
+SELF_TEST_TIMEOUT = 60.0
+
+# IsProcessorFeaturePresent ids of the features binaries usually require
+_WINDOWS_FEATURES = {"sse3": 13, "sse4_1": 37, "sse4_2": 38, "avx": 39, "avx2": 40, "avx512f": 41}
+
+
+def cpu_features():
+    # Lower-case instruction set extensions of this CPU ("avx2", "fma", ...),
+    # None where they can't be found out
+    system = platform.system()
+    try:
+        if system == "Linux":
+            with open("/proc/cpuinfo", encoding="utf-8") as f:
+                for line in f:
+                    if line.startswith(("flags", "Features")):
+                        return set(line.split(":", 1)[1].lower().split())
+        elif system == "Darwin":
+            output = subprocess.run(
+                ["sysctl", "-n", "machdep.cpu.features", "machdep.cpu.leaf7_features"],
+                capture_output=True, text=True, timeout=5
+            ).stdout
+            return set(output.lower().replace(".", "_").split())
+        elif system == "Windows":
+            import ctypes
+            present = ctypes.windll.kernel32.IsProcessorFeaturePresent
+            return {name for name, feature in _WINDOWS_FEATURES.items() if present(feature)}
+    except (OSError, subprocess.SubprocessError, AttributeError):
+        pass
+    return None
+
+
+def _path(value, base=None):
+    if value in (None, ""):
+        return None
+    path = Path(os.path.expandvars(str(value))).expanduser()
+    if base is not None and not path.is_absolute():
+        path = base / path
+    return path
+
+
+def load_config(path=None, hostname=None):
+    # The config file with the sections of the "hosts" patterns matching
+    # this host merged in (in file order), or {} without a file
+    path = _path(path or PIPER_CONFIG)
+    if path is None or not path.is_file():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    base = path.resolve().parent
+    hostname = hostname or socket.gethostname()
+    merged = {key: value for key, value in config.items() if key != "hosts"}
+    for pattern, overrides in config.get("hosts", {}).items():
+        if fnmatch.fnmatch(hostname.lower(), pattern.lower()):
+            merged.update(overrides)
+    merged["config_path"] = path
+    merged["base"] = base
+    return merged
+
+
+def load_runtime(environ=None, config=None):
+    # Resolve the piper install from the environment, the config file and
+    # the usual install locations. Nothing is run here; select_binary()
+    # picks the binary to use.
+    environ = os.environ if environ is None else environ
+    config = load_config(environ.get("PIPER_CONFIG")) if config is None else config
+    base = config.get("base")
+
+    piper_dir = _path(environ.get("PIPER_DIR")) or _path(config.get("piper_dir"), base)
+    on_path = shutil.which(EXECUTABLE_NAME)
+    if piper_dir is None:
+        candidates = [_path(directory) for directory in DEFAULT_PIPER_DIRS]
+        piper_dir = next((directory for directory in candidates if directory.is_dir()), None)
+    if piper_dir is None:
+        piper_dir = Path(on_path).resolve().parent if on_path else _path(DEFAULT_PIPER_DIRS[0])
+    models_dir = (
+        _path(environ.get("PIPER_MODELS_DIR")) or _path(config.get("models_dir"), base) or piper_dir / "models"
+    )
+    # Only passed to piper when configured; piper finds the data next to itself
+    espeak_data = _path(environ.get("PIPER_ESPEAK_DATA")) or _path(config.get("espeak_data"), base)
+    # Only applies to the onnx backend: the piper executable sets up its own
+    # onnxruntime session threads and has no option or variable to change them
+    threads = int(environ.get("PIPER_THREADS") or config.get("threads") or 0)
+
+    entries = [
+        {**entry, "path": _path(entry["path"], base)} for entry in config.get("binaries", [])
+    ] or [{"name": "piper", "path": piper_dir / EXECUTABLE_NAME}]
+    if not config.get("binaries") and on_path and Path(on_path).resolve() != entries[0]["path"].resolve():
+        entries.append({"name": "piper (PATH)", "path": Path(on_path)})
+    # PIPER_BINARY pins a binary by name or path; so does "binary" in the config
+    pinned = environ.get("PIPER_BINARY") or config.get("binary")
+    if pinned:
+        entries = [entry for entry in entries if entry.get("name") == pinned] or [
+            {"path": _path(pinned, None if environ.get("PIPER_BINARY") else base)}
+        ]
+
+    binaries = []
+    for entry in entries:
+        binary = {
+            "name": entry.get("name") or entry["path"].stem,
+            "path": entry["path"],
+            "requires": [feature.lower() for feature in entry.get("requires", [])],
+            "args": list(entry.get("args", [])),
+            "env": dict(entry.get("env", {}))
+        }
+        if espeak_data is not None:
+            binary["args"] += ["--espeak_data", str(espeak_data)]
+        binaries.append(binary)
+
+    return {
+        "host": socket.gethostname(),
+        "config_path": config.get("config_path"),
+        "piper_dir": piper_dir,
+        "models_dir": models_dir,
+        "espeak_data": espeak_data,
+        "threads": threads,
+        "binaries": binaries,
+        "pinned": bool(pinned),
+        "self_test": []
+    }
+
+
+def usable_binaries(runtime):
+    # Binaries that exist and whose required CPU features this host has.
+    # Without known CPU features, the self-test has the last word.
+    features = cpu_features()
+    usable = []
+    for binary in runtime["binaries"]:
+        if not binary["path"].is_file():
+            binary["problem"] = f"not found at {binary['path']}"
+        elif features is not None and not set(binary["requires"]) <= features:
+            binary["problem"] = f"needs {', '.join(sorted(set(binary['requires']) - features))}"
+        else:
+            binary["problem"] = None
+            usable.append(binary)
+    return usable
+
+
+def self_test(binary, model_path, output_raw=True, text=SELF_TEST_TEXT):
+    # Start the binary with a voice, synthesize a sentence twice and time
+    # the second (warm) run: {"name", "path", "load_seconds", "seconds",
+    # "audio_seconds", "real_time_factor", "error"}
+    model_path = Path(model_path)
+    result = {"name": binary["name"], "path": str(binary["path"]), "error": None}
+    worker = PiperWorker(
+        binary["path"], model_path, model_path.with_suffix('.onnx.json'),
+        cwd=binary["path"].parent, request_timeout=SELF_TEST_TIMEOUT, output_raw=output_raw,
+        extra_args=binary["args"], env=binary["env"]
+    )
+    try:
+        with metrics.mode("self-test"):
+            start = time.perf_counter()
+            worker.start()
+            # The first request includes loading the model
+            if worker.synthesize_pcm(text) is None:
+                raise RuntimeError(" | ".join(list(worker.stderr_tail)[-3:]) or "no audio")
+            result["load_seconds"] = time.perf_counter() - start
+            start = time.perf_counter()
+            audio = worker.synthesize_pcm(text)
+            elapsed = time.perf_counter() - start
+        if audio is None:
+            raise RuntimeError(" | ".join(list(worker.stderr_tail)[-3:]) or "no audio")
+        frames, sample_rate = audio
+        result["seconds"] = elapsed
+        result["audio_seconds"] = len(frames) / 2 / sample_rate
+        result["real_time_factor"] = elapsed / result["audio_seconds"] if result["audio_seconds"] else None
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+    finally:
+        worker.stop()
+    return result
+
+
+def select_binary(runtime, model_path=None, output_raw=True):
+    # The binary this host should run, or None if none works. With a voice
+    # model to test with, every usable binary is self-tested and the one
+    # with the lowest real-time factor wins; results end up in
+    # runtime["self_test"]. Without one, the first usable binary is taken.
+    usable = usable_binaries(runtime)
+    if not usable:
+        return None
+    if model_path is None:
+        return usable[0]
+    results = runtime["self_test"] = [self_test(binary, model_path, output_raw) for binary in usable]
+    working = [
+        (result["real_time_factor"], index)
+        for index, result in enumerate(results) if result["error"] is None and result["real_time_factor"]
+    ]
+    for binary, result in zip(usable, results):
+        binary["problem"] = f"self-test failed: {result['error']}" if result["error"] else None
+    if not working:
+        return None
+    return usable[min(working)[1]]
+
+
+def pinned_environment(runtime, binary):
+    # Environment variables that make other processes started from this one
+    # (batch workers) use `binary` without self-testing again. They resolve
+    # the same runtime, so the binary can be pinned by name; a runtime that
+    # is pinned already stays as it is.
+    environ = {"PIPER_SELF_TEST": "0"}
+    if not runtime["pinned"]:
+        environ["PIPER_BINARY"] = binary["name"]
+    return environ
+
+
+def runtime_problems(runtime):
+    # One line per configured binary that can't be used
+    return [
+        f"{binary['name']}: {binary['problem']}"
+        for binary in runtime["binaries"] if binary.get("problem")
+    ]
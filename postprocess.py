@@ -0,0 +1,222 @@
+import os
+
+import numpy as np
+
+from resample import resample_pcm16
+
+# Per-segment clean-up applied while segments are joined. Defaults for every
+# join; callers can override them per request.
+AUDIO_NORMALIZE = os.environ.get("AUDIO_NORMALIZE", "1") != "0"
+# Gated RMS loudness every segment is brought to
+AUDIO_TARGET_DBFS = float(os.environ.get("AUDIO_TARGET_DBFS", "-20"))
+AUDIO_TRIM_SILENCE = os.environ.get("AUDIO_TRIM_SILENCE", "1") != "0"
+# Frames quieter than this at the start and end of a segment are trimmed,
+# except for AUDIO_TRIM_KEEP_MS of them next to the speech
+AUDIO_TRIM_THRESHOLD_DBFS = float(os.environ.get("AUDIO_TRIM_THRESHOLD_DBFS", "-50"))
+AUDIO_TRIM_KEEP_MS = float(os.environ.get("AUDIO_TRIM_KEEP_MS", "40"))
+# Segments joined without a gap overlap by this much; others fade in and out
+AUDIO_CROSSFADE_MS = float(os.environ.get("AUDIO_CROSSFADE_MS", "10"))
+
+# Analysis frame length, and the loudness block made of several frames
+FRAME_MS = 10
+LOUDNESS_BLOCK_FRAMES = 10
+# Gates of the loudness measurement, like EBU R128: blocks below the
+# absolute gate and blocks 10 dB below the mean of the rest are ignored
+ABSOLUTE_GATE_DBFS = -70.0
+RELATIVE_GATE_DB = -10.0
+# Gain limits: quiet segments aren't blown up and peaks stay below -1 dBFS
+MAX_GAIN_DB = 20.0
+PEAK_CEILING_DBFS = -1.0
+# Samples converted to float at a time, so no segment is ever copied to
+# float32 as a whole
+BLOCK_SAMPLES = 64 * 1024
+
+FULL_SCALE = 32768.0
+
+
+def _to_db(mean_square):
+    return 10 * np.log10(np.maximum(mean_square, 1e-12) / (FULL_SCALE * FULL_SCALE))
+
+
+def frame_energies(samples, frame_samples):
+    # Mean square of every whole frame of int16 samples, converted block by block
+    count = len(samples) // frame_samples
+    energies = np.empty(count, dtype=np.float64)
+    block_frames = max(1, BLOCK_SAMPLES // frame_samples)
+    for first in range(0, count, block_frames):
+        last = min(count, first + block_frames)
+        block = samples[first * frame_samples:last * frame_samples].astype(np.float32).reshape(-1, frame_samples)
+        energies[first:last] = np.einsum('ij,ij->i', block, block, dtype=np.float64) / frame_samples
+    return energies
+
+
+def loudness_dbfs(energies):
+    # Gated loudness of a segment from its frame energies, None for silence
+    blocks = len(energies) // LOUDNESS_BLOCK_FRAMES
+    if blocks:
+        energies = energies[:blocks * LOUDNESS_BLOCK_FRAMES].reshape(blocks, -1).mean(axis=1)
+    gated = energies[_to_db(energies) > ABSOLUTE_GATE_DBFS]
+    if not len(gated):
+        return None
+    gated = gated[_to_db(gated) > _to_db(gated.mean()) + RELATIVE_GATE_DB]
+    return float(_to_db(gated.mean()))
+
+
+def apply_gain(samples, gain):
+    # Scale writable int16 samples in place, with rounding and clipping
+    for start in range(0, len(samples), BLOCK_SAMPLES):
+        block = samples[start:start + BLOCK_SAMPLES].astype(np.float32)
+        block *= gain
+        np.rint(block, out=block)
+        np.clip(block, -32768, 32767, out=block)
+        samples[start:start + BLOCK_SAMPLES] = block
+
+
+def _ramp(num_frames, num_channels):
+    ramp = (np.arange(num_frames, dtype=np.float32) + 0.5) / num_frames
+    return np.repeat(ramp, num_channels) if num_channels > 1 else ramp
+
+
+def _fade(samples, ramp):
+    samples[:] = np.rint(samples * ramp)
+
+
+class PostProcessor:
+    # Cleans up segments one at a time as they are joined: silence at both
+    # ends is trimmed, loudness is normalized, and segments are faded in and
+    # out, or crossfaded when they follow each other without a gap. Works on
+    # int16 and only holds back the last crossfade_ms of the previous
+    # segment, so joins of any length keep their memory use.
+    #
+    # feed() and flush() return (frames, gap_seconds) pieces to append in
+    # order: gap_seconds of silence, then the frames. Silence before the
+    # first frames is never written, like WavConcatenator does. `position`
+    # counts the frames appended so far and `span` is the (first, end) frame
+    # of the last fed segment in the output (None if nothing was left of
+    # it), so timings come out of the join without looking at the audio.
+    def __init__(self, sample_rate=None, num_channels=1, normalize=None, target_dbfs=None, trim=None,
+                 trim_threshold_dbfs=None, trim_keep_ms=None, crossfade_ms=None):
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.normalize = AUDIO_NORMALIZE if normalize is None else normalize
+        self.target_dbfs = AUDIO_TARGET_DBFS if target_dbfs is None else target_dbfs
+        self.trim = AUDIO_TRIM_SILENCE if trim is None else trim
+        self.trim_threshold_dbfs = AUDIO_TRIM_THRESHOLD_DBFS if trim_threshold_dbfs is None else trim_threshold_dbfs
+        self.trim_keep_ms = AUDIO_TRIM_KEEP_MS if trim_keep_ms is None else trim_keep_ms
+        self.crossfade_ms = AUDIO_CROSSFADE_MS if crossfade_ms is None else crossfade_ms
+        self._tail = None
+        self.position = 0
+        self.span = None
+
+    def _frames(self, milliseconds):
+        return int(milliseconds * self.sample_rate / 1000)
+
+    def process(self, frames, sample_rate=None):
+        # One segment trimmed and normalized, as int16 samples at
+        # self.sample_rate (writable only if they had to be changed)
+        sample_rate = sample_rate or self.sample_rate
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+        channels = self.num_channels
+        if sample_rate != self.sample_rate:
+            samples = resample_pcm16(frames, sample_rate, self.sample_rate, channels)
+        else:
+            samples = np.frombuffer(frames, dtype=np.int16)
+        if not (self.normalize or self.trim) or not len(samples):
+            return samples
+
+        frame_samples = max(1, self._frames(FRAME_MS)) * channels
+        energies = frame_energies(samples, frame_samples)
+        if self.trim:
+            loud = np.flatnonzero(_to_db(energies) >= self.trim_threshold_dbfs)
+            if len(loud):
+                keep = self._frames(self.trim_keep_ms) * channels
+                start = max(0, loud[0] * frame_samples - keep)
+                end = min(len(samples), (loud[-1] + 1) * frame_samples + keep)
+                samples = samples[start:end]
+                energies = energies[loud[0]:loud[-1] + 1]
+        if self.normalize:
+            loudness = loudness_dbfs(energies)
+            if loudness is not None:
+                peak = max(int(samples.max()), -int(samples.min()), 1)
+                gain_db = min(
+                    self.target_dbfs - loudness,
+                    MAX_GAIN_DB,
+                    PEAK_CEILING_DBFS - 20 * np.log10(peak / FULL_SCALE)
+                )
+                if abs(gain_db) >= 0.1:
+                    samples = samples.copy()
+                    apply_gain(samples, 10 ** (gain_db / 20))
+        return samples
+
+    def _advance(self, pieces):
+        for piece, gap in pieces:
+            if self.position and gap:
+                self.position += int(gap * self.sample_rate)
+            self.position += len(piece) // (2 * self.num_channels)
+        return pieces
+
+    def feed(self, frames, sample_rate=None, gap_seconds=0.0):
+        # Pieces for one segment that follows gap_seconds of silence
+        samples = self.process(frames, sample_rate)
+        channels = self.num_channels
+        fade_frames = min(self._frames(self.crossfade_ms), len(samples) // channels // 2)
+        if fade_frames <= 0:
+            pieces = self._flush()
+            if len(samples):
+                pieces.append((memoryview(samples).cast('B'), gap_seconds))
+            return self._place(pieces, gap_seconds, len(samples) // channels)
+
+        fade = fade_frames * channels
+        if not samples.flags.writeable:
+            samples = samples.copy()
+        tail, self._tail = self._tail, None
+        if tail is not None and not gap_seconds:
+            # Overlap the end of the previous segment with the start of this one
+            overlap = min(len(tail), fade)
+            pieces = []
+            if len(tail) > overlap:
+                pieces.append((memoryview(tail[:len(tail) - overlap]).cast('B'), 0.0))
+            ramp = _ramp(overlap // channels, channels)
+            mixed = samples[:overlap] * ramp
+            mixed += tail[len(tail) - overlap:] * ramp[::-1]
+            samples[:overlap] = np.clip(np.rint(mixed), -32768, 32767)
+        else:
+            self._tail = tail
+            pieces = self._flush()
+            _fade(samples[:fade], _ramp(fade_frames, channels))
+        pieces.append((memoryview(samples[:len(samples) - fade]).cast('B'), gap_seconds))
+        # Held back until it's known whether the next segment overlaps it
+        self._tail = samples[len(samples) - fade:]
+        return self._place(pieces, gap_seconds, len(samples) // channels)
+
+    def _place(self, pieces, gap_seconds, num_frames):
+        # The segment's own piece comes last, when it has any frames; the
+        # part of it still held back counts as well
+        self.span = None
+        if not num_frames:
+            return self._advance(pieces)
+        self._advance(pieces[:-1])
+        first = self.position + (int(gap_seconds * self.sample_rate) if self.position else 0)
+        self._advance(pieces[-1:])
+        self.span = (first, first + num_frames)
+        return pieces
+
+    def flush(self):
+        # The held back end of the last segment, faded out
+        return self._advance(self._flush())
+
+    def _flush(self):
+        tail, self._tail = self._tail, None
+        if tail is None or not len(tail):
+            return []
+        _fade(tail, _ramp(len(tail) // self.num_channels, self.num_channels)[::-1])
+        return [(memoryview(tail).cast('B'), 0.0)]
+
+
+def make_postprocessor(postprocess, sample_rate=None, num_channels=1):
+    # `postprocess` is a dict of PostProcessor options (None for the
+    # defaults) or False to join segments untouched
+    if postprocess is False:
+        return PostProcessor(sample_rate, num_channels, normalize=False, trim=False, crossfade_ms=0)
+    return PostProcessor(sample_rate, num_channels, **(postprocess or {}))
@@ -0,0 +1,98 @@
+import threading
+from collections import deque
+
+# How often a queued job checks whether the machine is still busy
+BUSY_POLL_SECONDS = 0.1
+
+
+class Prefetcher:
+    # Synthesizes text in the background before anyone asks for it, so it
+    # is in the synthesis cache by the time it is. At most `workers` jobs
+    # run at once, on threads of their own, which keeps it from competing
+    # with interactive requests for more than that many cores. While
+    # `busy()` says other work is using every core, queued jobs wait
+    # instead of starting.
+    #
+    # Jobs are (key, text, model_info) and `synthesize(text, model_info)`
+    # does the work. Every owner (a session) has one batch of jobs:
+    # submitting a new batch cancels what hasn't started of the previous
+    # one. Keys that are already queued or running aren't queued again.
+    def __init__(self, synthesize, workers=1, busy=None):
+        self._synthesize = synthesize
+        self.workers = workers
+        self._busy = busy
+        self._queue = deque()
+        # Owners of every queued key
+        self._queued = {}
+        self._running = set()
+        self._threads = []
+        self._condition = threading.Condition()
+        self.counters = {"queued": 0, "done": 0, "cancelled": 0}
+
+    def submit(self, owner, jobs):
+        # Replace owner's pending jobs; returns how many were queued
+        with self._condition:
+            self._cancel(owner)
+            queued = 0
+            for key, text, model_info in jobs:
+                if key in self._running:
+                    continue
+                if key in self._queued:
+                    self._queued[key].add(owner)
+                    continue
+                self._queue.append((key, text, model_info))
+                self._queued[key] = {owner}
+                queued += 1
+            self.counters["queued"] += queued
+            if queued:
+                self._start_workers()
+                self._condition.notify(queued)
+            return queued
+
+    def cancel(self, owner):
+        with self._condition:
+            self._cancel(owner)
+
+    def _cancel(self, owner):
+        # Caller holds the lock. Jobs already running finish (their audio
+        # still lands in the cache), and jobs other owners want too stay.
+        kept = deque()
+        for job in self._queue:
+            owners = self._queued[job[0]]
+            owners.discard(owner)
+            if owners:
+                kept.append(job)
+            else:
+                del self._queued[job[0]]
+                self.counters["cancelled"] += 1
+        self._queue = kept
+
+    def _start_workers(self):
+        # Caller holds the lock
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True, name=f"prefetch-{len(self._threads)}")
+            self._threads.append(thread)
+            thread.start()
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue or (self._busy is not None and self._busy()):
+                    # Other work doesn't notify when it finishes, hence the timeout
+                    self._condition.wait(BUSY_POLL_SECONDS if self._queue else None)
+                key, text, model_info = self._queue.popleft()
+                del self._queued[key]
+                self._running.add(key)
+            try:
+                self._synthesize(text, model_info)
+            except Exception:
+                pass
+            finally:
+                with self._condition:
+                    self._running.discard(key)
+                    self.counters["done"] += 1
+
+    def pending(self, owner=None):
+        # Jobs not started yet, of one owner or of everybody
+        with self._condition:
+            return sum(1 for key, _, _ in self._queue if owner is None or owner in self._queued[key])
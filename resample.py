@@ -0,0 +1,47 @@
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from scipy.signal import firwin, resample_poly
+
+
+def resample_ratio(from_rate, to_rate):
+    # Smallest (up, down) pair, e.g. 16000 -> 22050 is 441/320
+    divisor = gcd(int(from_rate), int(to_rate))
+    return int(to_rate) // divisor, int(from_rate) // divisor
+
+
+@lru_cache(maxsize=32)
+def filter_bank(up, down):
+    # Same anti-aliasing low-pass filter resample_poly designs by default,
+    # but designed once per rate pair and kept in float32
+    max_rate = max(up, down)
+    half_len = 10 * max_rate
+    taps = firwin(2 * half_len + 1, 1.0 / max_rate, window=('kaiser', 5.0)).astype(np.float32)
+    taps.setflags(write=False)
+    return taps
+
+
+def resample(samples, from_rate, to_rate):
+    # Band-limited polyphase resampling of int16 or float32 samples, shaped
+    # (frames,) or (frames, channels). The result has the same dtype; the
+    # filtering itself runs in float32.
+    if from_rate == to_rate or len(samples) == 0:
+        return samples
+    up, down = resample_ratio(from_rate, to_rate)
+    dtype = samples.dtype
+    resampled = resample_poly(
+        samples.astype(np.float32, copy=False), up, down, axis=0, window=filter_bank(up, down)
+    )
+    if dtype == np.int16:
+        np.rint(resampled, out=resampled)
+        np.clip(resampled, -32768, 32767, out=resampled)
+    return resampled.astype(dtype, copy=False)
+
+
+def resample_pcm16(frames, from_rate, to_rate, num_channels=1):
+    # Resample interleaved 16-bit PCM (bytes or memoryview), returning an int16 array
+    samples = np.frombuffer(frames, dtype=np.int16)
+    if num_channels > 1:
+        samples = samples.reshape(-1, num_channels)
+    return resample(samples, from_rate, to_rate).reshape(-1)
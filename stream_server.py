@@ -0,0 +1,372 @@
+import os
+import re
+import secrets
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Read size when serving files from disk
+FILE_BLOCK_SIZE = 256 * 1024
+
+
+class _ByteBudget:
+    # Bytes of stream chunks held in memory by one server, across streams
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.used += size
+
+    def over(self):
+        with self._lock:
+            return self.used > self.limit
+
+
+def _seal_wav(data):
+    # Streamed WAVs go out with placeholder sizes; fill them in once the
+    # length is known, so the stored copy can be seeked
+    if data[:4] != b"RIFF" or data[36:40] != b"data":
+        return data
+    data = bytearray(data)
+    struct.pack_into("<I", data, 4, len(data) - 8)
+    struct.pack_into("<I", data, 40, len(data) - 44)
+    return data
+
+
+class _Stream:
+    # Chunks produced by one generator. The generator runs on its own thread
+    # when the first listener connects; every listener replays the chunks
+    # produced so far and then follows along as new ones arrive.
+    #
+    # Chunks count against the server's `budget`. Past it, chunks every
+    # listener has read are dropped (so nobody can join from the start any
+    # more) and the producer waits for its listeners to catch up. A stream
+    # that finished with all of its chunks is handed to the `audio_store`
+    # (if any) and served from there; either way its chunks are dropped as
+    # soon as the last listener is done.
+    def __init__(self, stream_factory, content_type, budget, audio_store=None):
+        self.stream_factory = stream_factory
+        self.content_type = content_type
+        self.budget = budget
+        self.audio_store = audio_store
+        self.chunks = []
+        # Chunks dropped from the front, and bytes still held
+        self.first = 0
+        self.size = 0
+        # Index of the next chunk of every listener
+        self.positions = {}
+        self.handle = None
+        self.storing = False
+        self.finished = False
+        self.released = False
+        self.cancelled = False
+        self.started = False
+        self.created = time.monotonic()
+        self.condition = threading.Condition()
+
+    def start(self):
+        with self.condition:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self._produce, daemon=True).start()
+
+    def _drop(self, count):
+        # Caller holds the condition
+        size = sum(len(chunk) for chunk in self.chunks[:count])
+        del self.chunks[:count]
+        self.first += count
+        self.size -= size
+        self.budget.add(-size)
+
+    def _trim(self):
+        # Caller holds the condition: drop the chunks every listener has read
+        read = min(self.positions.values(), default=self.first + len(self.chunks)) - self.first
+        if read > 0:
+            self._drop(read)
+
+    def release(self):
+        # Caller holds the condition: nothing is served from memory any more
+        self._drop(len(self.chunks))
+        self.released = True
+
+    def _produce(self):
+        generator = self.stream_factory()
+        try:
+            for chunk in generator:
+                with self.condition:
+                    if self.cancelled:
+                        break
+                    if not chunk:
+                        continue
+                    self.chunks.append(chunk)
+                    self.size += len(chunk)
+                    self.budget.add(len(chunk))
+                    self.condition.notify_all()
+                    if self.budget.over():
+                        self._trim()
+                        # Still too far ahead of a slow listener: wait for it
+                        # (other streams freeing memory don't notify, hence the timeout)
+                        while self.size and self.budget.over() and not self.cancelled:
+                            self.condition.wait(0.5)
+                            self._trim()
+        finally:
+            # Closing the generator lets it cancel any synthesis still in flight
+            generator.close()
+            with self.condition:
+                self.finished = True
+                self.storing = bool(
+                    not self.cancelled and not self.first and self.chunks and self.audio_store is not None
+                )
+                chunks = list(self.chunks) if self.storing else None
+                self.condition.notify_all()
+            handle = None
+            if chunks:
+                data = b"".join(chunks)
+                if self.content_type == "audio/wav":
+                    data = _seal_wav(data)
+                handle = self.audio_store.put(data, self.content_type)
+            with self.condition:
+                self.handle = handle
+                self.storing = False
+                if not self.positions:
+                    self.release()
+
+    def listen(self, key):
+        # Register a listener; False if the start of the stream is gone
+        with self.condition:
+            if self.first or self.released or self.cancelled:
+                return False
+            self.positions[key] = 0
+        self.start()
+        return True
+
+    def iter_chunks(self, key):
+        index = 0
+        while True:
+            with self.condition:
+                self.positions[key] = index
+                if self.first:
+                    # Past the budget already: free what everyone has read
+                    self._trim()
+                self.condition.notify_all()
+                while index >= self.first + len(self.chunks) and not self.finished:
+                    self.condition.wait()
+                if index >= self.first + len(self.chunks):
+                    return
+                chunk = self.chunks[index - self.first]
+            index += 1
+            yield chunk
+
+    def leave(self, key):
+        # Unregister a listener. Returns True if the stream is of no more use:
+        # abandoned before it finished, or finished without a stored copy.
+        with self.condition:
+            self.positions.pop(key, None)
+            if self.positions:
+                return False
+            if not self.finished:
+                # Nobody is listening to an unfinished stream any more: stop synthesizing
+                self.cancelled = True
+                return True
+            if self.storing:
+                # _produce releases it once the stored copy has its handle
+                return False
+            self.release()
+            return self.handle is None
+
+
+class _FileStream:
+    # A file on disk, served with its length and byte ranges so the browser
+    # can seek without the file ever being read into memory
+    def __init__(self, path, content_type):
+        self.path = path
+        self.content_type = content_type
+        self.cancelled = False
+        self.created = time.monotonic()
+
+
+class AudioStreamServer:
+    # Small chunked-HTTP server for audio that is still being synthesized, so
+    # playback can start as soon as the first sentence is ready. Runs on a
+    # background thread next to the Streamlit server. With an `audio_store`
+    # it also serves the blobs in that store by handle. Listens on loopback
+    # only unless another host is given.
+    # Streams still being produced keep at most about `max_buffered_bytes`
+    # of chunks in memory between them.
+    def __init__(self, host="127.0.0.1", port=8599, public_url=None, ttl=1800, audio_store=None,
+                 max_buffered_bytes=64 * 1024 * 1024):
+        self.public_url = (public_url or f"http://localhost:{port}").rstrip("/")
+        self.ttl = ttl
+        self.audio_store = audio_store
+        self.budget = _ByteBudget(max_buffered_bytes)
+        self._streams = {}
+        self._lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def register(self, stream_factory, content_type="audio/wav"):
+        # stream_factory() must return a generator of bytes chunks
+        self._expire()
+        token = secrets.token_urlsafe(16)
+        with self._lock:
+            self._streams[token] = _Stream(stream_factory, content_type, self.budget, self.audio_store)
+        return f"{self.public_url}/stream/{token}"
+
+    def register_file(self, path, content_type="audio/wav"):
+        # URL for a file on disk; the same file keeps the same URL
+        self._expire()
+        path = str(path)
+        with self._lock:
+            for token, stream in self._streams.items():
+                if isinstance(stream, _FileStream) and stream.path == path:
+                    # Registering again keeps it from expiring
+                    stream.created = time.monotonic()
+                    return f"{self.public_url}/stream/{token}"
+            token = secrets.token_urlsafe(16)
+            self._streams[token] = _FileStream(path, content_type)
+        return f"{self.public_url}/stream/{token}"
+
+    def audio_url(self, handle):
+        # URL of a blob in the audio store
+        return f"{self.public_url}/audio/{handle}"
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for token, stream in list(self._streams.items()):
+                if now - stream.created > self.ttl:
+                    expired.append(stream)
+                    del self._streams[token]
+        for stream in expired:
+            stream.cancelled = True
+            if isinstance(stream, _Stream):
+                with stream.condition:
+                    if not stream.positions:
+                        stream.release()
+                if stream.handle is not None:
+                    self.audio_store.discard(stream.handle)
+
+    def _unregister(self, stream):
+        with self._lock:
+            for token, registered in list(self._streams.items()):
+                if registered is stream:
+                    del self._streams[token]
+
+    def _send_stored(self, request, handle):
+        opened = self.audio_store.open(handle) if handle is not None else None
+        if opened is None:
+            request.send_error(404)
+            return
+        file, size, content_type = opened
+        with file:
+            self._send_body(request, file, size, content_type)
+
+    def _handle(self, request):
+        parts = request.path.split("?")[0].strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "audio" and self.audio_store is not None:
+            self._send_stored(request, parts[1])
+            return
+        with self._lock:
+            stream = self._streams.get(parts[1]) if len(parts) == 2 and parts[0] == "stream" else None
+        if stream is None:
+            request.send_error(404)
+            return
+        if isinstance(stream, _FileStream):
+            self._send_file(request, stream)
+            return
+
+        key = object()
+        if not stream.listen(key):
+            # Finished (served from the audio store, with ranges), or its
+            # start was dropped to stay within the memory budget
+            if stream.handle is not None:
+                self._send_stored(request, stream.handle)
+            else:
+                request.send_error(410 if stream.first else 404)
+            return
+
+        request.send_response(200)
+        request.send_header("Content-Type", stream.content_type)
+        request.send_header("Transfer-Encoding", "chunked")
+        request.send_header("Cache-Control", "no-store")
+        request.end_headers()
+        try:
+            for chunk in stream.iter_chunks(key):
+                request.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                request.wfile.flush()
+            request.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            if stream.leave(key):
+                self._unregister(stream)
+
+    def _send_file(self, request, stream):
+        try:
+            file = open(stream.path, 'rb')
+        except OSError:
+            request.send_error(404)
+            return
+        with file:
+            self._send_body(request, file, os.fstat(file.fileno()).st_size, stream.content_type)
+
+    def _send_body(self, request, file, size, content_type):
+        # Whole file or the requested byte range, read in blocks
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)$", request.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                # bytes=-N is the last N bytes
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                request.send_response(416)
+                request.send_header("Content-Range", f"bytes */{size}")
+                request.send_header("Content-Length", "0")
+                request.end_headers()
+                return
+            request.send_response(206)
+            request.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            request.send_response(200)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(end - start + 1))
+        request.send_header("Accept-Ranges", "bytes")
+        request.send_header("Cache-Control", "no-store")
+        request.end_headers()
+        file.seek(start)
+        remaining = end - start + 1
+        try:
+            while remaining > 0:
+                block = file.read(min(FILE_BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                request.wfile.write(block)
+                remaining -= len(block)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def shutdown(self):
+        self.httpd.shutdown()
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+
+def normalize_text(text):
+    # Whitespace differences don't change what piper says
+    return re.sub(r'\s+', ' ', unicodedata.normalize("NFC", text)).strip()
+
+
+class SynthesisCache:
+    # Two-tier cache for synthesized audio: an in-memory LRU limited by
+    # `memory_budget` bytes in front of an on-disk store limited by
+    # `disk_budget` bytes. Keys are content hashes of the voice, its model
+    # files, the normalized text and the synthesis parameters.
+    def __init__(self, cache_dir, memory_budget=256 * 1024 * 1024, disk_budget=2 * 1024 * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+        self._model_hashes = {}
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0
+        }
+        if disk_budget:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    def _load_disk_index(self):
+        # Oldest files first so they are the first to be evicted
+        entries = []
+        for path in self.cache_dir.glob("*/*.wav"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def model_hash(self, model_path):
+        # Hash the .onnx/.onnx.json pair, memoized on size and mtime so the
+        # model files are only read again when they change
+        model_path = Path(model_path)
+        files = [model_path, model_path.with_suffix('.onnx.json')]
+        stamp = tuple((f.stat().st_size, f.stat().st_mtime_ns) for f in files)
+        cached = self._model_hashes.get(model_path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        digest = hashlib.sha256()
+        for f in files:
+            with open(f, 'rb') as fh:
+                for block in iter(lambda: fh.read(1024 * 1024), b''):
+                    digest.update(block)
+        model_digest = digest.hexdigest()
+        self._model_hashes[model_path] = (stamp, model_digest)
+        return model_digest
+
+    def make_key(self, voice_id, model_path, text, params=None):
+        payload = json.dumps({
+            "voice": voice_id,
+            "model": self.model_hash(model_path),
+            "text": normalize_text(text),
+            "params": params or {}
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.wav"
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return data
+            on_disk = key in self._disk
+
+        if on_disk:
+            path = self._disk_path(key)
+            try:
+                data = path.read_bytes()
+                os.utime(path)
+            except OSError:
+                data = None
+            with self._lock:
+                if data is not None:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self.counters["disk_hits"] += 1
+                    self._put_memory(key, data)
+                    return data
+                # File went missing underneath us
+                self._disk_bytes -= self._disk.pop(key, 0)
+
+        with self._lock:
+            self.counters["misses"] += 1
+        return None
+
+    def __contains__(self, key):
+        # Whether key is cached, without counting as a lookup
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def put(self, key, data):
+        if not data:
+            return
+        with self._lock:
+            self._put_memory(key, data)
+            write_to_disk = self.disk_budget and key not in self._disk and len(data) <= self.disk_budget
+        if write_to_disk:
+            self._put_disk(key, data)
+
+    def _put_memory(self, key, data):
+        # Caller holds the lock
+        if len(data) > self.memory_budget:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.counters["memory_evictions"] += 1
+
+    def _put_disk(self, key, data):
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file and rename so readers never see partial files
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.replace(tmp_name, path)
+        except OSError:
+            Path(tmp_name).unlink(missing_ok=True)
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            while self._disk_bytes > self.disk_budget and self._disk:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.counters["disk_evictions"] += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._disk_path(old_key).unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes
+            }
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._disk)
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._disk.clear()
+            self._disk_bytes = 0
+        for key in keys:
+            self._disk_path(key).unlink(missing_ok=True)
@@ -0,0 +1,75 @@
+# The tests run against benchmarks/fake_piper.py instead of a piper install.
+# tts_core resolves the runtime when it is imported, so the environment is
+# set up here, before any test module imports it.
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+FAKE_PIPER = ROOT / "benchmarks" / "fake_piper.py"
+VOICE_ID = "en_US-hfc_female-medium"
+SAMPLE_RATE = 22050
+
+_runtime_dir = Path(tempfile.mkdtemp(prefix="piper_tts_tests_"))
+atexit.register(shutil.rmtree, _runtime_dir, True)
+
+
+def _make_fake_runtime(root):
+    # A piper directory with the stub as its executable and one empty model
+    models_dir = root / "models"
+    models_dir.mkdir(parents=True)
+    model_path = models_dir / f"{VOICE_ID}.onnx"
+    model_path.write_bytes(b"")
+    model_path.with_suffix(".onnx.json").write_text(json.dumps({
+        "audio": {"sample_rate": SAMPLE_RATE, "quality": "medium"},
+        "espeak": {"voice": "en-us"},
+        "language": {"code": "en_US"},
+        "num_speakers": 1
+    }), encoding="utf-8")
+
+    command = [sys.executable, str(FAKE_PIPER)]
+    if os.name == "nt":
+        launcher = root / "piper.cmd"
+        launcher.write_text("@" + subprocess.list2cmdline(command) + " %*\r\n", encoding="utf-8")
+    else:
+        launcher = root / "piper"
+        launcher.write_text("#!/bin/sh\nexec " + " ".join(f"'{part}'" for part in command) + ' "$@"\n', encoding="utf-8")
+        launcher.chmod(0o755)
+    return launcher, models_dir
+
+
+_launcher, _models_dir = _make_fake_runtime(_runtime_dir)
+os.environ.update({
+    "PIPER_CONFIG": str(_runtime_dir / "piper_runtime.json"),
+    "PIPER_DIR": str(_runtime_dir),
+    "PIPER_MODELS_DIR": str(_models_dir),
+    "PIPER_BINARY": str(_launcher),
+    "PIPER_SELF_TEST": "0",
+    "PREFETCH_WORKERS": "0",
+    "SYNTHESIS_CACHE_DIR": str(_runtime_dir / "cache"),
+    "AUDIO_STORE_DIR": str(_runtime_dir / "sessions"),
+    "LONG_JOB_DIR": str(_runtime_dir / "jobs")
+})
+
+
+def tone_wav(seconds, sample_rate=SAMPLE_RATE, amplitude=8000, frequency=220):
+    # A mono 16-bit WAV of a sine tone
+    from backends import pcm_to_wav
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    return pcm_to_wav((np.sin(2 * np.pi * frequency * t) * amplitude).astype(np.int16), sample_rate)
+
+
+@pytest.fixture
+def model_info():
+    import tts_core
+    return tts_core.find_voice(tts_core.get_available_models(), VOICE_ID)
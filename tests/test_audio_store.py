@@ -0,0 +1,70 @@
+from audio_store import AudioStore
+
+
+def blob(value, size=60):
+    return bytes([value]) * size
+
+
+def test_put_and_get(tmp_path):
+    store = AudioStore(tmp_path, memory_budget=1000, disk_budget=1000)
+    handle = store.put(blob(1), "audio/ogg")
+    assert handle in store
+    assert store.get(handle) == blob(1)
+    assert store.content_type(handle) == "audio/ogg"
+    assert store.size(handle) == 60
+    assert store.size("unknown") is None
+    file, size, content_type = store.open(handle)
+    with file:
+        assert (file.read(), size, content_type) == (blob(1), 60, "audio/ogg")
+
+
+def test_least_recently_used_blobs_spill_to_disk(tmp_path):
+    store = AudioStore(tmp_path, memory_budget=150, disk_budget=1000)
+    first, second = store.put(blob(1)), store.put(blob(2))
+    # Using the first blob makes the second the least recently used
+    store.get(first)
+    third = store.put(blob(3))
+
+    stats = store.stats()
+    assert (stats["memory_entries"], stats["memory_bytes"]) == (2, 120)
+    assert (stats["disk_entries"], stats["disk_bytes"]) == (1, 60)
+    assert stats["spills"] == 1
+    # Spilled blobs are still served, from disk
+    assert [store.get(handle) for handle in (first, second, third)] == [blob(1), blob(2), blob(3)]
+
+
+def test_disk_tier_evicts_the_oldest_blobs(tmp_path):
+    store = AudioStore(tmp_path, memory_budget=60, disk_budget=130)
+    handles = [store.put(blob(value)) for value in range(5)]
+
+    # One blob in memory, the two most recent spills on disk, the rest gone
+    assert [handle in store for handle in handles] == [False, False, True, True, True]
+    assert store.get(handles[0]) is None
+    assert store.open(handles[1]) is None
+    assert store.get(handles[2]) == blob(2)
+    assert [store.size(handle) for handle in handles] == [None, None, 60, 60, 60]
+    stats = store.stats()
+    assert stats["evictions"] == 2
+    assert stats["disk_bytes"] <= 130
+    assert len(list(store.dir.iterdir())) == 2
+
+
+def test_without_disk_overflow_is_dropped(tmp_path):
+    store = AudioStore(tmp_path, memory_budget=100, disk_budget=0)
+    first, second = store.put(blob(1)), store.put(blob(2))
+    assert first not in store
+    assert store.get(second) == blob(2)
+    assert store.stats()["evictions"] == 1
+
+
+def test_discard_frees_memory_and_disk(tmp_path):
+    store = AudioStore(tmp_path, memory_budget=60, disk_budget=1000)
+    on_disk, in_memory = store.put(blob(1)), store.put(blob(2))
+    store.discard(on_disk)
+    store.discard(in_memory)
+    store.discard("unknown")
+
+    stats = store.stats()
+    assert stats["memory_bytes"] == stats["disk_bytes"] == 0
+    assert on_disk not in store and in_memory not in store
+    assert list(store.dir.iterdir()) == []
@@ -0,0 +1,40 @@
+import time
+
+import pytest
+
+from chunker import chunk_text, finished_chunks, split_sentence_spans
+
+# Runs that used to be retried at every position inside them, taking
+# seconds to chunk
+RUNS = {
+    "spaces": "Hello" + " " * 20000 + "world.",
+    "tabs": "Hello" + "\t" * 20000 + "world.",
+    "line breaks": "Done." + "\n" * 20000 + "Next.",
+    "dots": "Wait" + "." * 20000 + "x",
+    "dashes": "Wait" + " - " * 7000 + "and" + " " * 7000
+}
+
+
+@pytest.mark.parametrize("name", RUNS)
+def test_long_runs_are_chunked_in_linear_time(name):
+    text = RUNS[name]
+    started = time.perf_counter()
+    chunks = chunk_text(text, max_chars=300)
+    finished_chunks(text, max_chars=300)
+    assert time.perf_counter() - started < 1.0
+    assert chunks and all(chunk["end"] - chunk["start"] <= 300 for chunk in chunks)
+
+
+def test_whitespace_padding_keeps_sentence_offsets():
+    text = "First one." + " " * 5000 + "Second one.\t\t\t\n" + " " * 5000 + "Third"
+    spans = split_sentence_spans(text)
+    assert [text[start:end] for start, end, _ in spans] == ["First one.", "Second one.", "Third"]
+    assert [line_end for _, _, line_end in spans] == [False, True, True]
+
+
+def test_unfinished_last_sentence_is_left_out():
+    assert [chunk["text"] for chunk in finished_chunks("A first sentence. And one being typ")] == [
+        "A first sentence."
+    ]
+    assert len(finished_chunks("A first sentence. And a second one.   ")) == 2
+    assert len(finished_chunks("A heading without a stop\n")) == 1
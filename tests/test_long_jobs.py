@@ -0,0 +1,90 @@
+import json
+import threading
+
+import pytest
+
+import long_jobs
+import tts_core
+from long_jobs import create_job, get_job
+from wav_concat import read_wav
+
+TEXT = " ".join(f"This is sentence number {index} of a long document." for index in range(12))
+
+
+@pytest.fixture
+def job_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(long_jobs, "LONG_JOB_DIR", tmp_path / "jobs")
+    return tmp_path / "jobs"
+
+
+def render(model_info, **kwargs):
+    job = create_job(TEXT, [model_info], gap_seconds=0.2, **kwargs)
+    assert job.run(tts_core.get_available_models())
+    return job
+
+
+def test_same_job_is_found_again(job_dir, model_info):
+    job = create_job(TEXT, [model_info], gap_seconds=0.2)
+    assert create_job(TEXT, [model_info], gap_seconds=0.2).id == job.id
+    assert create_job(TEXT, [model_info], gap_seconds=0.3).id != job.id
+    assert create_job(TEXT, [model_info], gap_seconds=0.2, postprocess={"trim": False}).id != job.id
+
+
+def test_resume_after_a_crash_past_the_checkpoint(job_dir, tmp_path, model_info, monkeypatch):
+    # Reference: the same job rendered in one go
+    monkeypatch.setattr(long_jobs, "LONG_JOB_DIR", tmp_path / "reference")
+    reference = render(model_info)
+    expected_audio = reference.audio_path.read_bytes()
+    expected_timing = reference.timing()
+    monkeypatch.setattr(long_jobs, "LONG_JOB_DIR", job_dir)
+
+    # Stop after a few chunks
+    job = create_job(TEXT, [model_info], gap_seconds=0.2)
+    cancel_event = threading.Event()
+    finished = job.run(
+        tts_core.get_available_models(),
+        on_progress=lambda completed, total: completed >= 3 and cancel_event.set(),
+        cancel_event=cancel_event
+    )
+    assert not finished
+    completed = job.state["completed"]
+    assert 3 <= completed < job.state["chunks"]
+    assert job.status == "paused"
+
+    # Then crash while writing the next chunk: part of its audio and timing
+    # reached the disk, the checkpoint didn't
+    with open(job.audio_path, "ab") as f:
+        f.write(b"\x01\x02" * 5000)
+    with open(job.timing_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"segment": completed, "start": 99.0, "end": 100.0}) + "\n")
+        f.write('{"segment": ')
+    state = json.loads((job.dir / "job.json").read_text(encoding="utf-8"))
+    state["status"] = "running"
+    (job.dir / "job.json").write_text(json.dumps(state), encoding="utf-8")
+
+    resumed = get_job(job.id)
+    assert resumed.status == "paused"
+    assert resumed.run(tts_core.get_available_models())
+    assert resumed.done
+    assert resumed.state["completed"] == resumed.state["chunks"]
+
+    audio = resumed.audio_path.read_bytes()
+    assert audio == expected_audio
+    _, frames = read_wav(audio)
+    assert len(frames) == resumed.state["data_size"]
+    assert resumed.timing() == expected_timing
+    assert [sentence["index"] for sentence in resumed.timing()] == list(range(resumed.state["chunks"]))
+
+
+def test_finished_job_is_not_rendered_again(job_dir, model_info):
+    job = render(model_info)
+    size = job.audio_path.stat().st_size
+    assert get_job(job.id).run(tts_core.get_available_models())
+    assert job.audio_path.stat().st_size == size
+
+
+def test_missing_voice_fails_the_job(job_dir, model_info):
+    job = create_job(TEXT, [model_info], gap_seconds=0.2)
+    assert not job.run({})
+    assert job.state["status"] == "failed"
+    assert "not installed" in job.state["error"]
@@ -0,0 +1,59 @@
+import threading
+import time
+
+import tts_core
+from prefetch import Prefetcher
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_jobs_wait_while_busy():
+    done = []
+    busy = threading.Event()
+    busy.set()
+    prefetcher = Prefetcher(lambda text, model_info: done.append(text), busy=busy.is_set)
+    assert prefetcher.submit("session", [("a", "first", None), ("b", "second", None)]) == 2
+    time.sleep(0.3)
+    assert done == [] and prefetcher.pending() == 2
+
+    busy.clear()
+    wait_for(lambda: done == ["first", "second"])
+    assert prefetcher.pending() == 0
+
+
+def test_new_batch_replaces_what_has_not_started():
+    release = threading.Event()
+    done = []
+
+    def synthesize(text, model_info):
+        release.wait(5)
+        done.append(text)
+
+    prefetcher = Prefetcher(synthesize)
+    prefetcher.submit("session", [("a", "first", None), ("b", "second", None)])
+    wait_for(lambda: prefetcher.pending() == 1)
+    # "first" is running and finishes, "second" is dropped
+    prefetcher.submit("session", [("c", "third", None)])
+    assert prefetcher.pending("session") == 1
+    release.set()
+    wait_for(lambda: done == ["first", "third"])
+    assert prefetcher.counters["cancelled"] == 1
+
+
+def test_prefetch_leaves_a_slot_free():
+    assert tts_core.PREFETCH_MAX_RUNNING < max(2, tts_core.SYNTHESIS_MAX_CONCURRENCY)
+    slots = tts_core.get_synthesis_slots()
+    taken = 0
+    while slots.acquire(blocking=False):
+        taken += 1
+    try:
+        assert tts_core.synthesis_slots_busy()
+    finally:
+        for _ in range(taken):
+            slots.release()
+    assert not tts_core.synthesis_slots_busy()
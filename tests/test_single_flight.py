@@ -0,0 +1,69 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_one_key_run_once():
+    flights = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flights.do, "key", work, 21)
+        # The followers must join while the leader is still running
+        while not calls:
+            threading.Event().wait(0.001)
+        followers = [executor.submit(flights.do, "key", work, 21) for _ in range(3)]
+        threading.Event().wait(0.2)
+        release.set()
+        results = [leader.result(5)] + [future.result(5) for future in followers]
+
+    assert calls == [21]
+    assert results[0] == (42, False)
+    assert results[1:] == [(42, True)] * 3
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+
+
+def test_nothing_is_kept_after_a_call():
+    flights = SingleFlight()
+    counter = iter(range(10))
+    assert flights.do("key", next, counter) == (0, False)
+    assert flights.do("key", next, counter) == (1, False)
+
+
+def test_followers_get_the_leaders_exception():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("boom")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, "key", fail)
+        started.wait(5)
+        follower = executor.submit(flights.do, "key", fail)
+        threading.Event().wait(0.2)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result(5)
+        with pytest.raises(ValueError):
+            follower.result(5)
+
+    # A failed call doesn't stick either
+    assert flights.do("key", lambda: "ok") == ("ok", False)
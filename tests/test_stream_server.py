@@ -0,0 +1,226 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from audio_store import AudioStore
+from stream_server import AudioStreamServer
+from wav_concat import read_wav, wav_header
+
+CHUNKS = [bytes([value]) * 100 for value in range(10)]
+
+
+def make_server(tmp_path, audio_store=True, max_buffered_bytes=1024 * 1024):
+    store = AudioStore(tmp_path, memory_budget=1024 * 1024, disk_budget=0) if audio_store else None
+    server = AudioStreamServer(port=0, audio_store=store, max_buffered_bytes=max_buffered_bytes)
+    server.public_url = f"http://127.0.0.1:{server.httpd.server_address[1]}"
+    return server
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = make_server(tmp_path)
+    yield server
+    server.shutdown()
+
+
+def slow(chunks, delay=0.005):
+    def generate():
+        for chunk in chunks:
+            time.sleep(delay)
+            yield chunk
+    return generate
+
+
+def fetch(url, range_header=None):
+    headers = {"Range": range_header} if range_header else {}
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=10) as response:
+        return response.status, response.headers, response.read()
+
+
+def stream_of(server, url):
+    token = url.rsplit("/", 1)[1]
+    return server._streams.get(token)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_listener_gets_every_chunk_in_order(server):
+    url = server.register(slow(CHUNKS), "audio/ogg")
+    status, headers, body = fetch(url)
+    assert status == 200
+    assert headers["Transfer-Encoding"] == "chunked"
+    assert "Access-Control-Allow-Origin" not in headers
+    assert body == b"".join(CHUNKS)
+
+
+def test_finished_stream_is_served_from_the_store_with_ranges(server):
+    url = server.register(slow(CHUNKS), "audio/ogg")
+    fetch(url)
+    stream = stream_of(server, url)
+    wait_for(lambda: stream.handle is not None and stream.released)
+    # Nothing of it is left in the stream buffers
+    assert stream.chunks == [] and server.budget.used == 0
+    assert stream.handle in server.audio_store
+
+    status, headers, body = fetch(url, "bytes=150-349")
+    assert status == 206
+    assert headers["Content-Range"] == "bytes 150-349/1000"
+    assert body == b"".join(CHUNKS)[150:350]
+
+    status, headers, body = fetch(url, "bytes=-50")
+    assert (status, headers["Content-Range"], body) == (206, "bytes 950-999/1000", CHUNKS[9][:50])
+
+    status, headers, body = fetch(url)
+    assert (status, headers["Content-Length"], body) == (200, "1000", b"".join(CHUNKS))
+
+    with pytest.raises(urllib.error.HTTPError) as error:
+        fetch(url, "bytes=2000-")
+    assert error.value.code == 416
+
+
+def test_request_while_the_stream_is_being_stored(tmp_path):
+    putting = threading.Event()
+    release = threading.Event()
+
+    class SlowStore(AudioStore):
+        def put(self, data, content_type="audio/wav"):
+            putting.set()
+            release.wait(5)
+            return super().put(data, content_type)
+
+    server = AudioStreamServer(port=0, audio_store=SlowStore(tmp_path, memory_budget=1024 * 1024, disk_budget=0))
+    server.public_url = f"http://127.0.0.1:{server.httpd.server_address[1]}"
+    try:
+        url = server.register(slow(CHUNKS), "audio/ogg")
+        assert fetch(url)[2] == b"".join(CHUNKS)
+        assert putting.wait(5)
+        # The last listener left while the copy was being stored
+        stream = stream_of(server, url)
+        assert stream is not None and not stream.released
+        assert fetch(url)[2] == b"".join(CHUNKS)
+        release.set()
+        wait_for(lambda: stream.handle is not None and stream.released)
+        assert fetch(url, "bytes=0-99")[2] == CHUNKS[0]
+    finally:
+        release.set()
+        server.shutdown()
+
+
+def test_stored_wav_gets_its_sizes_filled_in(server):
+    pcm = bytes(range(256)) * 8
+    url = server.register(slow([wav_header(22050, 1, 2), pcm[:1000], pcm[1000:]]), "audio/wav")
+    fetch(url)
+    stream = stream_of(server, url)
+    wait_for(lambda: stream.handle is not None)
+
+    _, _, body = fetch(url)
+    fmt, frames = read_wav(body)
+    assert bytes(frames) == pcm
+    assert int.from_bytes(body[40:44], "little") == len(pcm)
+    assert int.from_bytes(body[4:8], "little") == len(body) - 8
+
+
+def test_a_late_listener_replays_from_the_start(server):
+    release = threading.Event()
+
+    def generate():
+        yield CHUNKS[0]
+        release.wait(5)
+        yield from CHUNKS[1:]
+
+    url = server.register(generate, "audio/ogg")
+    results = []
+    first = threading.Thread(target=lambda: results.append(fetch(url)[2]))
+    first.start()
+    stream = stream_of(server, url)
+    wait_for(lambda: stream.chunks)
+    second = threading.Thread(target=lambda: results.append(fetch(url)[2]))
+    second.start()
+    wait_for(lambda: len(stream.positions) == 2)
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert results == [b"".join(CHUNKS)] * 2
+
+
+def test_buffering_over_budget_drops_what_was_read(tmp_path):
+    server = make_server(tmp_path, max_buffered_bytes=250)
+    try:
+        url = server.register(slow(CHUNKS), "audio/ogg")
+        stream = stream_of(server, url)
+        peak = []
+        sampler_done = threading.Event()
+
+        def sample():
+            while not sampler_done.is_set():
+                peak.append(server.budget.used)
+                time.sleep(0.001)
+
+        sampler = threading.Thread(target=sample)
+        sampler.start()
+        _, _, body = fetch(url)
+        sampler_done.set()
+        sampler.join()
+
+        assert body == b"".join(CHUNKS)
+        assert max(peak) <= 250 + 100
+        wait_for(lambda: server.budget.used == 0)
+        # Its start is gone, so it can't be replayed or stored
+        assert stream.handle is None
+        with pytest.raises(urllib.error.HTTPError) as error:
+            fetch(url)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+
+
+def test_without_a_store_the_stream_is_dropped_once_read(tmp_path):
+    server = make_server(tmp_path, audio_store=False)
+    try:
+        url = server.register(slow(CHUNKS), "audio/ogg")
+        stream = stream_of(server, url)
+        assert fetch(url)[2] == b"".join(CHUNKS)
+        wait_for(lambda: stream.released)
+        assert server.budget.used == 0
+        with pytest.raises(urllib.error.HTTPError) as error:
+            fetch(url)
+        assert error.value.code == 404
+    finally:
+        server.shutdown()
+
+
+def test_abandoned_stream_stops_its_generator(server):
+    closed = threading.Event()
+
+    def generate():
+        try:
+            while True:
+                time.sleep(0.005)
+                yield b"x" * 1000
+        finally:
+            closed.set()
+
+    url = server.register(generate, "audio/ogg")
+    response = urllib.request.urlopen(url, timeout=10)
+    response.read(5000)
+    response.close()
+    assert closed.wait(5)
+    wait_for(lambda: stream_of(server, url) is None)
+    wait_for(lambda: server.budget.used == 0)
+
+
+def test_file_streams_serve_ranges(server, tmp_path):
+    path = tmp_path / "audio.bin"
+    path.write_bytes(bytes(range(256)))
+    url = server.register_file(path, "audio/wav")
+    assert server.register_file(path, "audio/wav") == url
+    status, headers, body = fetch(url, "bytes=10-19")
+    assert (status, headers["Content-Range"], body) == (206, "bytes 10-19/256", bytes(range(10, 20)))
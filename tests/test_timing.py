@@ -0,0 +1,93 @@
+import json
+
+import numpy as np
+import pytest
+
+from backends import pcm_to_wav
+from chunker import chunk_text
+from conftest import SAMPLE_RATE, tone_wav
+from timing import build_index, export_timing
+from wav_concat import concat_wavs, read_wav
+
+TEXT = "The first sentence is the longest one here. A second one follows. And the third ends it."
+DURATIONS = [1.0, 0.5, 0.75]
+GAP = 0.25
+
+
+def samples_of(wav_bytes):
+    _, frames = read_wav(wav_bytes)
+    return np.frombuffer(bytes(frames), dtype=np.int16)
+
+
+def padded_tone(seconds, padding=0.3):
+    silence = np.zeros(int(padding * SAMPLE_RATE), dtype=np.int16)
+    tone = samples_of(tone_wav(seconds))
+    return pcm_to_wav(np.concatenate([silence, tone, silence]), SAMPLE_RATE)
+
+
+def test_spans_without_postprocessing_are_exact():
+    timings = []
+    joined = concat_wavs([tone_wav(seconds) for seconds in DURATIONS], gap_seconds=GAP,
+                         postprocess=False, timings=timings)
+
+    # In frames: the gaps are whole frames too
+    expected = []
+    position = 0
+    for segment, seconds in enumerate(DURATIONS):
+        expected.append((segment, position, position + int(seconds * SAMPLE_RATE)))
+        position = expected[-1][2] + int(GAP * SAMPLE_RATE)
+    assert [
+        (entry["segment"], round(entry["start"] * SAMPLE_RATE), round(entry["end"] * SAMPLE_RATE))
+        for entry in timings
+    ] == expected
+    assert len(samples_of(joined)) == expected[-1][2]
+
+
+def test_spans_follow_trimmed_speech():
+    timings = []
+    joined = samples_of(concat_wavs([padded_tone(seconds) for seconds in DURATIONS], gap_seconds=GAP,
+                                    timings=timings))
+
+    for entry, seconds in zip(timings, DURATIONS):
+        # The padding is trimmed away, apart from a short margin
+        assert seconds <= entry["end"] - entry["start"] < seconds + 0.3
+        start, end = (int(entry[key] * SAMPLE_RATE) for key in ("start", "end"))
+        assert np.abs(joined[start:end]).max() > 1000
+    # Between the spans there is only the gap's silence
+    for previous, following in zip(timings, timings[1:]):
+        assert following["start"] - previous["end"] == pytest.approx(GAP, abs=1 / SAMPLE_RATE)
+        start, end = int(previous["end"] * SAMPLE_RATE) + 1, int(following["start"] * SAMPLE_RATE)
+        assert not joined[start:end].any()
+
+
+def test_exported_timing_matches_the_spans():
+    segments = chunk_text(TEXT, min_chars=0)
+    assert len(segments) == len(DURATIONS)
+    timings = []
+    concat_wavs([tone_wav(seconds) for seconds in DURATIONS], gap_seconds=GAP,
+                postprocess=False, timings=timings)
+    index = build_index(TEXT, segments, timings)
+
+    assert [sentence["text"] for sentence in index] == [
+        "The first sentence is the longest one here.", "A second one follows.", "And the third ends it."
+    ]
+    for sentence, entry in zip(index, timings):
+        assert sentence["start"] == round(entry["start"], 3)
+        assert sentence["end"] == round(entry["end"], 3)
+        words = sentence["words"]
+        assert words[0]["start"] == sentence["start"]
+        assert words[-1]["end"] == pytest.approx(sentence["end"], abs=0.002)
+        assert all(a["end"] <= b["start"] for a, b in zip(words, words[1:]))
+
+    srt = export_timing(index, "srt")
+    assert srt.splitlines()[:3] == ["1", "00:00:00,000 --> 00:00:01,000", index[0]["text"]]
+    assert "2\n00:00:01,250 --> 00:00:01,750\nA second one follows.\n" in srt
+    assert "3\n00:00:02,000 --> 00:00:02,750\n" in srt
+
+    vtt = export_timing(index, "vtt")
+    assert vtt.startswith("WEBVTT\n")
+    assert "2\n00:00:01.250 --> 00:00:01.750\nA <00:00:01." in vtt
+
+    assert json.loads(export_timing(index, "json"))["sentences"] == index
+    with pytest.raises(ValueError):
+        export_timing(index, "txt")
@@ -0,0 +1,149 @@
+import json
+import re
+
+# Where each sentence (and word) of joined audio is heard, built from the
+# segment positions the join already tracks (see PostProcessor.span)
+# instead of a separate alignment pass over the audio.
+#
+# An index is a list of sentences:
+#   {"index", "text", "start", "end", "char_start", "char_end", "words"}
+# with start/end in seconds of the output and char_start/char_end into the
+# original text ("voice" too for mixed voices). Words have the same keys
+# (except "index" and "words"). Neither the piper executable nor its ONNX
+# exports report phoneme durations, so word times are estimated: the
+# sentence's speech is shared out by the number of letters in each word,
+# with pauses for the punctuation after it.
+
+TIMING_FORMATS = {
+    "srt": {"mime": "application/x-subrip", "extension": "srt"},
+    "vtt": {"mime": "text/vtt", "extension": "vtt"},
+    "json": {"mime": "application/json", "extension": "json"}
+}
+
+_WORD = re.compile(r"\S+")
+_LETTER = re.compile(r"\w")
+# Pause after a word, in letters, by the punctuation it ends with
+_PAUSES = {",": 2, ";": 3, ":": 3, "-": 2, ".": 4, "!": 4, "?": 4}
+
+
+def _pause(word):
+    stripped = word.rstrip("\"')]}»”’")
+    return _PAUSES.get(stripped[-1:], 0) if stripped else 0
+
+
+def estimate_words(text, char_start, char_end, start, end):
+    # Words of text[char_start:char_end] spread over start..end seconds
+    words = [
+        (match.start(), match.end(), match.group())
+        for match in _WORD.finditer(text, char_start, char_end)
+    ]
+    if not words:
+        return []
+    weights = [max(1, len(_LETTER.findall(word))) for _, _, word in words]
+    # The pause after the last word is part of the trimmed silence
+    pauses = [_pause(word) for _, _, word in words[:-1]] + [0]
+    seconds_per_letter = max(0.0, end - start) / (sum(weights) + sum(pauses))
+    result = []
+    position = start
+    for (first, last, word), weight, pause in zip(words, weights, pauses):
+        word_end = position + weight * seconds_per_letter
+        result.append({
+            "text": word,
+            "start": round(position, 3),
+            "end": round(word_end, 3),
+            "char_start": first,
+            "char_end": last
+        })
+        position = word_end + pause * seconds_per_letter
+    return result
+
+
+def build_index(text, segments, timings):
+    # Sentence index of joined audio. `segments` are the joined pieces in
+    # order, dicts with the "start"/"end" of their text (chunks from
+    # chunk_text, or the sentences of generate_mixed_voices_audio); the
+    # chunks of one "group" make one sentence. `timings` are the
+    # {"segment", "start", "end"} entries concat_wavs collected.
+    index = []
+    previous_group = None
+    for timing in timings:
+        segment = segments[timing["segment"]]
+        group = segment.get("group", timing["segment"])
+        words = estimate_words(text, segment["start"], segment["end"], timing["start"], timing["end"])
+        if index and group == previous_group:
+            # Another chunk of a long sentence
+            sentence = index[-1]
+            sentence["end"] = round(timing["end"], 3)
+            sentence["char_end"] = segment["end"]
+            sentence["words"] += words
+        else:
+            sentence = {
+                "index": len(index),
+                "start": round(timing["start"], 3),
+                "end": round(timing["end"], 3),
+                "char_start": segment["start"],
+                "char_end": segment["end"],
+                "words": words
+            }
+            if "voice" in segment:
+                sentence["voice"] = segment["voice"]
+            index.append(sentence)
+        sentence["text"] = " ".join(text[sentence["char_start"]:sentence["char_end"]].split())
+        previous_group = group
+    return index
+
+
+def _timestamp(seconds, separator):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def _escape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def to_srt(index):
+    cues = []
+    for number, sentence in enumerate(index, 1):
+        cues.append(
+            f"{number}\n{_timestamp(sentence['start'], ',')} --> {_timestamp(sentence['end'], ',')}\n"
+            f"{sentence['text']}\n"
+        )
+    return "\n".join(cues)
+
+
+def to_webvtt(index, words=True):
+    # One cue per sentence; with words=True every word after the first is
+    # preceded by its start time, which players use to highlight it
+    cues = ["WEBVTT\n"]
+    for number, sentence in enumerate(index, 1):
+        if words and sentence["words"]:
+            first, *rest = sentence["words"]
+            body = " ".join(
+                [_escape(first["text"])]
+                + [f"<{_timestamp(word['start'], '.')}>{_escape(word['text'])}" for word in rest]
+            )
+        else:
+            body = _escape(sentence["text"])
+        cues.append(
+            f"{number}\n{_timestamp(sentence['start'], '.')} --> {_timestamp(sentence['end'], '.')}\n{body}\n"
+        )
+    return "\n".join(cues)
+
+
+def to_json(index):
+    return json.dumps({"sentences": index, "word_timing": "estimated"}, indent=2, ensure_ascii=False)
+
+
+def export_timing(index, timing_format):
+    # The index as text in one of TIMING_FORMATS
+    if timing_format == "srt":
+        return to_srt(index)
+    if timing_format == "vtt":
+        return to_webvtt(index)
+    if timing_format == "json":
+        return to_json(index)
+    raise ValueError(f"Unknown timing format: {timing_format}")
@@ -0,0 +1,609 @@
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from functools import wraps
+from pathlib import Path
+
+import numpy as np
+
+import metrics
+from audio_store import AudioStore
+from backends import SubprocessBackend, OnnxBackend
+from chunker import chunk_gaps, chunk_text, finished_chunks, group_chunks
+from encoders import StreamEncoder, encoder_sample_rate
+from metrics import METRICS
+from piper_pool import PiperPool
+from piper_runtime import load_runtime, runtime_problems, select_binary
+from postprocess import make_postprocessor
+from prefetch import Prefetcher
+from single_flight import SingleFlight
+from synthesis_cache import SynthesisCache
+from timing import build_index
+from voice_registry import VoiceRegistry
+from wav_concat import concat_wavs, read_wav, wav_header
+
+# Voice configurations
+VOICE_CONFIGS = [
+    {
+        "id": "en_US-hfc_female-medium",
+        "name": "HFC Female (Medium)",
+        "file": "en_US-hfc_female-medium.onnx",
+        "quality": "medium",
+        "gender": "female"
+    },
+    {
+        "id": "en_US-ljspeech-high",
+        "name": "LJSpeech (High)",
+        "file": "en_US-ljspeech-high.onnx",
+        "quality": "high",
+        "gender": "female"
+    },
+    {
+        "id": "en_GB-cori-high",
+        "name": "Cori (High)",
+        "file": "en_GB-cori-high.onnx",
+        "quality": "high",
+        "gender": "female"
+    },
+    {
+        "id": "en_US-amy-medium",
+        "name": "Amy (Medium)",
+        "file": "en_US-amy-medium.onnx",
+        "quality": "medium",
+        "gender": "female"
+    },
+    {
+        "id": "en_US-bryce-medium",
+        "name": "Bryce (Medium)",
+        "file": "en_US-bryce-medium.onnx",
+        "quality": "medium",
+        "gender": "male"
+    },
+    {
+        "id": "en_US-danny-low",
+        "name": "Danny (Low)",
+        "file": "en_US-danny-low.onnx",
+        "quality": "low",
+        "gender": "male"
+    },
+    {
+        "id": "en_US-hfc_male-medium",
+        "name": "HFC Male (Medium)",
+        "file": "en_US-hfc_male-medium.onnx",
+        "quality": "medium",
+        "gender": "male"
+    },
+    {
+        "id": "en_US-lessac-high",
+        "name": "Lessac (High)",
+        "file": "en_US-lessac-high.onnx",
+        "quality": "high",
+        "gender": "female"
+    },
+    {
+        "id": "en_US-ryan-high",
+        "name": "Ryan (High)",
+        "file": "en_US-ryan-high.onnx",
+        "quality": "high",
+        "gender": "male"
+    }
+]
+
+# Piper install: environment variables, piper_runtime.json or the usual
+# install locations (see piper_runtime.py)
+PIPER_RUNTIME = load_runtime()
+PIPER_DIR = PIPER_RUNTIME["piper_dir"]
+MODELS_DIR = PIPER_RUNTIME["models_dir"]
+# Self-test the piper binaries at startup and run the fastest
+PIPER_SELF_TEST = os.environ.get("PIPER_SELF_TEST", "1") != "0"
+
+# Voice used when none is picked
+DEFAULT_VOICE = "HFC Female (Medium)"
+
+def find_voice(available_models, voice=None):
+    # Look a voice up by name or id; None picks the default voice
+    if voice is None:
+        if DEFAULT_VOICE in available_models:
+            return available_models[DEFAULT_VOICE]
+        return next(iter(available_models.values()), None)
+    for name, info in available_models.items():
+        if voice == name or voice == info["config"]["id"]:
+            return info
+    return None
+
+# Warm worker pool settings
+PIPER_IDLE_TIMEOUT = float(os.environ.get("PIPER_IDLE_TIMEOUT", "600"))
+# How piper hands audio back: "raw" (PCM on stdout, no disk) or "wav" (temp files)
+PIPER_OUTPUT = os.environ.get("PIPER_OUTPUT", "raw")
+# Synthesis backend: "subprocess" (piper executable) or "onnx" (in-process onnxruntime)
+SYNTHESIS_BACKEND = os.environ.get("SYNTHESIS_BACKEND", "subprocess")
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", str(PIPER_RUNTIME["threads"])))
+ONNX_INTER_OP_THREADS = int(os.environ.get("ONNX_INTER_OP_THREADS", "0"))
+ONNX_MAX_BATCH_SIZE = int(os.environ.get("ONNX_MAX_BATCH_SIZE", "8"))
+ONNX_BATCH_WAIT_MS = float(os.environ.get("ONNX_BATCH_WAIT_MS", "10"))
+# Max sentences being synthesized at the same time
+SYNTHESIS_MAX_IN_FLIGHT = int(os.environ.get("SYNTHESIS_MAX_IN_FLIGHT", str(os.cpu_count() or 4)))
+# Max piper processes per voice, so one voice's sentences can run in
+# parallel. They are only started when that many sentences of the voice are
+# waiting, and each one holds its own copy of the model in memory.
+PIPER_WORKERS_PER_VOICE = int(os.environ.get(
+    "PIPER_WORKERS_PER_VOICE", str(min(SYNTHESIS_MAX_IN_FLIGHT, os.cpu_count() or 4))
+))
+
+# Max sentences synthesized at the same time by the whole process, across
+# all sessions and API requests
+SYNTHESIS_MAX_CONCURRENCY = int(os.environ.get("SYNTHESIS_MAX_CONCURRENCY", str(os.cpu_count() or 4)))
+
+# Background synthesis of text while it is being edited: sentences
+# synthesized at the same time (0 turns it off), and the longest text that
+# is also synthesized as a whole for "Generate Audio"
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "1"))
+PREFETCH_WHOLE_TEXT_MAX_CHARS = int(os.environ.get("PREFETCH_WHOLE_TEXT_MAX_CHARS", "1000"))
+# Prefetching never takes the last synthesis slot, so a click on a generate
+# button always finds one free (with a single slot there is no prefetching)
+PREFETCH_MAX_RUNNING = min(PREFETCH_WORKERS, max(0, SYNTHESIS_MAX_CONCURRENCY - 1))
+
+# Voices synthesized at the same time by "Generate in All Voices"
+ALL_VOICES_MAX_PARALLEL = int(os.environ.get("ALL_VOICES_MAX_PARALLEL", str(os.cpu_count() or 4)))
+
+# How often the models directory is checked for added/changed voices
+VOICE_REGISTRY_REFRESH_SECONDS = float(os.environ.get("VOICE_REGISTRY_REFRESH_SECONDS", "10"))
+
+# Synthesis cache settings
+SYNTHESIS_CACHE_DIR = Path(os.environ.get("SYNTHESIS_CACHE_DIR", Path(tempfile.gettempdir()) / "piper_tts_cache"))
+SYNTHESIS_CACHE_MEMORY_MB = int(os.environ.get("SYNTHESIS_CACHE_MEMORY_MB", "256"))
+SYNTHESIS_CACHE_DISK_MB = int(os.environ.get("SYNTHESIS_CACHE_DISK_MB", "2048"))
+
+# Shared store for the audio sessions keep between reruns
+AUDIO_STORE_DIR = Path(os.environ.get("AUDIO_STORE_DIR", Path(tempfile.gettempdir()) / "piper_tts_sessions"))
+AUDIO_STORE_MEMORY_MB = int(os.environ.get("AUDIO_STORE_MEMORY_MB", "256"))
+AUDIO_STORE_DISK_MB = int(os.environ.get("AUDIO_STORE_DISK_MB", "4096"))
+
+_resource_lock = threading.RLock()
+
+def shared_resource(func):
+    # Create the object once per process and hand out the same instance
+    # afterwards (the Streamlit-free equivalent of st.cache_resource)
+    instance = []
+
+    @wraps(func)
+    def get():
+        with _resource_lock:
+            if not instance:
+                instance.append(func())
+            return instance[0]
+    return get
+
+# The piper binary this host runs, picked once per process (None if no
+# configured binary works)
+@shared_resource
+def get_piper_binary():
+    model_info = find_voice(get_available_models()) if PIPER_SELF_TEST else None
+    binary = select_binary(PIPER_RUNTIME, model_info["path"] if model_info else None, PIPER_OUTPUT != "wav")
+    for result in PIPER_RUNTIME["self_test"]:
+        if binary is not None and result["name"] == binary["name"]:
+            METRICS.set_gauge("piper_self_test_real_time_factor", result["real_time_factor"])
+    return binary
+
+# One pool per process, shared across Streamlit sessions/reruns and API requests
+@shared_resource
+def get_piper_pool():
+    binary = get_piper_binary()
+    if binary is None:
+        raise RuntimeError("No working piper binary")
+    return PiperPool(
+        binary["path"],
+        cwd=binary["path"].parent,
+        workers_per_voice=PIPER_WORKERS_PER_VOICE,
+        idle_timeout=PIPER_IDLE_TIMEOUT,
+        output_raw=PIPER_OUTPUT != "wav",
+        extra_args=binary["args"],
+        env=binary["env"],
+        slots=get_synthesis_slots()
+    )
+
+# Backends keep their processes/sessions loaded for the life of the process
+@shared_resource
+def get_synthesis_backend():
+    if SYNTHESIS_BACKEND == "onnx":
+        return OnnxBackend(
+            intra_op_threads=ONNX_INTRA_OP_THREADS,
+            inter_op_threads=ONNX_INTER_OP_THREADS,
+            max_batch_size=ONNX_MAX_BATCH_SIZE,
+            batch_wait=ONNX_BATCH_WAIT_MS / 1000,
+            # Use the configured espeak-ng data, or the data shipped with piper if it's there
+            espeak_data_path=PIPER_RUNTIME["espeak_data"] or (
+                PIPER_DIR / "espeak-ng-data" if (PIPER_DIR / "espeak-ng-data").exists() else None
+            ),
+            slots=get_synthesis_slots()
+        )
+    return SubprocessBackend(get_piper_pool())
+
+# Identical sentences being synthesized right now, and the slots that keep
+# the total number of syntheses at SYNTHESIS_MAX_CONCURRENCY
+@shared_resource
+def get_synthesis_flights():
+    return SingleFlight()
+
+@shared_resource
+def get_synthesis_slots():
+    return threading.BoundedSemaphore(max(1, SYNTHESIS_MAX_CONCURRENCY))
+
+def synthesis_slots_busy():
+    # Whether every synthesis slot is taken (probed by taking one and
+    # handing it straight back)
+    slots = get_synthesis_slots()
+    if not slots.acquire(blocking=False):
+        return True
+    slots.release()
+    return False
+
+@shared_resource
+def get_prefetcher():
+    return Prefetcher(
+        lambda text, model_info: metrics.call_in_mode("prefetch", generate_audio, text, model_info),
+        workers=PREFETCH_MAX_RUNNING,
+        busy=synthesis_slots_busy
+    )
+
+@shared_resource
+def get_voice_registry():
+    return VoiceRegistry(MODELS_DIR, VOICE_CONFIGS, refresh_interval=VOICE_REGISTRY_REFRESH_SECONDS)
+
+# Get available models: name -> {"path", "config", "sample_rate", "language", ...}
+def get_available_models():
+    return get_voice_registry().get_available_models()
+
+@shared_resource
+def get_synthesis_cache():
+    return SynthesisCache(
+        SYNTHESIS_CACHE_DIR,
+        memory_budget=SYNTHESIS_CACHE_MEMORY_MB * 1024 * 1024,
+        disk_budget=SYNTHESIS_CACHE_DISK_MB * 1024 * 1024
+    )
+
+# One store per process, shared by every session
+@shared_resource
+def get_audio_store():
+    return AudioStore(
+        AUDIO_STORE_DIR,
+        memory_budget=AUDIO_STORE_MEMORY_MB * 1024 * 1024,
+        disk_budget=AUDIO_STORE_DISK_MB * 1024 * 1024
+    )
+
+def synthesis_cache_key(text, model_info, params=None):
+    return get_synthesis_cache().make_key(
+        model_info["config"]["id"], model_info["path"], text,
+        {"backend": get_synthesis_backend().name, **(params or {})}
+    )
+
+def generate_audio(text, model_info, params=None):
+    voice_id = model_info["config"]["id"]
+    try:
+        # Unchanged sentences are served from the cache
+        backend = get_synthesis_backend()
+        cache = get_synthesis_cache()
+        with METRICS.span("cache_lookup", voice_id):
+            cache_key = synthesis_cache_key(text, model_info, params)
+            audio_bytes = cache.get(cache_key)
+        if audio_bytes is not None:
+            METRICS.inc("cache_hits", voice=voice_id)
+            return audio_bytes
+
+        # The same sentence already being synthesized for someone else (another
+        # session, a double click) is waited for instead of synthesized twice
+        audio_bytes, shared = get_synthesis_flights().do(
+            cache_key, _synthesize, backend, cache, cache_key, text, model_info, params
+        )
+        if shared:
+            METRICS.inc("coalesced", voice=voice_id)
+        return audio_bytes
+    except Exception as e:
+        METRICS.inc("errors", voice=voice_id)
+        return None
+
+def _synthesize(backend, cache, cache_key, text, model_info, params):
+    voice_id = model_info["config"]["id"]
+    # Model stays loaded in the backend, so it's only loaded once per voice.
+    # The backend takes a synthesis slot once the work actually runs.
+    start = time.perf_counter()
+    audio_bytes = backend.synthesize(text, model_info, params)
+    elapsed = time.perf_counter() - start
+    METRICS.observe("synthesize", elapsed, voice_id)
+    if audio_bytes:
+        fmt, frames = read_wav(audio_bytes)
+        METRICS.record_audio(
+            voice_id, len(audio_bytes), len(frames) // fmt['block_align'], fmt['sample_rate'], elapsed
+        )
+        cache.put(cache_key, audio_bytes)
+    return audio_bytes
+
+def prefetch_text(owner, text, model_info):
+    # Start synthesizing the finished sentences of text being edited in the
+    # background, in the chunks "Generate with Gaps" uses, plus short texts
+    # as a whole for "Generate Audio". Replaces owner's earlier prefetch;
+    # cached sentences are skipped. Returns the number of sentences queued.
+    if PREFETCH_MAX_RUNNING <= 0 or not text.strip():
+        return 0
+    texts = [chunk["text"] for chunk in finished_chunks(text)]
+    if len(text) <= PREFETCH_WHOLE_TEXT_MAX_CHARS:
+        texts.append(text)
+    try:
+        cache = get_synthesis_cache()
+        jobs = []
+        for sentence in texts:
+            key = synthesis_cache_key(sentence, model_info)
+            if key not in cache:
+                jobs.append((key, sentence, model_info))
+    except Exception:
+        return 0
+    return get_prefetcher().submit(owner, jobs)
+
+def iter_synthesize_sentences(jobs, max_in_flight=None, cancel_event=None, on_progress=None, mode=None):
+    # Synthesize (sentence, model_info) jobs in parallel and yield the audio
+    # in the original order (None for failed sentences) as soon as it's ready.
+    # `mode` labels the metrics recorded in the worker threads (defaults to
+    # the caller's mode).
+    max_in_flight = max(1, max_in_flight or SYNTHESIS_MAX_IN_FLIGHT)
+    cancel_event = cancel_event or threading.Event()
+    mode = mode or metrics.current_mode()
+    if not jobs:
+        return
+
+    def run(sentence, model_info):
+        if cancel_event.is_set():
+            return None
+        return metrics.call_in_mode(mode, generate_audio, sentence, model_info)
+
+    executor = ThreadPoolExecutor(max_workers=min(max_in_flight, len(jobs)))
+    in_flight = deque()
+    next_job = 0
+    yielded = 0
+    reported = 0
+
+    def report():
+        nonlocal reported
+        completed = yielded + sum(1 for future in in_flight if future.done())
+        if on_progress is not None and completed > reported:
+            reported = completed
+            on_progress(completed, len(jobs))
+
+    try:
+        while yielded < len(jobs):
+            # Keep at most max_in_flight sentences submitted but not yet consumed
+            while next_job < len(jobs) and len(in_flight) < max_in_flight:
+                in_flight.append(executor.submit(run, *jobs[next_job]))
+                next_job += 1
+            while not in_flight[0].done():
+                wait([future for future in in_flight if not future.done()], return_when=FIRST_COMPLETED)
+                report()
+            report()
+            audio_bytes = in_flight.popleft().result()
+            yielded += 1
+            yield audio_bytes
+    finally:
+        # Runs when the consumer stops early too (Streamlit interrupting the
+        # script, or a stream listener going away): cancel the rest
+        if yielded < len(jobs):
+            cancel_event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def synthesize_sentences(jobs, max_in_flight=None, cancel_event=None, on_progress=None):
+    # Same as iter_synthesize_sentences but collects everything; on_progress
+    # is called from the calling thread as each sentence completes
+    return list(iter_synthesize_sentences(jobs, max_in_flight, cancel_event, on_progress))
+
+def iter_generate_all_voices(text, available_models, max_parallel=None):
+    # Synthesize the text in every voice concurrently, yielding
+    # (voice name, model_info, audio bytes or None) as each voice finishes.
+    # A failing voice only yields None and doesn't hold up the others.
+    if not available_models:
+        return
+    max_parallel = max(1, max_parallel or ALL_VOICES_MAX_PARALLEL)
+    executor = ThreadPoolExecutor(max_workers=min(max_parallel, len(available_models)))
+    start = time.perf_counter()
+    try:
+        futures = {
+            executor.submit(metrics.call_in_mode, "all-voices", generate_audio, text, info): (name, info)
+            for name, info in available_models.items()
+        }
+        for future in as_completed(futures):
+            name, info = futures[future]
+            try:
+                audio_bytes = future.result()
+            except Exception:
+                audio_bytes = None
+            yield name, info, audio_bytes
+        METRICS.observe("request", time.perf_counter() - start, mode="all-voices")
+    finally:
+        # Consumer stopped early (e.g. the Streamlit script was interrupted)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def generate_mixed_voices_audio(text, on_progress=None, cancel_event=None):
+    # One entry per sentence with its audio as synthesized; post-processing
+    # is left to the final join (concat_wavs) so it's applied only once
+    with metrics.mode("mixed"), METRICS.span("request"):
+        return _generate_mixed_voices_audio(text, on_progress, cancel_event)
+
+def _generate_mixed_voices_audio(text, on_progress, cancel_event):
+    chunks = chunk_text(text)
+    if not chunks:
+        return None
+    
+    # Get list of available models in the same order as VOICE_CONFIGS
+    available_models = get_available_models()
+    ordered_models = []
+    for voice in VOICE_CONFIGS:
+        if voice["name"] in available_models:
+            ordered_models.append((voice["name"], available_models[voice["name"]]))
+    
+    if not ordered_models:
+        return None
+    
+    # Use voices in sequence, looping back to the start if needed. A long
+    # sentence split into several chunks keeps one voice.
+    groups = group_chunks(chunks)
+    group_voices = [ordered_models[i % len(ordered_models)] for i in range(len(groups))]
+    
+    # Generate audio for all chunks in parallel, results come back in order
+    audios = iter(synthesize_sentences(
+        [(chunk["text"], voice_info) for group, (_, voice_info) in zip(groups, group_voices) for chunk in group],
+        cancel_event=cancel_event,
+        on_progress=on_progress
+    ))
+    
+    sentence_audios = []
+    for group, (voice_name, voice_info) in zip(groups, group_voices):
+        pieces = [audio for audio in (next(audios) for _ in group) if audio]
+        if not pieces:
+            continue
+        start, end = group[0]["start"], group[-1]["end"]
+        sentence_audios.append({
+            "sentence": " ".join(text[start:end].split()),
+            "audio": concat_wavs(pieces, gap_seconds=0, postprocess=False),
+            "voice": voice_name,
+            "config": voice_info["config"],
+            "start": start,
+            "end": end
+        })
+    
+    return sentence_audios
+
+def create_silence(duration_seconds, sample_rate, num_channels):
+    # Create silence as a numpy array
+    num_samples = int(duration_seconds * sample_rate)
+    return np.zeros(num_samples * num_channels, dtype=np.int16)
+
+def stream_single_voice_with_gaps(text, model_info, gap_seconds=1.0, cancel_event=None, audio_format="wav", bitrate_kbps=None,
+                                  postprocess=None):
+    # Generator version of generate_single_voice_with_gaps: yields the WAV
+    # header, then each sentence's PCM (with silence in between) as soon as
+    # that sentence is synthesized. Streamable compressed formats yield
+    # whatever the encoder has produced after each sentence instead.
+    if audio_format != "wav":
+        yield from _stream_encoded(text, model_info, gap_seconds, cancel_event, audio_format, bitrate_kbps, postprocess)
+        return
+    chunks = chunk_text(text)
+    # The registry knows the voice's sample rate, so the header can go out
+    # before anything is synthesized
+    sample_rate = model_info.get("sample_rate")
+    if sample_rate:
+        yield wav_header(sample_rate, 1, 2)
+    processor = None
+    silences = {}
+    start = time.perf_counter()
+    jobs = [(chunk["text"], model_info) for chunk in chunks]
+    audios = iter_synthesize_sentences(jobs, cancel_event=cancel_event, mode="gaps")
+    for gap, audio_bytes in zip(chunk_gaps(chunks, gap_seconds), audios):
+        if not audio_bytes:
+            continue
+        fmt, frames = read_wav(audio_bytes)
+        if processor is None:
+            METRICS.observe("first_audio", time.perf_counter() - start, model_info["config"]["id"], mode="gaps")
+            if sample_rate is None:
+                sample_rate = fmt['sample_rate']
+                yield wav_header(sample_rate, 1, 2)
+            processor = make_postprocessor(postprocess, sample_rate)
+            # Nothing goes before the first sentence
+            gap = 0
+        with METRICS.span("postprocess", model_info["config"]["id"]):
+            pieces = processor.feed(frames, fmt['sample_rate'], gap)
+        for piece, piece_gap in pieces:
+            if piece_gap:
+                if piece_gap not in silences:
+                    silences[piece_gap] = create_silence(piece_gap, sample_rate, 1).tobytes()
+                yield silences[piece_gap]
+            yield piece
+    if processor is not None:
+        for piece, _ in processor.flush():
+            yield piece
+
+def _stream_encoded(text, model_info, gap_seconds, cancel_event, audio_format, bitrate_kbps, postprocess):
+    chunks = chunk_text(text)
+    encoder = None
+    start = time.perf_counter()
+    jobs = [(chunk["text"], model_info) for chunk in chunks]
+    audios = iter_synthesize_sentences(jobs, cancel_event=cancel_event, mode="gaps")
+    for gap, audio_bytes in zip(chunk_gaps(chunks, gap_seconds), audios):
+        if not audio_bytes:
+            continue
+        fmt, frames = read_wav(audio_bytes)
+        if encoder is None:
+            METRICS.observe("first_audio", time.perf_counter() - start, model_info["config"]["id"], mode="gaps")
+            encoder = StreamEncoder(audio_format, fmt['sample_rate'], gap_seconds=gap_seconds, bitrate_kbps=bitrate_kbps)
+            processor = make_postprocessor(postprocess, encoder_sample_rate(audio_format, fmt['sample_rate']))
+        with METRICS.span("postprocess", model_info["config"]["id"]):
+            pieces = processor.feed(frames, fmt['sample_rate'], gap)
+        with METRICS.span("encode", model_info["config"]["id"]):
+            encoded = b"".join(encoder.add(piece, processor.sample_rate, piece_gap) for piece, piece_gap in pieces)
+        yield encoded
+    if encoder is not None:
+        for piece, piece_gap in processor.flush():
+            encoder.add(piece, processor.sample_rate, piece_gap)
+        yield encoder.close()
+
+def generate_single_voice_with_gaps(text, model_info, gap_seconds=1.0, on_progress=None, cancel_event=None, output=None,
+                                    audio_format="wav", bitrate_kbps=None, postprocess=None, timing=None):
+    # Joined audio bytes (or `output` path/file if given), None if nothing
+    # was synthesized. Compressed formats are encoded as the sentences arrive.
+    # `postprocess` is passed on to concat_wavs. A `timing` list gets the
+    # sentence index of the output (see timing.py).
+    chunks = chunk_text(text)
+    if not chunks:
+        return None
+        
+    # Generate audio for all chunks in parallel and write each one into
+    # the output as soon as it's next in order
+    with metrics.mode("gaps"), METRICS.span("request", model_info["config"]["id"]):
+        audios = iter_synthesize_sentences(
+            [(chunk["text"], model_info) for chunk in chunks],
+            cancel_event=cancel_event,
+            on_progress=on_progress
+        )
+        timings = [] if timing is not None else None
+        result = concat_wavs(
+            audios,
+            output=output,
+            gap_seconds=gap_seconds,
+            gaps=chunk_gaps(chunks, gap_seconds),
+            audio_format=audio_format,
+            bitrate_kbps=bitrate_kbps,
+            postprocess=postprocess,
+            timings=timings
+        )
+    if timing is not None and result is not None:
+        timing.extend(build_index(text, chunks, timings))
+    return result
+
+def runtime_info():
+    # What this process synthesizes with, for health checks and the UI
+    binary = get_piper_binary() if SYNTHESIS_BACKEND != "onnx" else None
+    return {
+        "host": PIPER_RUNTIME["host"],
+        "backend": SYNTHESIS_BACKEND,
+        "binary": binary["name"] if binary else None,
+        "binary_path": str(binary["path"]) if binary else None,
+        "models_dir": str(MODELS_DIR),
+        # Only set for the onnx backend; piper executables size their own
+        "threads": ONNX_INTRA_OP_THREADS if SYNTHESIS_BACKEND == "onnx" else None,
+        "config": str(PIPER_RUNTIME["config_path"]) if PIPER_RUNTIME["config_path"] else None,
+        "self_test": PIPER_RUNTIME["self_test"],
+        "problems": runtime_problems(PIPER_RUNTIME)
+    }
+
+def check_runtime():
+    # Error message if synthesis can't run on this machine, otherwise None
+    if not MODELS_DIR.exists():
+        return f"Voice models directory not found at {MODELS_DIR} (set PIPER_MODELS_DIR or PIPER_DIR)"
+    if SYNTHESIS_BACKEND == "onnx":
+        try:
+            get_synthesis_backend()
+        except ImportError as e:
+            return str(e)
+    elif get_piper_binary() is None:
+        problems = "; ".join(runtime_problems(PIPER_RUNTIME)) or "no binary configured"
+        return f"No working piper executable on {PIPER_RUNTIME['host']} ({problems}). Set PIPER_DIR or PIPER_BINARY."
+    return None
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def _file_stamp(path):
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def describe_model(voice_json):
+    # The parts of a piper .onnx.json the app needs without loading the model
+    audio = voice_json.get("audio", {})
+    language = voice_json.get("language", {})
+    return {
+        "sample_rate": audio.get("sample_rate", 22050),
+        "quality": audio.get("quality"),
+        "language": language.get("code") or voice_json.get("espeak", {}).get("voice"),
+        "num_speakers": voice_json.get("num_speakers", 1),
+        "speaker_map": voice_json.get("speaker_id_map", {})
+    }
+
+
+def config_from_filename(model_path, details):
+    # Voice entry for a model that isn't in VOICE_CONFIGS. Piper names its
+    # models <language>-<dataset>-<quality>, e.g. de_DE-thorsten-high.onnx
+    voice_id = model_path.name[:-len(".onnx")]
+    parts = voice_id.split("-")
+    dataset = parts[1] if len(parts) >= 3 else voice_id
+    quality = details["quality"] or (parts[-1] if len(parts) >= 3 else "unknown")
+    return {
+        "id": voice_id,
+        "name": f"{dataset.replace('_', ' ').title()} ({quality.replace('_', ' ').title()}, {parts[0] if len(parts) >= 3 else '?'})",
+        "file": model_path.name,
+        "quality": quality,
+        "gender": "unknown"
+    }
+
+
+class VoiceRegistry:
+    # Index of the voice models under models_dir. The directory is scanned at
+    # most once every refresh_interval seconds, and only .onnx.json files
+    # whose size or mtime changed are parsed again, so Streamlit reruns don't
+    # hit the disk. Models listed in voice_configs keep their configured
+    # names and order; any other model found is added after them.
+    def __init__(self, models_dir, voice_configs, refresh_interval=10.0):
+        self.models_dir = Path(models_dir)
+        self.voice_configs = voice_configs
+        self.refresh_interval = refresh_interval
+        self._entries = {}
+        self._models = {}
+        self._last_scan = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self._last_scan is not None and time.monotonic() - self._last_scan < self.refresh_interval:
+                return False
+            self._last_scan = time.monotonic()
+
+            found = {}
+            if self.models_dir.exists():
+                for root, _, files in os.walk(self.models_dir):
+                    for file_name in files:
+                        if file_name.endswith(".onnx") and file_name + ".json" in files:
+                            found[file_name] = Path(root) / file_name
+
+            changed = set(found) != set(self._entries)
+            entries = {}
+            for file_name, model_path in found.items():
+                json_path = model_path.with_suffix(".onnx.json")
+                try:
+                    stamp = (model_path, _file_stamp(model_path), _file_stamp(json_path))
+                except OSError:
+                    continue
+                entry = self._entries.get(file_name)
+                if entry is None or entry["stamp"] != stamp:
+                    try:
+                        with open(json_path, encoding="utf-8") as f:
+                            details = describe_model(json.load(f))
+                    except (OSError, ValueError):
+                        continue
+                    entry = {"stamp": stamp, "path": model_path, "details": details}
+                    changed = True
+                entries[file_name] = entry
+            self._entries = entries
+
+            if changed:
+                self._models = self._build_models()
+            return changed
+
+    def _build_models(self):
+        models = {}
+        configured_files = set()
+        for voice in self.voice_configs:
+            configured_files.add(voice["file"])
+            entry = self._entries.get(voice["file"])
+            if entry is not None:
+                models[voice["name"]] = {"path": entry["path"], "config": voice, **entry["details"]}
+        for file_name in sorted(set(self._entries) - configured_files):
+            entry = self._entries[file_name]
+            config = config_from_filename(entry["path"], entry["details"])
+            if config["name"] in models:
+                config["name"] = f"{config['name']} [{config['id']}]"
+            models[config["name"]] = {"path": entry["path"], "config": config, **entry["details"]}
+        return models
+
+    def get_available_models(self):
+        self.refresh()
+        return dict(self._models)
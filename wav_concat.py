@@ -0,0 +1,239 @@
+import io
+import struct
+from pathlib import Path
+
+from encoders import EncodedConcatenator, encoder_sample_rate
+from metrics import METRICS
+from postprocess import make_postprocessor
+from resample import resample_pcm16
+
+WAV_HEADER_SIZE = 44
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def wav_header(sample_rate, num_channels, sampwidth, data_size=None):
+    # Canonical 44-byte PCM header; data_size=None is for streams of unknown length
+    if data_size is None:
+        riff_size = data_size = _UNKNOWN_SIZE
+    else:
+        riff_size = 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", riff_size, b"WAVE",
+        b"fmt ", 16, 1, num_channels, sample_rate,
+        sample_rate * num_channels * sampwidth, num_channels * sampwidth, sampwidth * 8,
+        b"data", data_size
+    )
+
+
+def read_wav(wav_bytes):
+    # Parse a PCM WAV without copying the audio: returns the format and a
+    # memoryview over the frames inside wav_bytes
+    view = memoryview(wav_bytes)
+    if bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Not a WAV file")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(view):
+        chunk_id = bytes(view[offset:offset + 4])
+        chunk_size = int.from_bytes(view[offset + 4:offset + 8], "little")
+        body = offset + 8
+        if chunk_id == b"fmt ":
+            _, channels, sample_rate, _, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            fmt = {
+                'sample_rate': sample_rate,
+                'channels': channels,
+                'sampwidth': bits // 8,
+                'block_align': block_align
+            }
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before fmt chunk")
+            # Streamed WAVs carry a placeholder size; clamp to whole frames
+            end = min(body + chunk_size, len(view))
+            end -= (end - body) % fmt['block_align']
+            return fmt, view[body:end]
+        offset = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file has no data chunk")
+
+
+class WavConcatenator:
+    # Writes PCM segments with silence gaps straight into `output` (a path or
+    # a seekable binary file) in a single pass. The header is written with a
+    # placeholder size and patched once on close(), so only the segment
+    # currently being written is ever held in memory.
+    def __init__(self, output, sample_rate, num_channels=1, sampwidth=2, gap_seconds=1.0):
+        self._owns_file = isinstance(output, (str, Path))
+        self.file = open(output, 'wb') if self._owns_file else output
+        self.sample_rate = sample_rate
+        self.num_channels = num_channels
+        self.sampwidth = sampwidth
+        self.block_align = num_channels * sampwidth
+        self.data_size = 0
+        self.segments = 0
+        self._start = self.file.tell()
+        self.file.write(wav_header(sample_rate, num_channels, sampwidth, 0))
+        # One shared silence buffer per gap length
+        self.gap_seconds = gap_seconds
+        self._silences = {}
+
+    def _write(self, frames):
+        self.file.write(frames)
+        self.data_size += len(frames)
+
+    def _silence(self, gap_seconds):
+        num_frames = int(gap_seconds * self.sample_rate)
+        silence = self._silences.get(num_frames)
+        if silence is None:
+            silence = self._silences[num_frames] = memoryview(bytes(num_frames * self.block_align))
+        return silence
+
+    def add(self, frames, sample_rate=None, gap_seconds=None):
+        # gap_seconds overrides the default gap before this segment
+        if self.segments:
+            silence = self._silence(self.gap_seconds if gap_seconds is None else gap_seconds)
+            if len(silence):
+                self._write(silence)
+        if sample_rate and sample_rate != self.sample_rate:
+            frames = memoryview(resample_pcm16(frames, sample_rate, self.sample_rate, self.num_channels)).cast('B')
+        self._write(frames)
+        self.segments += 1
+
+    def add_wav(self, wav_bytes):
+        fmt, frames = read_wav(wav_bytes)
+        self.add(frames, fmt['sample_rate'])
+
+    @property
+    def num_frames(self):
+        return self.data_size // self.block_align
+
+    @classmethod
+    def reopen(cls, path, data_size, segments, gap_seconds=1.0):
+        # Continue a WAV written by an earlier concatenator. Anything after
+        # the first data_size bytes of audio (a segment that was only partly
+        # written) is dropped.
+        file = open(path, 'r+b')
+        try:
+            fmt, _ = read_wav(file.read(WAV_HEADER_SIZE))
+        except ValueError:
+            file.close()
+            raise
+        concatenator = cls.__new__(cls)
+        concatenator._owns_file = True
+        concatenator.file = file
+        concatenator.sample_rate = fmt['sample_rate']
+        concatenator.num_channels = fmt['channels']
+        concatenator.sampwidth = fmt['sampwidth']
+        concatenator.block_align = fmt['block_align']
+        concatenator.data_size = data_size
+        concatenator.segments = segments
+        concatenator._start = 0
+        concatenator.gap_seconds = gap_seconds
+        concatenator._silences = {}
+        file.truncate(WAV_HEADER_SIZE + data_size)
+        file.seek(WAV_HEADER_SIZE + data_size)
+        return concatenator
+
+    def checkpoint(self):
+        # Patch the header and flush, so the file is a valid WAV of
+        # everything written so far
+        end = self.file.tell()
+        self.file.seek(self._start)
+        self.file.write(wav_header(self.sample_rate, self.num_channels, self.sampwidth, self.data_size))
+        self.file.seek(end)
+        self.file.flush()
+
+    def close(self):
+        self.checkpoint()
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def concat_wavs(wavs, output=None, gap_seconds=1.0, gaps=None, audio_format="wav", bitrate_kbps=None,
+                postprocess=None, timings=None):
+    # Join an iterable of WAV byte strings (empty/None entries are skipped)
+    # using the first segment's format. `gaps` optionally gives the silence
+    # before each segment instead of gap_seconds. Segments are trimmed,
+    # normalized and crossfaded on the way (`postprocess`: PostProcessor
+    # options, None for the defaults, False for none). Other `audio_format`s
+    # (see encoders.FORMATS) are encoded segment by segment as they come in.
+    # With output=None the joined audio is returned as bytes; otherwise it is
+    # written to the given path or file, which is returned. Returns None if
+    # there was nothing to join. A `timings` list gets a
+    # {"segment", "start", "end"} entry (seconds) for every segment written.
+    buffer = io.BytesIO() if output is None else None
+    stage = "join" if audio_format == "wav" else "encode"
+    concatenator = None
+    processor = None
+    gaps = iter(gaps) if gaps is not None else None
+    skipped_gap = None
+    for segment, wav_bytes in enumerate(wavs):
+        gap = next(gaps, None) if gaps is not None else None
+        if not wav_bytes:
+            # Keep the gap of a skipped segment for the next one
+            if gap is not None:
+                skipped_gap = gap if skipped_gap is None else max(skipped_gap, gap)
+            continue
+        if skipped_gap is not None and gap is not None:
+            gap, skipped_gap = max(gap, skipped_gap), None
+        # Timed per segment, so waiting on the (possibly lazy) input isn't counted
+        with METRICS.span("wav_parse"):
+            fmt, frames = read_wav(wav_bytes)
+        with METRICS.span("postprocess"):
+            if processor is None:
+                # Segments come out at the rate they are encoded at, so
+                # nothing is resampled piece by piece later on
+                processor = make_postprocessor(
+                    postprocess, encoder_sample_rate(audio_format, fmt['sample_rate']), fmt['channels']
+                )
+            pieces = processor.feed(frames, fmt['sample_rate'], gap_seconds if gap is None else gap)
+        if timings is not None and processor.span is not None:
+            timings.append({
+                "segment": segment,
+                "start": processor.span[0] / processor.sample_rate,
+                "end": processor.span[1] / processor.sample_rate
+            })
+        with METRICS.span(stage):
+            if concatenator is None:
+                if audio_format == "wav":
+                    concatenator = WavConcatenator(
+                        buffer if buffer is not None else output,
+                        fmt['sample_rate'],
+                        fmt['channels'],
+                        fmt['sampwidth'],
+                        gap_seconds
+                    )
+                else:
+                    concatenator = EncodedConcatenator(
+                        buffer if buffer is not None else output,
+                        fmt['sample_rate'],
+                        fmt['channels'],
+                        fmt['sampwidth'],
+                        gap_seconds,
+                        audio_format,
+                        bitrate_kbps
+                    )
+            for piece, piece_gap in pieces:
+                concatenator.add(piece, processor.sample_rate, piece_gap)
+
+    if concatenator is None:
+        return None
+    with METRICS.span(stage):
+        for piece, piece_gap in processor.flush():
+            concatenator.add(piece, processor.sample_rate, piece_gap)
+        concatenator.close()
+    return buffer.getvalue() if buffer is not None else output
+
+
+def encode_wav(wav_bytes, audio_format="wav", bitrate_kbps=None):
+    # One WAV in another output format
+    if audio_format == "wav" or not wav_bytes:
+        return wav_bytes
+    return concat_wavs([wav_bytes], audio_format=audio_format, bitrate_kbps=bitrate_kbps, postprocess=False)